@@ -0,0 +1,97 @@
+"""
+Бенчмарк памяти: размер контекста диалога до и после компактного формата
+
+Запуск:
+    python benchmarks/context_memory.py --users 100000 --messages 8
+"""
+import argparse
+import gc
+import json
+import random
+import sys
+import tracemalloc
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from models.context import Context  # noqa: E402
+
+
+@dataclass
+class LegacyContext:
+    """Прежняя модель контекста: без __slots__, с полной историей сообщений"""
+    summory: str = ""
+    messages: List[str] = field(default_factory=list)
+
+
+WORDS = (
+    "день рождения коллега начальник любит рыбалку футбол стихи кофе путешествия "
+    "сын дочь внук юбилей свадьба переезд официально игриво хокку проза кот собака"
+).split()
+
+
+def random_text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def build(factory, users: int, messages: int, seed: int) -> tuple[int, dict]:
+    """Создание контекстов и замер выделенной памяти"""
+    rng = random.Random(seed)
+    gc.collect()
+    tracemalloc.start()
+    contexts = {}
+    for user_id in range(users):
+        contexts[user_id] = factory(rng, messages)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current, contexts
+
+
+def legacy_factory(rng: random.Random, messages: int) -> LegacyContext:
+    context = LegacyContext(summory=random_text(rng, 60))
+    for _ in range(messages):
+        context.messages.append(random_text(rng, 25))
+    return context
+
+
+def compact_factory(rng: random.Random, messages: int) -> Context:
+    context = Context(summory=random_text(rng, 60))
+    for _ in range(messages):
+        context.add_message(random_text(rng, 25))
+    return context
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--messages", type=int, default=8, help="сообщений на пользователя")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    legacy_bytes, legacy = build(legacy_factory, args.users, args.messages, args.seed)
+    legacy_sample = [legacy[i] for i in range(min(1000, args.users))]
+    del legacy
+    compact_bytes, compact = build(compact_factory, args.users, args.messages, args.seed)
+    compact_sample = [compact[i] for i in range(min(1000, args.users))]
+
+    json_size = sum(
+        len(json.dumps({"summory": c.summory, "messages": c.messages},
+                       ensure_ascii=False).encode("utf-8"))
+        for c in legacy_sample
+    ) / len(legacy_sample)
+    binary_size = sum(len(c.to_bytes()) for c in compact_sample) / len(compact_sample)
+
+    print(f"Пользователей: {args.users}, сообщений на пользователя: {args.messages}")
+    print(f"{'':28}{'всего, МБ':>12}{'на контекст, Б':>18}")
+    print(f"{'Прежний Context (память)':28}{legacy_bytes / 2**20:>12.1f}"
+          f"{legacy_bytes / args.users:>18.0f}")
+    print(f"{'Компактный Context (память)':28}{compact_bytes / 2**20:>12.1f}"
+          f"{compact_bytes / args.users:>18.0f}")
+    print(f"{'JSON на диске':28}{'':>12}{json_size:>18.0f}")
+    print(f"{'Двоичный формат на диске':28}{'':>12}{binary_size:>18.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,440 @@
+"""
+Локальная замена OpenAI API для бенчмарков
+
+Отвечает на /v1/chat/completions (в том числе потоково и со
+structured output) и /v1/images/generations с задержками из
+логнормального распределения и заданной долей ошибок 429/500.
+Для пакетной генерации поддерживаются /v1/files и /v1/batches
+(Batch API для chat.completions). Счетчики вызовов доступны
+по GET /_stats. Для воспроизводимых сценариев отказов POST /_faults
+задает коды ответов для ближайших вызовов, например
+{"chat:gpt-4o": [500, 500, 429]}: они отдаются по порядку раньше
+случайных ошибок профиля.
+
+Запуск отдельно:
+    python benchmarks/fake_openai.py --port 18081 --chat-latency 0.8 --error-rate 0.02
+"""
+import argparse
+import asyncio
+import base64
+import json
+import math
+import random
+import time
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+from dataclasses import asdict, dataclass
+from typing import Any, AsyncIterator, Deque, Dict, Iterable
+
+from aiohttp import web
+
+# Изображение 1x1 PNG для ответов в формате b64_json и по ссылке
+PIXEL_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg=="
+)
+
+WORDS = (
+    "дорогой друг поздравляю от всей души желаю счастья здоровья удачи радости "
+    "тепла любви вдохновения новых свершений улыбок пусть сбываются мечты"
+).split()
+
+
+@dataclass
+class LatencyProfile:
+    """Распределение задержек и ошибок"""
+    chat_latency: float = 0.8  # Медиана задержки ответа чата (до первого токена), сек
+    image_latency: float = 8.0  # Медиана задержки генерации изображения, сек
+    sigma: float = 0.5  # Разброс логнормального распределения (0 - без разброса)
+    token_interval: float = 0.02  # Интервал между фрагментами потокового ответа, сек
+    completion_tokens: int = 120  # Длина ответа в фрагментах (токенах)
+    error_rate: float = 0.0  # Доля ответов с ошибкой
+    rate_limit_share: float = 0.5  # Доля 429 среди ошибок (остальные - 500)
+    retry_after_ms: int = 200  # Значение retry-after-ms в ответах 429
+    batch_latency: float = 5.0  # Задержка завершения пакета Batch API после выполнения запросов, сек
+    speedup: float = 1.0  # Во сколько раз сократить все задержки
+
+    def delay(self, median: float) -> float:
+        if median <= 0:
+            return 0.0
+        value = median * math.exp(random.gauss(0, self.sigma)) if self.sigma else median
+        return value / self.speedup
+
+
+class FakeOpenAI:
+    """aiohttp-приложение, имитирующее OpenAI API"""
+
+    def __init__(self, profile: LatencyProfile):
+        self.profile = profile
+        self.calls: Counter = Counter()
+        self.errors: Counter = Counter()
+        self.tokens: Counter = Counter()
+        self.faults: Dict[str, Deque[int]] = {}
+        self.app = web.Application(client_max_size=16 * 1024 * 1024)
+        self.app.router.add_post("/v1/chat/completions", self.chat)
+        self.app.router.add_post("/v1/images/generations", self.images)
+        self.app.router.add_get("/files/{name}", self.file)
+        self.app.router.add_post("/v1/files", self.upload)
+        self.app.router.add_get("/v1/files/{file_id}/content", self.file_content)
+        self.app.router.add_post("/v1/batches", self.create_batch)
+        self.app.router.add_get("/v1/batches/{batch_id}", self.get_batch)
+        self.files: Dict[str, bytes] = {}
+        self.batches: Dict[str, Dict[str, Any]] = {}
+        self.app.router.add_get("/_stats", self.stats)
+        self.app.router.add_post("/_reset", self.reset)
+        self.app.router.add_post("/_faults", self.set_faults)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "calls": dict(self.calls),
+            "errors": dict(self.errors),
+            "tokens": dict(self.tokens),
+            "faults": {key: list(statuses) for key, statuses in self.faults.items() if statuses},
+            "profile": asdict(self.profile),
+        }
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.snapshot())
+
+    async def reset(self, request: web.Request) -> web.Response:
+        self.calls.clear()
+        self.errors.clear()
+        self.tokens.clear()
+        self.faults.clear()
+        return web.json_response({"ok": True})
+
+    def inject(self, key: str, statuses: Iterable[int]):
+        """Коды ответов для ближайших вызовов key (например, chat:gpt-4o)"""
+        self.faults.setdefault(key, deque()).extend(statuses)
+
+    async def set_faults(self, request: web.Request) -> web.Response:
+        for key, statuses in (await request.json()).items():
+            self.inject(key, statuses)
+        return web.json_response({"ok": True})
+
+    def _error_status(self, key: str) -> int | None:
+        """Код ошибки из заданных отказов или случайный по профилю"""
+        faults = self.faults.get(key)
+        if faults:
+            status = faults.popleft()
+        elif random.random() >= self.profile.error_rate:
+            return None
+        else:
+            status = 429 if random.random() < self.profile.rate_limit_share else 500
+        self.errors[f"{key}:{status}"] += 1
+        return status
+
+    def _error(self, key: str) -> web.Response | None:
+        """Случайная ошибка по профилю"""
+        status = self._error_status(key)
+        if status is None:
+            return None
+        if status == 429:
+            return web.json_response(
+                _error_body(status),
+                status=429,
+                headers={"retry-after-ms": str(self.profile.retry_after_ms)}
+            )
+        return web.json_response(_error_body(status), status=500)
+
+    async def chat(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        model = body.get("model", "")
+        key = f"chat:{model}"
+        self.calls[key] += 1
+        await asyncio.sleep(self.profile.delay(self.profile.chat_latency))
+        error = self._error(key)
+        if error is not None:
+            return error
+
+        contents, usage = self._completion(body)
+        if body.get("stream"):
+            include_usage = (body.get("stream_options") or {}).get("include_usage")
+            return await self._stream(request, model, contents[0], usage if include_usage else None)
+        return web.json_response(_completion_response(model, contents, usage))
+
+    def _completion(self, body: Dict[str, Any]) -> tuple[list[str], Dict[str, int]]:
+        """Тексты ответа и usage для запроса chat.completions"""
+        model = body.get("model", "")
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in body.get("messages", [])) // 4
+        n = body.get("n") or 1
+        response_format = body.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            contents = [json.dumps(_from_schema(response_format["json_schema"]["schema"]), ensure_ascii=False)]
+        else:
+            length = min(self.profile.completion_tokens, body.get("max_tokens") or self.profile.completion_tokens)
+            contents = [" ".join(random.choice(WORDS) for _ in range(length)) for _ in range(n)]
+        completion_tokens = sum(len(content.split()) for content in contents)
+        self.tokens[f"{model}:prompt"] += prompt_tokens
+        self.tokens[f"{model}:completion"] += completion_tokens
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        return contents, usage
+
+    async def _stream(
+        self,
+        request: web.Request,
+        model: str,
+        content: str,
+        usage: Dict[str, int] | None
+    ) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        chunk_id = f"chatcmpl-{random.getrandbits(48):x}"
+
+        async def send(delta: Dict[str, Any] | None, finish_reason=None, chunk_usage=None):
+            chunk = {
+                "id": chunk_id, "object": "chat.completion.chunk",
+                "created": int(time.time()), "model": model,
+                "choices": [] if delta is None else [
+                    {"index": 0, "delta": delta, "finish_reason": finish_reason}
+                ],
+                "usage": chunk_usage,
+            }
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+
+        await send({"role": "assistant", "content": ""})
+        for word in content.split():
+            await send({"content": word + " "})
+            if self.profile.token_interval:
+                await asyncio.sleep(self.profile.token_interval / self.profile.speedup)
+        await send({}, "stop")
+        if usage is not None:
+            # Как в OpenAI: usage приходит отдельным фрагментом без choices
+            await send(None, chunk_usage=usage)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def images(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        model = body.get("model", "")
+        key = f"images:{model}"
+        self.calls[key] += 1
+        await asyncio.sleep(self.profile.delay(self.profile.image_latency))
+        error = self._error(key)
+        if error is not None:
+            return error
+        if body.get("response_format") == "b64_json":
+            item = {"b64_json": base64.b64encode(PIXEL_PNG).decode("ascii")}
+        else:
+            item = {"url": f"{request.scheme}://{request.host}/files/{random.getrandbits(48):x}.png"}
+        item["revised_prompt"] = body.get("prompt", "")[:200]
+        return web.json_response({"created": int(time.time()), "data": [item]})
+
+    async def file(self, request: web.Request) -> web.Response:
+        self.calls["files"] += 1
+        return web.Response(body=PIXEL_PNG, content_type="image/png")
+
+    async def upload(self, request: web.Request) -> web.Response:
+        """Загрузка входного файла пакета (multipart)"""
+        self.calls["files:upload"] += 1
+        form = await request.post()
+        upload = form["file"]
+        file_id = f"file-{random.getrandbits(48):x}"
+        self.files[file_id] = upload.file.read()
+        return web.json_response(self._file_object(file_id, upload.filename, form.get("purpose", "batch")))
+
+    def _file_object(self, file_id: str, filename: str, purpose: str) -> Dict[str, Any]:
+        return {
+            "id": file_id, "object": "file", "bytes": len(self.files[file_id]),
+            "created_at": int(time.time()), "filename": filename,
+            "purpose": purpose, "status": "processed",
+        }
+
+    async def file_content(self, request: web.Request) -> web.Response:
+        self.calls["files:content"] += 1
+        data = self.files.get(request.match_info["file_id"])
+        if data is None:
+            return web.json_response(_error_body(404), status=404)
+        return web.Response(body=data, content_type="application/octet-stream")
+
+    async def create_batch(self, request: web.Request) -> web.Response:
+        """Создание пакета: запросы выполняются в фоне с задержками профиля"""
+        self.calls["batches:create"] += 1
+        body = await request.json()
+        data = self.files.get(body.get("input_file_id"))
+        if data is None:
+            return web.json_response(_error_body(404), status=404)
+        lines = [json.loads(line) for line in data.decode("utf-8").splitlines() if line.strip()]
+        batch_id = f"batch_{random.getrandbits(48):x}"
+        batch = {
+            "id": batch_id, "object": "batch", "endpoint": body.get("endpoint"),
+            "input_file_id": body["input_file_id"],
+            "completion_window": body.get("completion_window", "24h"),
+            "status": "in_progress", "created_at": int(time.time()),
+            "output_file_id": None, "error_file_id": None, "errors": None,
+            "request_counts": {"total": len(lines), "completed": 0, "failed": 0},
+        }
+        self.batches[batch_id] = batch
+        batch["_task"] = asyncio.create_task(self._run_batch(batch, lines))
+        return web.json_response(_public(batch))
+
+    async def get_batch(self, request: web.Request) -> web.Response:
+        self.calls["batches:get"] += 1
+        batch = self.batches.get(request.match_info["batch_id"])
+        if batch is None:
+            return web.json_response(_error_body(404), status=404)
+        return web.json_response(_public(batch))
+
+    async def _run_batch(self, batch: Dict[str, Any], lines: list[Dict[str, Any]]):
+        """Выполнение запросов пакета и запись файлов результатов и ошибок"""
+        results: list[Dict[str, Any]] = []
+        errors: list[Dict[str, Any]] = []
+        semaphore = asyncio.Semaphore(50)
+        counts = batch["request_counts"]
+
+        async def run_line(line: Dict[str, Any]):
+            async with semaphore:
+                body = line["body"]
+                key = f"batch:{body.get('model', '')}"
+                self.calls[key] += 1
+                await asyncio.sleep(self.profile.delay(self.profile.chat_latency))
+                status = self._error_status(key)
+                result = {"id": f"batch_req_{random.getrandbits(48):x}", "custom_id": line["custom_id"]}
+                if status is None:
+                    contents, usage = self._completion(body)
+                    result["response"] = {
+                        "status_code": 200,
+                        "request_id": f"req_{random.getrandbits(48):x}",
+                        "body": _completion_response(body.get("model", ""), contents, usage),
+                    }
+                    result["error"] = None
+                    results.append(result)
+                    counts["completed"] += 1
+                else:
+                    result["response"] = {"status_code": status, "body": _error_body(status)}
+                    result["error"] = None
+                    errors.append(result)
+                    counts["failed"] += 1
+
+        await asyncio.gather(*(run_line(line) for line in lines))
+        await asyncio.sleep(self.profile.batch_latency / self.profile.speedup)
+        for name, rows in (("output_file_id", results), ("error_file_id", errors)):
+            if rows:
+                file_id = f"file-{random.getrandbits(48):x}"
+                self.files[file_id] = "".join(
+                    json.dumps(row, ensure_ascii=False) + "\n" for row in rows
+                ).encode("utf-8")
+                batch[name] = file_id
+        batch["status"] = "completed"
+        batch["completed_at"] = int(time.time())
+
+
+def _public(batch: Dict[str, Any]) -> Dict[str, Any]:
+    """Объект пакета без служебных полей"""
+    return {key: value for key, value in batch.items() if not key.startswith("_")}
+
+
+def _error_body(status: int) -> Dict[str, Any]:
+    if status == 429:
+        return {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}}
+    if status == 404:
+        return {"error": {"message": "Not found", "type": "invalid_request_error", "code": None}}
+    return {"error": {"message": "The server had an error", "type": "server_error", "code": None}}
+
+
+def _completion_response(model: str, contents: list[str], usage: Dict[str, int]) -> Dict[str, Any]:
+    """Тело ответа chat.completion"""
+    return {
+        "id": f"chatcmpl-{random.getrandbits(48):x}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [
+            {"index": index, "finish_reason": "stop",
+             "message": {"role": "assistant", "content": content}}
+            for index, content in enumerate(contents)
+        ],
+        "usage": usage,
+    }
+
+
+def _from_schema(schema: Dict[str, Any]) -> Any:
+    """Правдоподобное значение по JSON-схеме structured output"""
+    if "enum" in schema:
+        return random.choice(schema["enum"])
+    types = schema.get("type", "object")
+    if isinstance(types, list):
+        # Поля "без изменений" (null) встречаются чаще заполненных
+        if "null" in types and random.random() < 0.6:
+            return None
+        types = next(t for t in types if t != "null")
+    if types == "object":
+        return {name: _from_schema(sub) for name, sub in schema.get("properties", {}).items()}
+    if types == "array":
+        items = schema.get("items", {})
+        if "enum" in items:
+            return []
+        return [_from_schema(items) for _ in range(random.randint(1, 3))]
+    if types in ("integer", "number"):
+        return random.randint(1, 100)
+    if types == "boolean":
+        return random.random() < 0.5
+    return " ".join(random.choice(WORDS) for _ in range(random.randint(1, 4)))
+
+
+@asynccontextmanager
+async def running(
+    profile: LatencyProfile,
+    host: str = "127.0.0.1",
+    port: int = 0
+) -> AsyncIterator[tuple[FakeOpenAI, str]]:
+    """
+    Сервер в текущем цикле событий на время блока
+
+    Yields:
+        tuple: (сервер, base_url для клиента OpenAI); port=0 - свободный порт
+    """
+    fake = FakeOpenAI(profile)
+    runner = web.AppRunner(fake.app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port, backlog=1024)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    try:
+        yield fake, f"http://{host}:{port}/v1"
+    finally:
+        await runner.cleanup()
+
+
+async def serve(host: str, port: int, profile: LatencyProfile, ready=None):
+    """Работа сервера до отмены"""
+    async with running(profile, host, port):
+        if ready is not None:
+            ready.set()
+        await asyncio.Event().wait()
+
+
+def run(host: str, port: int, profile: LatencyProfile, ready=None):
+    """Точка входа отдельного процесса"""
+    try:
+        asyncio.run(serve(host, port, profile, ready))
+    except KeyboardInterrupt:
+        pass
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser):
+    defaults = LatencyProfile()
+    for name, value in asdict(defaults).items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(value), default=value)
+
+
+def profile_from_args(args: argparse.Namespace) -> LatencyProfile:
+    return LatencyProfile(**{name: getattr(args, name) for name in asdict(LatencyProfile())})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18081)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    print(f"Fake OpenAI: http://{args.host}:{args.port}/v1")
+    run(args.host, args.port, profile_from_args(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""
+Локальная замена Telegram Bot API для бенчмарков
+
+Бот подключается к серверу через TELEGRAM_API_URL и получает
+обновления обычным getUpdates. Сценарий бенчмарка отправляет
+сообщения и нажатия кнопок от имени пользователей и ждет ответов
+бота в их чатах.
+"""
+import asyncio
+import json
+import random
+import time
+from collections import Counter, deque
+from dataclasses import dataclass
+from itertools import islice
+from typing import Any, Callable, Dict, Optional
+
+from aiohttp import web
+
+BOT_ID = 100000
+
+
+@dataclass
+class BotEvent:
+    """Вызов Bot API, адресованный чату"""
+    method: str
+    chat_id: int
+    text: str
+    time: float
+    message_id: int = 0
+
+
+class FakeTelegram:
+    """aiohttp-приложение, имитирующее Bot API"""
+
+    def __init__(self, api_latency: float = 0.0):
+        """
+        Args:
+            api_latency: задержка ответа на каждый вызов, сек
+        """
+        self.api_latency = api_latency
+        self.calls: Counter = Counter()
+        self.uploads = 0
+        self.updates_sent = 0
+        self._updates: deque = deque()
+        self._new_updates = asyncio.Event()
+        self._update_id = 0
+        self._message_id = 0
+        self._chats: Dict[int, asyncio.Queue] = {}
+        self.app = web.Application(client_max_size=32 * 1024 * 1024)
+        self.app.router.add_post("/bot{token}/{method}", self.handle)
+
+    # Сторона пользователя
+
+    def events(self, chat_id: int) -> asyncio.Queue:
+        """Очередь вызовов бота в чате пользователя"""
+        queue = self._chats.get(chat_id)
+        if queue is None:
+            queue = self._chats[chat_id] = asyncio.Queue()
+        return queue
+
+    def send_text(self, user_id: int, text: str) -> float:
+        """Сообщение пользователя боту; возвращает время отправки"""
+        self._message_id += 1
+        message = {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": f"user{user_id}"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+            "text": text,
+        }
+        if text.startswith("/"):
+            command = text.split()[0]
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        return self._push({"message": message})
+
+    def send_callback(self, user_id: int, data: str, message_id: int) -> float:
+        """Нажатие inline-кнопки под сообщением бота"""
+        return self._push({"callback_query": {
+            "id": str(random.getrandbits(48)),
+            "chat_instance": str(user_id),
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+            "message": self._message(user_id, "", message_id),
+            "data": data,
+        }})
+
+    def _push(self, payload: Dict[str, Any]) -> float:
+        self._update_id += 1
+        self._updates.append({"update_id": self._update_id, **payload})
+        self.updates_sent += 1
+        self._new_updates.set()
+        return time.perf_counter()
+
+    # Сторона бота
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        params = await _params(request)
+        if self.api_latency and method != "getUpdates":
+            await asyncio.sleep(self.api_latency)
+        handler: Optional[Callable] = getattr(self, f"_{method}", None)
+        result = await handler(params) if handler else True
+        return web.json_response({"ok": True, "result": result})
+
+    async def _getMe(self, params):
+        return {"id": BOT_ID, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+    async def _getUpdates(self, params):
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+        while self._updates and self._updates[0]["update_id"] < offset:
+            self._updates.popleft()
+        if not self._updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return list(islice(self._updates, limit))
+
+    async def _sendMessage(self, params):
+        chat_id = int(params["chat_id"])
+        message = self._message(chat_id, params.get("text", ""))
+        self._emit("sendMessage", chat_id, message["text"], message["message_id"])
+        return message
+
+    async def _editMessageText(self, params):
+        chat_id = int(params["chat_id"])
+        message = self._message(chat_id, params.get("text", ""), int(params["message_id"]))
+        self._emit("editMessageText", chat_id, message["text"], message["message_id"])
+        return message
+
+    async def _sendPhoto(self, params):
+        chat_id = int(params["chat_id"])
+        photo = params.get("photo")
+        if isinstance(photo, web.FileField):
+            self.uploads += 1
+        message = self._message(chat_id, "")
+        message.pop("text")
+        if params.get("caption"):
+            message["caption"] = params["caption"]
+        file_id = f"photo-{message['message_id']}"
+        message["photo"] = [{"file_id": file_id, "file_unique_id": file_id, "width": 1024, "height": 1024}]
+        self._emit("sendPhoto", chat_id, params.get("caption", ""), message["message_id"])
+        return message
+
+    async def _sendDocument(self, params):
+        chat_id = int(params["chat_id"])
+        message = self._message(chat_id, "")
+        message.pop("text")
+        document = params.get("document")
+        file_id = f"document-{message['message_id']}"
+        message["document"] = {
+            "file_id": file_id, "file_unique_id": file_id,
+            "file_name": getattr(document, "filename", None) or "document",
+        }
+        self._emit("sendDocument", chat_id, params.get("caption", ""), message["message_id"])
+        return message
+
+    async def _deleteMessage(self, params):
+        self._emit("deleteMessage", int(params["chat_id"]), "", int(params["message_id"]))
+        return True
+
+    def _message(self, chat_id: int, text: str, message_id: int | None = None) -> Dict[str, Any]:
+        if message_id is None:
+            self._message_id += 1
+            message_id = self._message_id
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": BOT_ID, "is_bot": True, "first_name": "Bench"},
+            "text": text,
+        }
+
+    def _emit(self, method: str, chat_id: int, text: str, message_id: int):
+        self.events(chat_id).put_nowait(BotEvent(method, chat_id, text, time.perf_counter(), message_id))
+
+
+async def _params(request: web.Request) -> Dict[str, Any]:
+    """Параметры вызова: aiogram отправляет multipart/form-data, вложенные объекты - в JSON"""
+    if request.content_type == "application/json":
+        return await request.json()
+    params: Dict[str, Any] = {}
+    for key, value in (await request.post()).items():
+        if isinstance(value, str) and value[:1] in "[{":
+            try:
+                value = json.loads(value)
+            except ValueError:
+                pass
+        params[key] = value
+    # Файл передается отдельной частью, поле ссылается на нее через attach://
+    for key, value in list(params.items()):
+        if isinstance(value, str) and value.startswith("attach://"):
+            params[key] = params.get(value[len("attach://"):], value)
+    return params
+
+
+async def start(host: str, port: int, api_latency: float = 0.0) -> tuple[FakeTelegram, web.AppRunner]:
+    """Запуск сервера в текущем цикле событий"""
+    fake = FakeTelegram(api_latency)
+    runner = web.AppRunner(fake.app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port, backlog=1024).start()
+    return fake, runner
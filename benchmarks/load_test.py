@@ -0,0 +1,348 @@
+"""
+Нагрузочный бенчмарк бота с локальными OpenAI и Telegram
+
+Настоящий create_bot работает с поддельными серверами: N пользователей
+одновременно проходят сценарий /start -> несколько сообщений с описанием
+-> «Создать поздравление» -> текст -> открытка. В отчете - задержки
+этапов (p50/p95/p99), обновлений в секунду, память процесса и число
+вызовов OpenAI. Результат сохраняется в JSON для сравнения коммитов.
+
+Запуск:
+    python benchmarks/load_test.py --users 50 --messages 3 --speedup 10
+    python benchmarks/load_test.py --users 50 --json after.json --compare before.json
+    python benchmarks/load_test.py --env JOB_QUEUE_ENABLED=false --env GREETING_STREAMING=false
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).parent))
+
+import fake_openai  # noqa: E402
+import fake_telegram  # noqa: E402
+from config import DEFAULT_LOG_LEVELS  # noqa: E402
+from utils.logger import setup_logging  # noqa: E402
+
+GENERATE_BUTTON = "✨ Создать поздравление"
+SUMMARY_SUFFIX = "Что-нибудь ещё?"
+# Служебные ответы бота, которые не являются результатом этапа
+SERVICE_PREFIXES = (
+    "⏳", "Генерирую поздравление", "✍️ Пишу поздравление", "Поздравление уже готовится",
+)
+ERROR_MARKERS = ("Произошла ошибка", "перегружен", "Не удалось создать открытку")
+STAGES = ("start", "describe", "generate_ack", "greeting", "card", "session")
+
+DESCRIPTIONS = (
+    "Хочу поздравить {who} с {event}.",
+    "{who} очень любит {hobby}, особенно по выходным.",
+    "Стиль поздравления - {tone}, можно с юмором.",
+    "Зовут {name}, исполняется {age} лет.",
+)
+FILL = {
+    "who": ["коллегу", "маму", "начальника", "друга", "сестру", "дедушку"],
+    "event": ["днем рождения", "юбилеем", "свадьбой", "повышением", "новосельем"],
+    "hobby": ["рыбалку", "футбол", "стихи", "кофе", "путешествия", "шахматы"],
+    "tone": ["официальный", "дружеский", "трогательный", "в стихах"],
+    "name": ["Анна", "Игорь", "Мария", "Сергей", "Ольга", "Павел"],
+    "age": [str(age) for age in range(20, 80)],
+}
+
+
+class SessionError(Exception):
+    def __init__(self, stage: str, reason: str):
+        super().__init__(f"{stage}: {reason}")
+        self.stage = stage
+        self.reason = reason
+
+
+def rss_bytes() -> int:
+    """Текущий RSS процесса"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Перцентиль методом ближайшего ранга"""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=Path(__file__).parent, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+class Scenario:
+    """Сценарии пользователей и сбор задержек"""
+
+    def __init__(self, tg: fake_telegram.FakeTelegram, messages: int, think_time: float, timeout: float):
+        self.tg = tg
+        self.messages = messages
+        self.think_time = think_time
+        self.timeout = timeout
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.failures: Dict[str, int] = defaultdict(int)
+
+    async def user(self, user_id: int, start_delay: float):
+        rng = random.Random(user_id)
+        await asyncio.sleep(start_delay)
+        session_start = time.perf_counter()
+        try:
+            sent = self.tg.send_text(user_id, "/start")
+            await self._expect(user_id, "start", sent, lambda e: e.method == "sendMessage")
+
+            for template in rng.sample(DESCRIPTIONS, k=min(self.messages, len(DESCRIPTIONS))):
+                await self._think(rng)
+                text = template.format(**{key: rng.choice(values) for key, values in FILL.items()})
+                sent = self.tg.send_text(user_id, text)
+                await self._expect(
+                    user_id, "describe", sent,
+                    lambda e: e.method == "sendMessage" and e.text.endswith(SUMMARY_SUFFIX)
+                )
+
+            await self._think(rng)
+            sent = self.tg.send_text(user_id, GENERATE_BUTTON)
+            await self._expect(user_id, "generate_ack", sent, lambda e: e.method != "deleteMessage")
+            event = await self._expect(user_id, "greeting", sent, _is_greeting)
+            if event.method == "sendPhoto":
+                # Открытка с текстом в подписи (без потоковой отправки)
+                self.latencies["card"].append(event.time - sent)
+            else:
+                await self._expect(user_id, "card", sent, lambda e: e.method == "sendPhoto")
+        except SessionError as e:
+            self.failures[e.stage] += 1
+            logging.getLogger(__name__).warning(f"Пользователь {user_id}: {e}")
+            return
+        self.latencies["session"].append(time.perf_counter() - session_start)
+
+    async def _think(self, rng: random.Random):
+        if self.think_time:
+            await asyncio.sleep(rng.uniform(0.5, 1.5) * self.think_time)
+
+    async def _expect(self, user_id, stage, sent, accept) -> fake_telegram.BotEvent:
+        """Ожидание ответа бота, подходящего под этап"""
+        events = self.tg.events(user_id)
+        deadline = sent + self.timeout
+        while True:
+            remaining = deadline - time.perf_counter()
+            try:
+                event = await asyncio.wait_for(events.get(), max(0.0, remaining))
+            except asyncio.TimeoutError:
+                raise SessionError(stage, "timeout")
+            if any(marker in event.text for marker in ERROR_MARKERS):
+                raise SessionError(stage, event.text[:80])
+            if accept(event):
+                self.latencies[stage].append(event.time - sent)
+                return event
+
+
+def _is_greeting(event: fake_telegram.BotEvent) -> bool:
+    """Первый фрагмент текста поздравления (или открытка с подписью)"""
+    if event.method == "sendPhoto":
+        return True
+    if event.method not in ("sendMessage", "editMessageText") or not event.text:
+        return False
+    return not event.text.startswith(SERVICE_PREFIXES)
+
+
+async def fetch_openai_stats(url: str) -> dict:
+    async with httpx.AsyncClient() as client:
+        return (await client.get(f"{url}/_stats")).json()
+
+
+def start_openai(host: str, port: int, profile: fake_openai.LatencyProfile) -> multiprocessing.Process:
+    """Поддельный OpenAI в отдельном процессе, чтобы не делить с ботом цикл событий"""
+    mp = multiprocessing.get_context("spawn")
+    ready = mp.Event()
+    process = mp.Process(target=fake_openai.run, args=(host, port, profile, ready), daemon=True)
+    process.start()
+    if not ready.wait(30):
+        process.terminate()
+        raise RuntimeError("Поддельный OpenAI не запустился")
+    return process
+
+
+def configure_env(args, workdir: str):
+    """Настройки бота: адреса поддельных серверов и отдельный каталог данных"""
+    env = {
+        "TELEGRAM_TOKEN": "123456:BENCHMARK-token-0000000000000000000",
+        "OPENAI_API_KEY": "sk-benchmark",
+        "OPENAI_PROXY_ENABLED": "false",
+        "OPENAI_BASE_URL": f"http://{args.host}:{args.openai_port}/v1",
+        "TELEGRAM_API_URL": f"http://{args.host}:{args.telegram_port}",
+        "CONTEXT_DB_PATH": f"{workdir}/contexts.sqlite3",
+        "RESULT_CACHE_DB_PATH": f"{workdir}/results.sqlite3",
+        "JOB_DB_PATH": f"{workdir}/jobs.sqlite3",
+        "FSM_DB_PATH": f"{workdir}/fsm.sqlite3",
+        # id обновлений поддельного Telegram начинаются с 1 в каждом запуске
+        "UPDATE_DEDUP_DB_PATH": f"{workdir}/updates.sqlite3",
+        "IMAGE_ASSETS_DIR": f"{workdir}/images",
+    }
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    os.environ.update(env)
+
+
+async def run(args) -> dict:
+    from bot.bot import close_services, create_bot
+    from config import load_config
+
+    profile = fake_openai.profile_from_args(args)
+    openai_process = start_openai(args.host, args.openai_port, profile)
+    tg, tg_runner = await fake_telegram.start(args.host, args.telegram_port, args.telegram_latency)
+    with tempfile.TemporaryDirectory(prefix="bench-") as workdir:
+        configure_env(args, workdir)
+        rss_start = rss_bytes()
+        bot, dp = await create_bot(load_config())
+        polling = asyncio.create_task(
+            dp.start_polling(bot, handle_signals=False, close_bot_session=False, polling_timeout=10)
+        )
+        rss_ready = rss_bytes()
+        peak = [rss_ready]
+
+        async def sample_memory():
+            while True:
+                peak[0] = max(peak[0], rss_bytes())
+                await asyncio.sleep(0.2)
+
+        sampler = asyncio.create_task(sample_memory())
+        scenario = Scenario(tg, args.messages, args.think_time, args.timeout)
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            scenario.user(1000 + index, args.ramp * index / max(1, args.users))
+            for index in range(args.users)
+        ))
+        elapsed = time.perf_counter() - started
+        rss_end = rss_bytes()
+        sampler.cancel()
+
+        openai_stats = await fetch_openai_stats(f"http://{args.host}:{args.openai_port}")
+        await dp.stop_polling()
+        await asyncio.gather(polling, return_exceptions=True)
+        await close_services(dp)
+        await bot.session.close()
+    await tg_runner.cleanup()
+    openai_process.terminate()
+    openai_process.join(5)
+
+    return {
+        "revision": git_revision(),
+        "users": args.users,
+        "messages": args.messages,
+        "elapsed": elapsed,
+        "updates": tg.updates_sent,
+        "updates_per_sec": tg.updates_sent / elapsed if elapsed else 0.0,
+        "sessions_ok": len(scenario.latencies["session"]),
+        "failures": dict(scenario.failures),
+        "stages": {
+            stage: {
+                "count": len(values),
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "p99": percentile(values, 99),
+                "max": max(values) if values else float("nan"),
+            }
+            for stage in STAGES
+            for values in [scenario.latencies.get(stage, [])]
+        },
+        "memory": {
+            "rss_start_mb": rss_start / 2 ** 20,
+            "rss_ready_mb": rss_ready / 2 ** 20,
+            "rss_peak_mb": peak[0] / 2 ** 20,
+            "rss_end_mb": rss_end / 2 ** 20,
+        },
+        "openai": openai_stats,
+        "telegram_calls": dict(tg.calls),
+        "telegram_uploads": tg.uploads,
+        "env": args.env,
+    }
+
+
+def report(result: dict, baseline: dict | None = None):
+    print(f"\nРевизия {result['revision'] or '-'}: {result['users']} пользователей, "
+          f"{result['messages']} сообщений, {result['elapsed']:.1f} с")
+    print(f"Сессий без ошибок: {result['sessions_ok']}/{result['users']}, "
+          f"ошибки по этапам: {result['failures'] or 'нет'}")
+    print(f"Обновлений: {result['updates']} ({result['updates_per_sec']:.1f}/с)")
+
+    print(f"\n{'этап':<14}{'n':>6}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}" + ("   p95 было" if baseline else ""))
+    for stage, row in result["stages"].items():
+        line = f"{stage:<14}{row['count']:>6}" + "".join(
+            f"{row[key]:>9.3f}" for key in ("p50", "p95", "p99", "max")
+        )
+        if baseline and stage in baseline.get("stages", {}):
+            old = baseline["stages"][stage]["p95"]
+            change = (row["p95"] / old - 1) * 100 if old else float("nan")
+            line += f"   {old:.3f} ({change:+.0f}%)"
+        print(line)
+
+    memory = result["memory"]
+    print(f"\nПамять (RSS, МБ): до бота {memory['rss_start_mb']:.1f}, после запуска "
+          f"{memory['rss_ready_mb']:.1f}, пик {memory['rss_peak_mb']:.1f}, в конце {memory['rss_end_mb']:.1f}")
+
+    print("\nВызовы OpenAI:")
+    for key, count in sorted(result["openai"]["calls"].items()):
+        old = baseline["openai"]["calls"].get(key) if baseline else None
+        print(f"  {key:<32}{count:>7}" + (f"   было {old}" if old is not None else ""))
+    if result["openai"]["errors"]:
+        print(f"  ошибки: {result['openai']['errors']}")
+    print(f"\nВызовы Bot API: {result['telegram_calls']}, загрузок фото: {result['telegram_uploads']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50, help="число одновременных пользователей")
+    parser.add_argument("--messages", type=int, default=3, help="сообщений с описанием на пользователя (до 4)")
+    parser.add_argument("--ramp", type=float, default=1.0, help="за сколько секунд подключаются все пользователи")
+    parser.add_argument("--think-time", type=float, default=0.0, help="средняя пауза пользователя между сообщениями, сек")
+    parser.add_argument("--timeout", type=float, default=180.0, help="предел ожидания ответа бота, сек")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--openai-port", type=int, default=18081)
+    parser.add_argument("--telegram-port", type=int, default=18082)
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="задержка ответа Bot API, сек")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="переменная окружения бота (можно несколько)")
+    parser.add_argument("--json", help="сохранить результат в файл")
+    parser.add_argument("--compare", help="результат предыдущего запуска для сравнения")
+    parser.add_argument("--log-level", default="WARNING")
+    fake_openai.add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    # Тот же конвейер журнала, что у бота: запись в отдельном потоке
+    setup_logging(level=args.log_level, module_levels=DEFAULT_LOG_LEVELS)
+    result = asyncio.run(run(args))
+    baseline = json.loads(Path(args.compare).read_text()) if args.compare else None
+    report(result, baseline)
+    if args.json:
+        Path(args.json).write_text(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Пакетная генерация поздравлений из CSV или JSONL
+
+Запуск:
+    python src/batch.py people.csv -o greetings.jsonl
+    python src/batch.py people.jsonl -o greetings.jsonl --images
+    python src/batch.py people.csv -o greetings.jsonl --openai-batch
+
+Каждая входная запись - один человек: колонка id (необязательно)
+и произвольные поля с фактами. Результаты дописываются в JSONL по мере
+готовности; повторный запуск с тем же файлом результатов продолжает
+работу: готовые записи пропускаются, записи с ошибкой обрабатываются снова.
+"""
+import argparse
+import asyncio
+import logging
+import sys
+from pathlib import Path
+
+# Добавляем корневую директорию проекта в PYTHONPATH
+sys.path.append(str(Path(__file__).parent.parent))
+
+from src.bot.bot import create_ai_service, create_image_assets, create_scheduler
+from src.config import load_config
+# Без префикса src: те же модули, что используют сервисы бота
+from services.bulk import BatchApiGenerator, BulkGenerator, BulkOutput, read_items
+from services.content_generator import ContentGenerator
+from utils.logger import setup_logging_from_config
+
+logger = logging.getLogger(__name__)
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="CSV с заголовком или JSONL с записями")
+    parser.add_argument("-o", "--output", help="файл результатов JSONL (по умолчанию: <input>.greetings.jsonl)")
+    parser.add_argument("--concurrency", type=int, help="одновременно обрабатываемых записей (BATCH_CONCURRENCY)")
+    parser.add_argument("--images", action="store_true", help="генерировать изображения")
+    parser.add_argument("--openai-batch", action="store_true", help="отправить запросы через OpenAI Batch API")
+    parser.add_argument("--poll-interval", type=float, help="интервал опроса пакета, сек (BATCH_POLL_INTERVAL)")
+    args = parser.parse_args()
+    if args.images and args.openai_batch:
+        parser.error("Batch API не генерирует изображения, --images недоступен с --openai-batch")
+    if not args.output:
+        args.output = str(Path(args.input).with_suffix(".greetings.jsonl"))
+    return args
+
+async def main(args: argparse.Namespace) -> int:
+    """
+    Обработка входного файла
+
+    Returns:
+        int: код завершения (1, если остались записи с ошибкой)
+    """
+    config = load_config(require_telegram=False)
+    setup_logging_from_config(config)
+    logger.info("Пакетная генерация: %s -> %s", args.input, args.output)
+
+    scheduler = None
+    if config.scheduler_enabled and not args.openai_batch:
+        scheduler = create_scheduler(config)
+    ai_service = create_ai_service(config, scheduler)
+    output = BulkOutput(args.output)
+    assets = None
+    try:
+        if args.openai_batch:
+            runner = BatchApiGenerator(
+                ai_service, output,
+                poll_interval=args.poll_interval or config.batch_poll_interval
+            )
+        else:
+            if args.images and config.image_assets_enabled:
+                assets = create_image_assets(config, ai_service)
+            runner = BulkGenerator(
+                ContentGenerator(ai_service, scheduler, assets=assets),
+                output,
+                concurrency=args.concurrency or config.batch_concurrency,
+                with_image=args.images,
+                assets=assets
+            )
+        await runner.run(read_items(args.input))
+    finally:
+        output.close()
+        await ai_service.close()
+        if assets:
+            assets.close()
+
+    logger.info(
+        "Готово: записано %s, ошибок %s, пропущено готовых %s",
+        output.written, output.failed, output.skipped
+    )
+    return 1 if output.failed else 0
+
+if __name__ == '__main__':
+    try:
+        sys.exit(asyncio.run(main(parse_args())))
+    except KeyboardInterrupt:
+        logger.info("Остановлено, повторный запуск продолжит с места остановки")
+        sys.exit(130)
@@ -2,19 +2,142 @@
 Инициализация и настройка бота
 """
 import logging
+from zoneinfo import ZoneInfo
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
 from aiogram.types import BotCommand, Message
 from aiogram.filters import Command
 from aiogram.client.session.base import BaseSession
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from config import Config
-from bot.handlers import register_handlers
-from services.ai_service import AIService
+from bot.handlers import register_handlers, reminder_sender
+from bot.jobs import GenerationJobs
+from bot.keyboards import BUTTON_ALIASES, BUTTON_COMMANDS
+from bot.storage import UpdateDedupMiddleware, UpdateDeduplicator, create_storage
+from services.ai_service import AIService, ANALYSIS_MODEL, GREETING_MODEL, IMAGE_MODEL
+from services.scheduler import AIScheduler, ModelBudget
 from services.context_manager import ContextManager
+from services.context_store import create_context_store
 from services.content_generator import ContentGenerator
+from services.result_cache import ResultCache
+from services.image_assets import ImageAssets
+from services.speculative import SpeculativeGenerator
+from services.job_queue import JobQueue, JobWorkerPool
+from services.prompts import PromptRegistry
+from services.prefilter import MessagePrefilter
+from services.reminders import ReminderScheduler, ReminderStore
+from services.variants import GreetingVariants, VariantStore
+from services.resilience import ModelPolicy, ResiliencePolicy
+from utils.metrics import QUEUE_DEPTH, MetricsServer, enable_tracing, install_middlewares
+from utils.diagnostics import Diagnostics
+from utils.logger import LogContextMiddleware
 
 logger = logging.getLogger(__name__)
 
+def create_scheduler(config: Config) -> AIScheduler:
+    """
+    Создание планировщика запросов к OpenAI с лимитами из конфигурации
+    """
+    budgets = {
+        ANALYSIS_MODEL: ModelBudget(
+            max_concurrency=config.gpt4o_mini_concurrency,
+            rpm=config.gpt4o_mini_rpm,
+            tpm=config.gpt4o_mini_tpm
+        ),
+        GREETING_MODEL: ModelBudget(
+            max_concurrency=config.gpt4o_concurrency,
+            rpm=config.gpt4o_rpm,
+            tpm=config.gpt4o_tpm
+        ),
+        IMAGE_MODEL: ModelBudget(
+            max_concurrency=config.dalle3_concurrency,
+            rpm=config.dalle3_rpm
+        ),
+    }
+    return AIScheduler(
+        budgets,
+        max_queue_size=config.scheduler_max_queue,
+        max_user_queue=config.scheduler_max_user_queue,
+        max_total_concurrency=config.scheduler_max_concurrency
+    )
+
+def create_session(config: Config) -> AiohttpSession:
+    """
+    HTTP-сессия бота с адресом Bot API из конфигурации
+    """
+    return AiohttpSession(api=TelegramAPIServer.from_base(config.telegram_api_url))
+
+def create_resilience_policy(config: Config, scheduler: AIScheduler | None = None) -> ResiliencePolicy:
+    """
+    Создание политики надежности вызовов OpenAI из конфигурации
+
+    Дублирующие запросы учитываются в лимитах планировщика, если он задан.
+    """
+    policies = {
+        ANALYSIS_MODEL: ModelPolicy(
+            timeout=config.openai_timeout_analysis,
+            retries=config.openai_retries,
+            hedge_after=config.openai_hedge_after
+        ),
+        GREETING_MODEL: ModelPolicy(
+            timeout=config.openai_timeout_greeting,
+            retries=config.openai_retries
+        ),
+        IMAGE_MODEL: ModelPolicy(
+            timeout=config.openai_timeout_image,
+            retries=config.openai_retries
+        ),
+    }
+    return ResiliencePolicy(
+        policies,
+        backoff=config.openai_retry_backoff,
+        max_backoff=config.openai_retry_max_backoff,
+        failure_threshold=config.circuit_failure_threshold,
+        reset_timeout=config.circuit_reset_timeout,
+        scheduler=scheduler
+    )
+
+def create_ai_service(config: Config, scheduler: AIScheduler | None = None) -> AIService:
+    """
+    Создание сервиса OpenAI с пулом соединений, политикой надежности
+    и реестром промптов из конфигурации
+    """
+    return AIService(
+        api_key=config.openai_api_key,
+        proxy_enabled=config.openai_proxy_enabled,
+        proxy_host=config.openai_proxy_host,
+        proxy_port=config.openai_proxy_port,
+        proxy_username=config.openai_proxy_username,
+        proxy_password=config.openai_proxy_password,
+        max_connections=config.openai_max_connections,
+        max_keepalive_connections=config.openai_max_keepalive_connections,
+        keepalive_expiry=config.openai_keepalive_expiry,
+        http2=config.openai_http2,
+        base_url=config.openai_base_url,
+        policy=create_resilience_policy(config, scheduler) if config.resilience_enabled else None,
+        greeting_fallback_model=ANALYSIS_MODEL if config.greeting_fallback_enabled else None,
+        prompts=PromptRegistry(
+            variant=config.prompt_variant,
+            ab_variant=config.prompt_ab_variant,
+            ab_share=config.prompt_ab_share
+        )
+    )
+
+def create_image_assets(config: Config, ai_service: AIService) -> ImageAssets:
+    """
+    Создание локального хранилища изображений из конфигурации
+    """
+    return ImageAssets(
+        ai_service.http_client,
+        directory=config.image_assets_dir,
+        image_format=config.image_format,
+        quality=config.image_quality,
+        max_side=config.image_max_side,
+        max_bytes=config.image_max_bytes,
+        ttl=config.image_assets_ttl
+    )
+
 async def create_bot(config: Config) -> tuple[Bot, Dispatcher]:
     """
     Создание и настройка экземпляра бота
@@ -27,28 +150,139 @@ async def create_bot(config: Config) -> tuple[Bot, Dispatcher]:
     # Создание бота с правильными настройками HTML-разметки
     bot = Bot(
         token=config.telegram_token,
+        session=create_session(config),
         parse_mode=ParseMode.HTML
     )
     logger.debug("Бот создан с настройками HTML-разметки")
 
-    # Создание диспетчера
-    dp = Dispatcher()
+    # Создание диспетчера с состояниями FSM, переживающими перезапуск
+    dp = Dispatcher(storage=create_storage(config.fsm_db_path))
+    # user_id и id обновления в каждой записи журнала обработчиков
+    dp.update.outer_middleware(LogContextMiddleware())
+    if config.update_dedup_enabled:
+        # Обновления, повторно доставленные после перезапуска, не обрабатываются
+        update_dedup = UpdateDeduplicator(config.update_dedup_db_path, ttl=config.update_dedup_ttl)
+        dp.update.outer_middleware(UpdateDedupMiddleware(update_dedup))
+        dp["update_dedup"] = update_dedup
     logger.debug("Диспетчер создан")
 
     # Инициализация сервисов
     try:
         logger.info("Инициализация сервисов")
-        ai_service = AIService(
-            api_key=config.openai_api_key,
-            proxy_enabled=config.openai_proxy_enabled,
-            proxy_host=config.openai_proxy_host,
-            proxy_port=config.openai_proxy_port,
-            proxy_username=config.openai_proxy_username,
-            proxy_password=config.openai_proxy_password
+        scheduler = create_scheduler(config) if config.scheduler_enabled else None
+        ai_service = create_ai_service(config, scheduler)
+        context_store = create_context_store(
+            config.context_db_path,
+            max_size=config.context_cache_size,
+            idle_ttl=config.context_idle_ttl
+        )
+        dp["context_store"] = context_store
+        context_manager = ContextManager(
+            ai_service, scheduler,
+            quiet_window=config.message_quiet_window,
+            store=context_store,
+            summary_token_budget=config.summary_token_budget,
+            delta_mode=config.analysis_delta_mode
+        )
+        result_cache = None
+        if config.result_cache_enabled:
+            result_cache = ResultCache(
+                max_size=config.result_cache_size,
+                ttl=config.result_cache_ttl,
+                db_path=config.result_cache_db_path
+            )
+            dp["result_cache"] = result_cache
+        image_assets = None
+        if config.image_assets_enabled:
+            image_assets = create_image_assets(config, ai_service)
+            dp["image_assets"] = image_assets
+        content_generator = ContentGenerator(
+            ai_service, scheduler,
+            cache=result_cache,
+            image_cache_ttl=config.image_cache_ttl,
+            assets=image_assets
         )
-        context_manager = ContextManager(ai_service)
-        content_generator = ContentGenerator(ai_service)
+        variants = None
+        if config.greeting_variants > 1:
+            variant_store = VariantStore(config.variants_db_path)
+            dp["variant_store"] = variant_store
+            variants = GreetingVariants(
+                content_generator, variant_store,
+                count=config.greeting_variants,
+                ttl=config.variants_ttl
+            )
+        speculative = None
+        if config.speculative_enabled and variants:
+            # Заранее созданная открытка к одному тексту противоречит выбору варианта
+            logger.warning("Режим вариантов включен: упреждающая генерация отключена")
+        elif config.speculative_enabled:
+            speculative = SpeculativeGenerator(
+                content_generator,
+                delay=config.speculative_delay,
+                with_image=config.speculative_image,
+                max_inflight=config.speculative_max_inflight,
+                max_per_hour=config.speculative_max_per_hour,
+                ttl=config.speculative_ttl
+            )
+        jobs = None
+        if config.job_queue_enabled:
+            job_queue = JobQueue(config.job_db_path)
+            dp["job_queue"] = job_queue
+            jobs = GenerationJobs(
+                bot, job_queue, content_generator,
+                streaming=config.greeting_streaming,
+                stream_edit_interval=config.stream_edit_interval,
+                variants=variants
+            )
+            if config.job_workers:
+                jobs.pool = JobWorkerPool(
+                    job_queue, jobs.handlers,
+                    on_failure=jobs.on_failure,
+                    concurrency=config.job_workers,
+                    max_attempts=config.job_max_attempts,
+                    backoff=config.job_retry_backoff,
+                    poll_interval=config.job_poll_interval
+                )
+                jobs.pool.start()
+                dp["job_pool"] = jobs.pool
+        reminders = None
+        if config.reminders_enabled:
+            reminder_store = ReminderStore(config.reminder_db_path)
+            dp["reminder_store"] = reminder_store
+            reminders = ReminderScheduler(
+                reminder_store, content_generator,
+                reminder_sender(bot, image_assets),
+                tz=ZoneInfo(config.reminder_timezone),
+                hour=config.reminder_hour,
+                prepare_window=(config.reminder_prepare_start, config.reminder_prepare_end),
+                lookahead=config.reminder_lookahead_days * 86400.0,
+                prepare_concurrency=config.reminder_prepare_concurrency,
+                delivery_rate=config.reminder_delivery_rate
+            )
+            reminders.start()
+            dp["reminders"] = reminders
+        prefilter = None
+        if config.prefilter_enabled:
+            prefilter = MessagePrefilter(
+                BUTTON_ALIASES, BUTTON_COMMANDS,
+                button_cutoff=config.prefilter_button_cutoff,
+                classifier=config.prefilter_classifier_enabled,
+                classifier_threshold=config.prefilter_classifier_threshold
+            )
+            dp["prefilter"] = prefilter
+        # Сервисы сохраняются в диспетчере, чтобы освободить ресурсы при остановке
+        dp["ai_service"] = ai_service
         logger.debug("Сервисы успешно инициализированы")
+
+        if config.tracing_enabled:
+            enable_tracing()
+        if config.metrics_enabled:
+            install_middlewares(dp)
+            if scheduler:
+                QUEUE_DEPTH.set_function(lambda: scheduler.queue_size, queue="openai_scheduler")
+            if jobs:
+                QUEUE_DEPTH.set_function(jobs.queue.pending, queue="jobs")
+            dp["metrics_server"] = await start_metrics_server(config)
     except Exception as e:
         logger.error(f"Ошибка при инициализации сервисов: {str(e)}", exc_info=True)
         raise
@@ -56,7 +290,19 @@ async def create_bot(config: Config) -> tuple[Bot, Dispatcher]:
     # Регистрация обработчиков
     try:
         # Регистрация всех обработчиков через handlers.py
-        register_handlers(dp, context_manager, content_generator)
+        register_handlers(
+            dp, context_manager, content_generator,
+            streaming=config.greeting_streaming,
+            stream_edit_interval=config.stream_edit_interval,
+            speculative=speculative,
+            jobs=jobs,
+            admin_ids=config.admin_ids,
+            profile_max_duration=config.profile_max_duration,
+            reminders=reminders,
+            reminder_max_per_user=config.reminder_max_per_user,
+            prefilter=prefilter,
+            variants=variants
+        )
         logger.debug("Обработчики команд зарегистрированы")
     except Exception as e:
         logger.error(f"Ошибка при регистрации обработчиков: {str(e)}", exc_info=True)
@@ -68,7 +314,12 @@ async def create_bot(config: Config) -> tuple[Bot, Dispatcher]:
             BotCommand(command="start", description="Перезагрузить бота"),
             BotCommand(command="help", description="Помощь"),
             BotCommand(command="congratulation", description="Создать поздравление"),
-            BotCommand(command="clear", description="Очистить контекст")
+            BotCommand(command="clear", description="Очистить контекст"),
+            *([
+                BotCommand(command="adddate", description="Добавить важную дату"),
+                BotCommand(command="dates", description="Важные даты"),
+                BotCommand(command="deldate", description="Удалить важную дату")
+            ] if config.reminders_enabled else [])
         ])
         logger.debug("Команды бота установлены")
     except Exception as e:
@@ -76,4 +327,79 @@ async def create_bot(config: Config) -> tuple[Bot, Dispatcher]:
         raise
 
     logger.info("Инициализация бота завершена успешно")
-    return bot, dp
\ No newline at end of file
+    return bot, dp
+
+def start_diagnostics(config: Config, name: str = "bot") -> Diagnostics:
+    """
+    Запуск сторожа цикла событий (из работающего цикла событий)
+    """
+    diagnostics = Diagnostics(
+        config.diagnostics_dir,
+        lag_threshold=config.loop_lag_threshold,
+        profile_interval=config.profile_interval,
+        name=name
+    )
+    diagnostics.start()
+    return diagnostics
+
+async def start_metrics_server(config: Config) -> MetricsServer | None:
+    """
+    Запуск локального сервера /metrics
+
+    Если порт занят (например, другим процессом бота), бот работает
+    без сервера метрик.
+    """
+    server = MetricsServer()
+    try:
+        await server.start(config.metrics_host, config.metrics_port)
+    except OSError as e:
+        logger.warning(f"Сервер метрик не запущен на порту {config.metrics_port}: {str(e)}")
+        return None
+    return server
+
+async def close_services(dp: Dispatcher):
+    """Освобождение ресурсов сервисов, сохраненных в диспетчере"""
+    metrics_server = dp.get("metrics_server")
+    if metrics_server:
+        await metrics_server.stop()
+    prefilter = dp.get("prefilter")
+    if prefilter:
+        logger.info("Фильтр сообщений: %s", prefilter.stats())
+    reminders = dp.get("reminders")
+    if reminders:
+        logger.info("Остановка планировщика напоминаний")
+        await reminders.stop()
+    job_pool = dp.get("job_pool")
+    if job_pool:
+        logger.info("Остановка обработчиков задач")
+        await job_pool.stop()
+    job_queue = dp.get("job_queue")
+    if job_queue:
+        job_queue.close()
+    ai_service = dp.get("ai_service")
+    if ai_service:
+        logger.info("Закрытие клиента OpenAI")
+        await ai_service.close()
+    context_store = dp.get("context_store")
+    if context_store:
+        logger.info("Закрытие хранилища контекстов")
+        context_store.close()
+    result_cache = dp.get("result_cache")
+    if result_cache:
+        logger.info("Закрытие кеша результатов")
+        result_cache.close()
+    reminder_store = dp.get("reminder_store")
+    if reminder_store:
+        reminder_store.close()
+    variant_store = dp.get("variant_store")
+    if variant_store:
+        variant_store.close()
+    update_dedup = dp.get("update_dedup")
+    if update_dedup:
+        logger.info("Пропущено повторных обновлений: %s", update_dedup.duplicates)
+        update_dedup.close()
+    await dp.storage.close()
+    image_assets = dp.get("image_assets")
+    if image_assets:
+        logger.info("Закрытие индекса изображений")
+        image_assets.close()
@@ -1,19 +1,61 @@
 """
 Обработчики команд и сообщений бота
 """
+import html
 import logging
-from aiogram import types, Dispatcher, F
-from aiogram.filters import Command
+import re
+from typing import Awaitable, Callable, Dict, Optional
+from aiogram import Bot, types, Dispatcher, F
+from aiogram.enums import ChatAction
+from aiogram.filters import Command, CommandObject
+from aiogram.types import FSInputFile
 from services.context_manager import ContextManager
 from services.content_generator import ContentGenerator
-from bot.keyboards import get_main_keyboard
-from models.messages import WELCOME_MESSAGE, HELP_MESSAGE
+from services.scheduler import QueueFullError
+from services.speculative import SpeculativeGenerator
+from services.prefilter import Action, Decision, MessagePrefilter
+from services.variants import GreetingVariants
+from bot.keyboards import (
+    BUTTON_CLEAR, BUTTON_GENERATE, BUTTON_HELP, BUTTON_RESTART,
+    VARIANT_CHOOSE, VARIANT_MORE, VARIANT_NEXT, VariantCallback, get_main_keyboard
+)
+from bot.streaming import MessageStreamer
+from bot.media import send_image
+from services.image_assets import ImageAssets
+from bot.jobs import GenerationJobs, send_variant, variant_view
+from models.context import Context
+from utils.diagnostics import Diagnostics
+from services.reminders import Reminder, ReminderScheduler
+from models.messages import (
+    WELCOME_MESSAGE, HELP_MESSAGE, QUEUE_MESSAGE, OVERLOAD_MESSAGE,
+    ADDDATE_USAGE, DATE_ADDED_MESSAGE, REMINDER_MESSAGE, REMINDER_FALLBACK_MESSAGE,
+    SMALLTALK_MESSAGE, UNKNOWN_COMMAND_MESSAGE, VARIANT_CHOSEN_MESSAGE
+)
 
 logger = logging.getLogger(__name__)
 
+ButtonHandler = Callable[[types.Message], Awaitable[None]]
+
+def queue_notifier(message: types.Message):
+    """Уведомление пользователя о позиции его запроса в очереди"""
+    async def notify(position: int):
+        await message.answer(QUEUE_MESSAGE.format(position=position))
+    return notify
+
+async def answer_image(
+    message: types.Message,
+    image: str,
+    content_generator: ContentGenerator,
+    **kwargs
+) -> types.Message:
+    """Отправка изображения открытки в чат сообщения"""
+    return await send_image(
+        message.bot, message.chat.id, image, content_generator.assets, **kwargs
+    )
+
 async def start_command(message: types.Message):
     """Обработчик команды /start"""
-    logger.info(f"Получена команда /start от пользователя {message.from_user.id}")
+    logger.info("Получена команда /start от пользователя %s", message.from_user.id)
     await message.answer(
         WELCOME_MESSAGE.format(telegram_username=message.from_user.first_name),
         reply_markup=get_main_keyboard()
@@ -21,67 +63,292 @@ async def start_command(message: types.Message):
 
 async def help_command(message: types.Message):
     """Обработчик команды /help"""
-    logger.info(f"Получена команда /help от пользователя {message.from_user.id}")
+    logger.info("Получена команда /help от пользователя %s", message.from_user.id)
     await message.answer(HELP_MESSAGE, reply_markup=get_main_keyboard())
 
-async def clear_command(message: types.Message, context_manager: ContextManager):
+async def clear_command(
+    message: types.Message,
+    context_manager: ContextManager,
+    speculative: SpeculativeGenerator | None = None
+):
     """Обработчик команды /clear"""
     user_id = message.from_user.id
-    logger.info(f"Получена команда /clear от пользователя {user_id}")
+    logger.info("Получена команда /clear от пользователя %s", user_id)
     context_manager.clear_context(user_id)
+    if speculative:
+        speculative.invalidate(user_id)
     await message.answer(
         "Контекст очищен. Можете начать новый диалог.",
         reply_markup=get_main_keyboard()
     )
 
+async def send_streamed_congratulation(
+    message: types.Message,
+    context: Context,
+    content_generator: ContentGenerator,
+    stream_edit_interval: float
+):
+    """
+    Потоковая отправка поздравления
+
+    Текст появляется в сообщении по мере генерации, изображение
+    запрашивается сразу после готовности текста и приходит вторым сообщением.
+    """
+    user_id = message.from_user.id
+    placeholder = await message.answer("✍️ Пишу поздравление...")
+    streamer = MessageStreamer(placeholder, stream_edit_interval)
+    async for chunk in content_generator.stream_greeting(
+            context, user_id, on_queued=queue_notifier(message)):
+        await streamer.feed(chunk)
+    greeting_text = await streamer.finish()
+    logger.info("Текст поздравления доставлен пользователю %s", user_id)
+    await send_congratulation_image(message, greeting_text, content_generator)
+
+async def send_prepared_congratulation(
+    message: types.Message,
+    prepared: tuple[str, str | None],
+    content_generator: ContentGenerator
+):
+    """Отправка заранее сгенерированного поздравления"""
+    greeting_text, image_url = prepared
+    await message.answer(greeting_text, parse_mode=None)
+    if image_url:
+        await answer_image(
+            message, image_url, content_generator, reply_markup=get_main_keyboard()
+        )
+    else:
+        await send_congratulation_image(message, greeting_text, content_generator)
+
+async def send_congratulation_image(
+    message: types.Message,
+    greeting_text: str,
+    content_generator: ContentGenerator,
+    user_id: int | None = None
+):
+    """
+    Генерация и отправка открытки к уже отправленному тексту
+
+    Args:
+        user_id: ID пользователя, если сообщение отправлено ботом
+            (нажатие inline-кнопки)
+    """
+    user_id = user_id or message.from_user.id
+    try:
+        await message.bot.send_chat_action(message.chat.id, ChatAction.UPLOAD_PHOTO)
+        image_url = await content_generator.generate_image(
+            greeting_text, user_id, on_queued=queue_notifier(message)
+        )
+        await answer_image(
+            message, image_url, content_generator, reply_markup=get_main_keyboard()
+        )
+    except QueueFullError:
+        raise
+    except Exception as e:
+        logger.error("Ошибка при генерации изображения: %s", e, exc_info=True)
+        await message.answer(
+            "Не удалось создать открытку, но текст поздравления готов.",
+            reply_markup=get_main_keyboard()
+        )
+
+async def send_variant_congratulation(
+    message: types.Message,
+    user_id: int,
+    context: Context,
+    variants: GreetingVariants,
+    jobs: GenerationJobs | None = None
+):
+    """
+    Отправка варианта поздравления с кнопками выбора
+
+    Непоказанный вариант для того же контекста отправляется сразу,
+    иначе новый набор запрашивается одним вызовом модели.
+    """
+    cached = variants.cached(user_id, context)
+    if cached:
+        await send_variant(message.bot, message.chat.id, *cached)
+        logger.info("Вариант поздравления из набора отправлен пользователю %s", user_id)
+        return
+
+    if jobs:
+        if jobs.enqueue_greeting(user_id, message.chat.id, context):
+            await message.answer("Генерирую варианты поздравления...")
+        else:
+            await message.answer("Поздравление уже готовится, немного подождите.")
+        return
+
+    await message.answer("Генерирую варианты поздравления...")
+    await message.bot.send_chat_action(message.chat.id, ChatAction.TYPING)
+    variant_set = await variants.generate(user_id, context, on_queued=queue_notifier(message))
+    await send_variant(message.bot, message.chat.id, variant_set, 0)
+    logger.info("Варианты поздравления отправлены пользователю %s", user_id)
+
 async def generate_congratulation(
     message: types.Message,
     context_manager: ContextManager,
-    content_generator: ContentGenerator
+    content_generator: ContentGenerator,
+    streaming: bool = False,
+    stream_edit_interval: float = 1.0,
+    speculative: SpeculativeGenerator | None = None,
+    jobs: GenerationJobs | None = None,
+    variants: GreetingVariants | None = None
 ):
     """Обработчик генерации поздравления"""
     try:
         user_id = message.from_user.id
-        logger.info(f"Генерация поздравления для пользователя {user_id}")
+        logger.info("Генерация поздравления для пользователя %s", user_id)
 
         context = context_manager.get_context(user_id)
-        if not context or not context.messages:
+        if not context or not context.message_count:
             await message.answer(
                 "Пожалуйста, сначала расскажите о человеке, которого хотите поздравить.",
                 reply_markup=get_main_keyboard()
             )
             return
 
+        if variants:
+            # Открытка создается только для выбранного варианта
+            await send_variant_congratulation(message, user_id, context, variants, jobs)
+            return
+
+        prepared = await speculative.take(user_id, context) if speculative else None
+        if prepared:
+            await send_prepared_congratulation(message, prepared, content_generator)
+            logger.info("Поздравление успешно отправлено пользователю %s", user_id)
+            return
+
+        if jobs:
+            # Генерация идет в пуле обработчиков, результат придет в чат
+            if jobs.enqueue_greeting(user_id, message.chat.id, context):
+                await message.answer("Генерирую поздравление...")
+            else:
+                await message.answer("Поздравление уже готовится, немного подождите.")
+            return
+
+        if streaming:
+            await send_streamed_congratulation(
+                message, context, content_generator, stream_edit_interval
+            )
+            logger.info("Поздравление успешно отправлено пользователю %s", user_id)
+            return
+
         await message.answer("Генерирую поздравление...")
-        greeting = await content_generator.generate_content(context)
+        greeting = await content_generator.generate_content(
+            context, user_id, on_queued=queue_notifier(message)
+        )
 
         greeting_text, image_url = greeting
         if image_url:
-            await message.answer_photo(image_url, caption=greeting_text[:1024])
+            await answer_image(
+                message, image_url, content_generator, caption=greeting_text[:1024]
+            )
         else:
             await message.answer(
                 greeting_text,
                 reply_markup=get_main_keyboard()
             )
-        logger.info(f"Поздравление успешно отправлено пользователю {user_id}")
+        logger.info("Поздравление успешно отправлено пользователю %s", user_id)
+    except QueueFullError:
+        await message.answer(OVERLOAD_MESSAGE, reply_markup=get_main_keyboard())
     except Exception as e:
-        logger.error(f"Ошибка при генерации поздравления: {str(e)}", exc_info=True)
+        logger.error("Ошибка при генерации поздравления: %s", e, exc_info=True)
         await message.answer(
             "Произошла ошибка при генерации поздравления. Попробуйте позже.",
             reply_markup=get_main_keyboard()
         )
 
+async def variant_callback(
+    callback: types.CallbackQuery,
+    callback_data: VariantCallback,
+    variants: GreetingVariants,
+    context_manager: ContextManager,
+    content_generator: ContentGenerator,
+    jobs: GenerationJobs | None = None
+):
+    """Обработчик кнопок под вариантом поздравления"""
+    user_id = callback.from_user.id
+    message = callback.message
+    logger.info("Кнопка варианта %s от пользователя %s", callback_data.action, user_id)
+    if message is None:
+        await callback.answer("Сообщение устарело, создайте новое поздравление")
+        return
+    try:
+        if callback_data.action == VARIANT_NEXT:
+            result = variants.next(user_id, callback_data.set_id)
+            if result is None:
+                await callback.answer("Эти варианты уже неактуальны")
+                return
+            await callback.answer()
+            text, keyboard = variant_view(*result)
+            await message.edit_text(text, parse_mode=None, reply_markup=keyboard)
+
+        elif callback_data.action == VARIANT_CHOOSE:
+            greeting_text = variants.choose(user_id, callback_data.set_id, callback_data.index)
+            if greeting_text is None:
+                await callback.answer("Этот вариант уже выбран")
+                return
+            await callback.answer(VARIANT_CHOSEN_MESSAGE)
+            # Без заголовка и кнопок: готовый текст удобно переслать
+            await message.edit_text(greeting_text, parse_mode=None)
+            if jobs:
+                jobs.enqueue_image(
+                    user_id, message.chat.id, greeting_text,
+                    f"variant:{callback_data.set_id}:{callback_data.index}"
+                )
+            else:
+                await send_congratulation_image(message, greeting_text, content_generator, user_id)
+
+        elif callback_data.action == VARIANT_MORE:
+            await callback.answer()
+            await message.edit_reply_markup(reply_markup=None)
+            context = context_manager.get_context(user_id)
+            if not context or not context.message_count:
+                await message.answer(
+                    "Пожалуйста, сначала расскажите о человеке, которого хотите поздравить.",
+                    reply_markup=get_main_keyboard()
+                )
+                return
+            await send_variant_congratulation(message, user_id, context, variants, jobs)
+    except QueueFullError:
+        await message.answer(OVERLOAD_MESSAGE, reply_markup=get_main_keyboard())
+    except Exception as e:
+        logger.error("Ошибка при обработке выбора варианта: %s", e, exc_info=True)
+        await message.answer(
+            "Произошла ошибка при генерации поздравления. Попробуйте позже.",
+            reply_markup=get_main_keyboard()
+        )
+
+async def answer_prefiltered(
+    message: types.Message,
+    decision: Decision,
+    context: Context | None,
+    buttons: Dict[str, ButtonHandler]
+):
+    """Ответ на сообщение, отсеянное локальным фильтром, без запроса к модели"""
+    if decision.action is Action.BUTTON and decision.button in buttons:
+        logger.info("Сообщение распознано как кнопка %s", decision.button)
+        await buttons[decision.button](message)
+    elif decision.action is Action.DUPLICATE and context and context.summory:
+        # Повтор ничего не добавляет: резюме остается прежним
+        await message.answer(
+            f"{context.get_summory()}\nЧто-нибудь ещё?",
+            reply_markup=get_main_keyboard()
+        )
+    elif decision.action is Action.COMMAND:
+        await message.answer(UNKNOWN_COMMAND_MESSAGE, reply_markup=get_main_keyboard())
+    else:
+        await message.answer(SMALLTALK_MESSAGE, reply_markup=get_main_keyboard())
+
 async def handle_message(
     message: types.Message,
     context_manager: ContextManager,
-    content_generator: ContentGenerator
+    content_generator: ContentGenerator,
+    speculative: SpeculativeGenerator | None = None,
+    prefilter: MessagePrefilter | None = None,
+    buttons: Dict[str, ButtonHandler] | None = None
 ):
     """Обработчик текстовых сообщений"""
     try:
-        logger.info(
-            f"Входящее сообщение - От: {message.from_user.id}, "
-            f"Текст: {message.text[:50] if message.text else 'None'}..."
-        )
+        logger.info("Входящее сообщение - От: %s, Текст: %.50s...", message.from_user.id, message.text)
 
         # Если сообщение пустое, игнорируем его
         if not message.text:
@@ -90,50 +357,244 @@ async def handle_message(
         message_text = message.text.strip()
         user_id = message.from_user.id
 
+        if prefilter:
+            # Служебные реплики, повторы и опечатки в кнопках - без анализа моделью
+            context = context_manager.get_context(user_id)
+            decision = prefilter.check(message_text, context)
+            if decision.action is not Action.ANALYZE:
+                await answer_prefiltered(message, decision, context, buttons or {})
+                return
+
         # Сохраняем сообщение в контекст
-        context = await context_manager.update_context(user_id, message_text)
+        context = await context_manager.update_context(
+            user_id, message_text, on_queued=queue_notifier(message)
+        )
+        if context is None:
+            # Сообщение объединено с соседними, ответ придет на последнее из них
+            return
+
         await message.answer(
             f"{context.get_summory()}\nЧто-нибудь ещё?", 
             reply_markup=get_main_keyboard()
         )
+        if speculative:
+            speculative.schedule(user_id, context)
 
+    except QueueFullError:
+        await message.answer(OVERLOAD_MESSAGE, reply_markup=get_main_keyboard())
     except Exception as e:
-        logger.error(f"Ошибка при обработке сообщения: {str(e)}", exc_info=True)
+        logger.error("Ошибка при обработке сообщения: %s", e, exc_info=True)
         await message.answer(
             "Произошла ошибка при обработке сообщения. Попробуйте позже.",
             reply_markup=get_main_keyboard()
         )
 
-def register_handlers(dp: Dispatcher, context_manager: ContextManager, content_generator: ContentGenerator):
+async def profile_command(
+    message: types.Message,
+    command: CommandObject,
+    diagnostics: Diagnostics | None = None,
+    max_duration: float = 60.0
+):
+    """Обработчик команды /profile [секунды] (только для администраторов)"""
+    logger.info("Получена команда /profile от пользователя %s", message.from_user.id)
+    if diagnostics is None:
+        await message.answer("Диагностика выключена (DIAGNOSTICS_ENABLED=false)")
+        return
+    try:
+        duration = min(float(command.args or 10), max_duration)
+    except ValueError:
+        await message.answer("Использование: /profile [секунды]")
+        return
+    await message.answer(f"Профилирую цикл событий {duration:g} с...\n{diagnostics.stats()}")
+    try:
+        summary, path = await diagnostics.profile(duration)
+    except RuntimeError as e:
+        await message.answer(str(e))
+        return
+    # Предел длины сообщения Telegram - 4096 символов
+    await message.answer(f"<pre>{html.escape(summary[:4000])}</pre>")
+    await message.answer_document(FSInputFile(path))
+
+# Дата события: ДД.ММ или ДД.ММ.ГГГГ, затем название
+DATE_PATTERN = re.compile(r"^(\d{1,2})\.(\d{1,2})(?:\.(\d{4}))?\s+(.+)$", re.S)
+
+async def add_date_command(
+    message: types.Message,
+    command: CommandObject,
+    reminders: ReminderScheduler,
+    context_manager: ContextManager,
+    max_per_user: int = 50
+):
+    """Обработчик команды /adddate ДД.ММ[.ГГГГ] Название"""
+    user_id = message.from_user.id
+    logger.info("Получена команда /adddate от пользователя %s", user_id)
+    match = DATE_PATTERN.match((command.args or "").strip())
+    if not match:
+        await message.answer(ADDDATE_USAGE, parse_mode=None)
+        return
+    if reminders.store.count(user_id) >= max_per_user:
+        await message.answer(f"Можно сохранить не больше {max_per_user} дат. Удалите лишние командой /deldate.")
+        return
+    day, month, year, title = match.groups()
+    # Факты о человеке, рассказанные до добавления даты, пригодятся для поздравления
+    context = context_manager.get_context(user_id)
+    summary = context.prompt_text() if context and context.message_count else ""
+    try:
+        reminder = reminders.add(
+            user_id, message.chat.id, title.strip()[:200], int(day), int(month),
+            int(year) if year else None, summary
+        )
+    except ValueError:
+        await message.answer(ADDDATE_USAGE, parse_mode=None)
+        return
+    await message.answer(
+        DATE_ADDED_MESSAGE.format(date=reminder.date_text(), title=reminder.title, id=reminder.id),
+        parse_mode=None,
+        reply_markup=get_main_keyboard()
+    )
+
+async def dates_command(message: types.Message, reminders: ReminderScheduler):
+    """Обработчик команды /dates"""
+    user_id = message.from_user.id
+    logger.info("Получена команда /dates от пользователя %s", user_id)
+    items = reminders.store.list(user_id)
+    if not items:
+        await message.answer("Важных дат пока нет. Добавьте: /adddate 15.03 День рождения мамы")
+        return
+    lines = ["🗓 Важные даты:"]
+    for item in items:
+        ready = " ✅ поздравление готово" if item.greeting else ""
+        lines.append(f"№{item.id}  {item.date_text()} — {item.title}{ready}")
+    lines.append("\nУдалить: /deldate номер")
+    await message.answer("\n".join(lines), parse_mode=None)
+
+async def delete_date_command(
+    message: types.Message,
+    command: CommandObject,
+    reminders: ReminderScheduler
+):
+    """Обработчик команды /deldate номер"""
+    user_id = message.from_user.id
+    logger.info("Получена команда /deldate от пользователя %s", user_id)
+    try:
+        reminder_id = int((command.args or "").strip().lstrip("№"))
+    except ValueError:
+        await message.answer("Использование: /deldate номер (номера - в /dates)")
+        return
+    if reminders.store.delete(user_id, reminder_id):
+        await message.answer(f"Дата №{reminder_id} удалена.")
+    else:
+        await message.answer(f"Дата №{reminder_id} не найдена.")
+
+def reminder_sender(bot: Bot, assets: Optional[ImageAssets] = None):
+    """Доставка напоминания: текст поздравления и открытка"""
+    async def deliver(reminder: Reminder, greeting: str, image: Optional[str]):
+        # Без поздравления (генерация не удалась до конца дня) - только напоминание
+        template = REMINDER_MESSAGE if greeting else REMINDER_FALLBACK_MESSAGE
+        await bot.send_message(
+            reminder.chat_id,
+            template.format(date=reminder.date_text(), title=reminder.title, greeting=greeting),
+            parse_mode=None
+        )
+        if image:
+            await send_image(bot, reminder.chat_id, image, assets, reply_markup=get_main_keyboard())
+    return deliver
+
+def register_handlers(
+    dp: Dispatcher,
+    context_manager: ContextManager,
+    content_generator: ContentGenerator,
+    streaming: bool = False,
+    stream_edit_interval: float = 1.0,
+    speculative: SpeculativeGenerator | None = None,
+    jobs: GenerationJobs | None = None,
+    admin_ids: tuple[int, ...] = (),
+    profile_max_duration: float = 60.0,
+    reminders: ReminderScheduler | None = None,
+    reminder_max_per_user: int = 50,
+    prefilter: MessagePrefilter | None = None,
+    variants: GreetingVariants | None = None
+):
     """Регистрация обработчиков команд бота"""
     logger.info("Регистрация обработчиков команд бота")
 
+    # Команды администраторов
+    if admin_ids:
+        async def profile_handler(
+            message: types.Message,
+            command: CommandObject,
+            diagnostics: Diagnostics | None = None
+        ):
+            await profile_command(message, command, diagnostics, profile_max_duration)
+
+        dp.message.register(
+            profile_handler, Command(commands=["profile"]), F.from_user.id.in_(set(admin_ids))
+        )
+
+    # Важные даты
+    if reminders:
+        async def add_date_handler(message: types.Message, command: CommandObject):
+            await add_date_command(message, command, reminders, context_manager, reminder_max_per_user)
+
+        async def dates_handler(message: types.Message):
+            await dates_command(message, reminders)
+
+        async def delete_date_handler(message: types.Message, command: CommandObject):
+            await delete_date_command(message, command, reminders)
+
+        dp.message.register(add_date_handler, Command(commands=["adddate"]))
+        dp.message.register(dates_handler, Command(commands=["dates"]))
+        dp.message.register(delete_date_handler, Command(commands=["deldate"]))
+
     # Регистрация команды help и кнопки помощи
     dp.message.register(help_command, Command(commands=["help"]))
-    dp.message.register(help_command, F.text == "❓ Помощь")
+    dp.message.register(help_command, F.text == BUTTON_HELP)
 
     # Регистрация команды start и кнопки перезагрузки
     dp.message.register(start_command, Command(commands=["start"]))
-    dp.message.register(start_command, F.text == "🔄 Перезагрузить")
+    dp.message.register(start_command, F.text == BUTTON_RESTART)
 
     # Создаем асинхронную функцию для очистки контекста
     async def clear_handler(message: types.Message):
-        await clear_command(message, context_manager)
+        await clear_command(message, context_manager, speculative)
 
     # Регистрация команды clear и кнопки очистки
     dp.message.register(clear_handler, Command(commands=["clear"]))
-    dp.message.register(clear_handler, F.text == "❌ Очистить контекст")
+    dp.message.register(clear_handler, F.text == BUTTON_CLEAR)
 
     # Создаем асинхронный обработчик для генерации поздравления
     async def generate_handler(message: types.Message):
-        await generate_congratulation(message, context_manager, content_generator)
+        await generate_congratulation(
+            message, context_manager, content_generator,
+            streaming=streaming, stream_edit_interval=stream_edit_interval,
+            speculative=speculative, jobs=jobs, variants=variants
+        )
 
     # Регистрация генерации поздравления
-    dp.message.register(generate_handler, F.text == "✨ Создать поздравление")
+    dp.message.register(generate_handler, F.text == BUTTON_GENERATE)
+
+    # Кнопки выбора варианта поздравления
+    if variants:
+        async def variant_handler(callback: types.CallbackQuery, callback_data: VariantCallback):
+            await variant_callback(
+                callback, callback_data, variants, context_manager, content_generator, jobs
+            )
+
+        dp.callback_query.register(variant_handler, VariantCallback.filter())
+
+    # Обработчики кнопок для сообщений с опечатками в тексте кнопки
+    buttons = {
+        BUTTON_GENERATE: generate_handler,
+        BUTTON_HELP: help_command,
+        BUTTON_CLEAR: clear_handler,
+        BUTTON_RESTART: start_command,
+    }
 
     # Регистрация общего обработчика сообщений
     async def message_handler(message: types.Message):
-        await handle_message(message, context_manager, content_generator)
+        await handle_message(
+            message, context_manager, content_generator, speculative, prefilter, buttons
+        )
 
     # Регистрируем общий обработчик последним
     dp.message.register(message_handler)
@@ -141,6 +602,6 @@ def register_handlers(dp: Dispatcher, context_manager: ContextManager, content_g
 
     # Общий обработчик для остальных сообщений
     dp.message.register(
-        lambda message: handle_message(message, context_manager, content_generator),
+        lambda message: handle_message(message, context_manager, content_generator, speculative),
         flags={'allow_in_transaction': True}
     )
\ No newline at end of file
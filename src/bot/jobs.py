@@ -0,0 +1,185 @@
+"""
+Задачи генерации поздравлений, выполняемые вне обработчиков сообщений
+"""
+import base64
+import logging
+from typing import Optional
+from aiogram import Bot
+from aiogram.enums import ChatAction
+from bot.keyboards import get_main_keyboard, get_variant_keyboard
+from bot.media import send_image
+from bot.streaming import MessageStreamer
+from models.context import Context
+from models.messages import QUEUE_MESSAGE, VARIANT_MESSAGE
+from services.content_generator import ContentGenerator
+from services.job_queue import Job, JobQueue, JobWorkerPool
+from services.scheduler import Priority
+from services.variants import GreetingVariants, VariantSet
+
+logger = logging.getLogger(__name__)
+
+# Типы задач
+GREETING_JOB = "greeting"
+IMAGE_JOB = "image"
+
+
+def variant_view(variant_set: VariantSet, index: int):
+    """Текст и клавиатура сообщения с вариантом поздравления"""
+    text = VARIANT_MESSAGE.format(
+        number=index + 1, count=len(variant_set.texts), text=variant_set.texts[index]
+    )
+    return text, get_variant_keyboard(variant_set.id, index, len(variant_set.texts))
+
+
+async def send_variant(bot: Bot, chat_id: int, variant_set: VariantSet, index: int):
+    """Отправка варианта поздравления с кнопками выбора"""
+    text, keyboard = variant_view(variant_set, index)
+    await bot.send_message(chat_id, text, parse_mode=None, reply_markup=keyboard)
+
+
+class GenerationJobs:
+    """
+    Постановка и выполнение задач генерации
+
+    Обработчик кнопки только ставит задачу в очередь и сразу отвечает.
+    Задача текста доставляет поздравление в чат и ставит отдельную задачу
+    изображения, поэтому повтор после ошибки DALL-E не отправляет текст
+    второй раз. Контекст сохраняется в задаче на момент нажатия кнопки.
+
+    В режиме вариантов задача текста отправляет первый вариант
+    с кнопками выбора, а задачу изображения ставит обработчик выбора.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        queue: JobQueue,
+        content_generator: ContentGenerator,
+        streaming: bool = False,
+        stream_edit_interval: float = 1.0,
+        variants: Optional[GreetingVariants] = None
+    ):
+        """
+        Args:
+            bot: экземпляр бота для доставки результатов
+            queue: очередь задач
+            content_generator: генератор контента
+            streaming: выводить текст поздравления по мере генерации
+            stream_edit_interval: минимальный интервал между редактированиями, сек
+            variants: режим вариантов поздравления (необязательно)
+        """
+        self.bot = bot
+        self.queue = queue
+        self.content_generator = content_generator
+        self.streaming = streaming
+        self.stream_edit_interval = stream_edit_interval
+        self.variants = variants
+        self.pool: Optional[JobWorkerPool] = None
+
+    @property
+    def handlers(self):
+        """Обработчики по типам задач для JobWorkerPool"""
+        return {GREETING_JOB: self._greeting, IMAGE_JOB: self._image}
+
+    def enqueue_greeting(self, user_id: int, chat_id: int, context: Context) -> bool:
+        """
+        Постановка задачи генерации поздравления
+
+        Returns:
+            bool: False, если поздравление для пользователя уже готовится
+        """
+        job_id = self.queue.enqueue(
+            GREETING_JOB, user_id, chat_id,
+            {"context": base64.b64encode(context.to_bytes()).decode("ascii")},
+            priority=Priority.GREETING,
+            dedup_key=f"{GREETING_JOB}:{user_id}"
+        )
+        if job_id is None:
+            return False
+        logger.info("Задача поздравления %s для пользователя %s поставлена в очередь", job_id, user_id)
+        self._notify()
+        return True
+
+    def enqueue_image(self, user_id: int, chat_id: int, greeting_text: str, dedup_key: str) -> bool:
+        """
+        Постановка задачи открытки к уже отправленному тексту
+
+        Returns:
+            bool: False, если такая задача уже поставлена
+        """
+        job_id = self.queue.enqueue(
+            IMAGE_JOB, user_id, chat_id, {"text": greeting_text},
+            priority=Priority.IMAGE,
+            dedup_key=f"{IMAGE_JOB}:{dedup_key}"
+        )
+        if job_id is None:
+            return False
+        self._notify()
+        return True
+
+    async def on_failure(self, job: Job, error: BaseException):
+        """Сообщение пользователю после последней неудачной попытки"""
+        if job.kind == IMAGE_JOB:
+            text = "Не удалось создать открытку, но текст поздравления готов."
+        else:
+            text = "Произошла ошибка при генерации поздравления. Попробуйте позже."
+        await self.bot.send_message(job.chat_id, text, reply_markup=get_main_keyboard())
+
+    async def _greeting(self, job: Job):
+        context = Context.from_bytes(base64.b64decode(job.payload["context"]))
+        if self.variants:
+            await self.bot.send_chat_action(job.chat_id, ChatAction.TYPING)
+            variant_set = await self.variants.generate(
+                job.user_id, context, on_queued=self._notifier(job.chat_id)
+            )
+            await send_variant(self.bot, job.chat_id, variant_set, 0)
+            logger.info("Варианты поздравления доставлены пользователю %s", job.user_id)
+            return
+        if self.streaming:
+            greeting_text = await self._stream(job, context)
+        else:
+            await self.bot.send_chat_action(job.chat_id, ChatAction.TYPING)
+            greeting_text = await self.content_generator.generate_greeting(
+                context, job.user_id, on_queued=self._notifier(job.chat_id)
+            )
+            await self.bot.send_message(job.chat_id, greeting_text, parse_mode=None)
+        logger.info("Текст поздравления доставлен пользователю %s", job.user_id)
+        self.enqueue_image(job.user_id, job.chat_id, greeting_text, str(job.id))
+
+    async def _stream(self, job: Job, context: Context) -> str:
+        """Потоковый вывод текста в сообщение-заглушку"""
+        placeholder = await self.bot.send_message(job.chat_id, "✍️ Пишу поздравление...")
+        streamer = MessageStreamer(placeholder, self.stream_edit_interval)
+        try:
+            async for chunk in self.content_generator.stream_greeting(
+                    context, job.user_id, on_queued=self._notifier(job.chat_id)):
+                await streamer.feed(chunk)
+        except Exception:
+            # Недописанный текст не оставляем: при повторе будет новое сообщение
+            try:
+                await placeholder.delete()
+            except Exception as e:
+                logger.debug("Не удалось удалить заглушку: %s", e)
+            raise
+        return await streamer.finish()
+
+    async def _image(self, job: Job):
+        await self.bot.send_chat_action(job.chat_id, ChatAction.UPLOAD_PHOTO)
+        image = await self.content_generator.generate_image(
+            job.payload["text"], job.user_id, on_queued=self._notifier(job.chat_id)
+        )
+        await send_image(
+            self.bot, job.chat_id, image, self.content_generator.assets,
+            reply_markup=get_main_keyboard()
+        )
+        logger.info("Открытка доставлена пользователю %s", job.user_id)
+
+    def _notifier(self, chat_id: int):
+        """Уведомление о позиции в очереди планировщика"""
+        async def notify(position: int):
+            await self.bot.send_message(chat_id, QUEUE_MESSAGE.format(position=position))
+        return notify
+
+    def _notify(self):
+        if self.pool:
+            self.pool.notify()
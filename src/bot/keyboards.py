@@ -1,7 +1,43 @@
 """
 Клавиатуры бота
 """
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import (
+    InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup
+)
+
+# Тексты кнопок основной клавиатуры
+BUTTON_GENERATE = "✨ Создать поздравление"
+BUTTON_HELP = "❓ Помощь"
+BUTTON_CLEAR = "❌ Очистить контекст"
+BUTTON_RESTART = "🔄 Перезагрузить"
+
+# Другие формулировки тех же действий (распознаются только при точном совпадении)
+BUTTON_ALIASES = {
+    BUTTON_GENERATE: ("создай поздравление", "сгенерируй поздравление"),
+    BUTTON_HELP: ("помощь", "помоги", "справка"),
+    BUTTON_CLEAR: ("очисти контекст", "начать заново"),
+    BUTTON_RESTART: ("перезагрузка", "перезапуск"),
+}
+
+# Команды с тем же действием, что и кнопки
+BUTTON_COMMANDS = {
+    "congratulation": BUTTON_GENERATE,
+    "help": BUTTON_HELP,
+    "clear": BUTTON_CLEAR,
+    "start": BUTTON_RESTART,
+}
+
+# Действия inline-клавиатуры вариантов поздравления
+VARIANT_CHOOSE = "choose"
+VARIANT_NEXT = "next"
+VARIANT_MORE = "more"
+
+class VariantCallback(CallbackData, prefix="variant"):
+    """Нажатие кнопки под вариантом поздравления"""
+    action: str
+    set_id: int
+    index: int
 
 def get_main_keyboard() -> ReplyKeyboardMarkup:
     """
@@ -9,16 +45,37 @@ def get_main_keyboard() -> ReplyKeyboardMarkup:
     """
     keyboard = [
         [
-            KeyboardButton(text="✨ Создать поздравление"),
-            KeyboardButton(text="❓ Помощь")
+            KeyboardButton(text=BUTTON_GENERATE),
+            KeyboardButton(text=BUTTON_HELP)
         ],
         [
-            KeyboardButton(text="❌ Очистить контекст"), 
-            KeyboardButton(text="🔄 Перезагрузить")
+            KeyboardButton(text=BUTTON_CLEAR), 
+            KeyboardButton(text=BUTTON_RESTART)
         ]
     ]
     return ReplyKeyboardMarkup(
         keyboard=keyboard,
         resize_keyboard=True,
         input_field_placeholder="Расскажите о человеке..."
-    )
\ No newline at end of file
+    )
+
+def get_variant_keyboard(set_id: int, index: int, count: int) -> InlineKeyboardMarkup:
+    """
+    Клавиатура под вариантом поздравления: выбор и следующий вариант
+    (под последним вариантом - запрос новых)
+    """
+    if index + 1 < count:
+        other = InlineKeyboardButton(
+            text="➡️ Другой вариант",
+            callback_data=VariantCallback(action=VARIANT_NEXT, set_id=set_id, index=index).pack()
+        )
+    else:
+        other = InlineKeyboardButton(
+            text="🔄 Новые варианты",
+            callback_data=VariantCallback(action=VARIANT_MORE, set_id=set_id, index=index).pack()
+        )
+    choose = InlineKeyboardButton(
+        text="✅ Выбрать",
+        callback_data=VariantCallback(action=VARIANT_CHOOSE, set_id=set_id, index=index).pack()
+    )
+    return InlineKeyboardMarkup(inline_keyboard=[[choose, other]])
@@ -0,0 +1,48 @@
+"""
+Отправка изображений открыток
+"""
+import logging
+from typing import Optional
+from aiogram import Bot, types
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import BufferedInputFile
+from services.image_assets import ImageAssets
+from utils.metrics import PHOTO_SEND_LATENCY
+
+logger = logging.getLogger(__name__)
+
+
+async def send_image(
+    bot: Bot,
+    chat_id: int,
+    image: str,
+    assets: Optional[ImageAssets] = None,
+    **kwargs
+) -> types.Message:
+    """
+    Отправка изображения открытки
+
+    Сохраненное изображение отправляется по file_id, если оно уже
+    загружалось в Telegram, иначе файл загружается один раз и его
+    file_id запоминается. Обычный URL передается Telegram как есть.
+    """
+    if not assets or not assets.is_asset(image):
+        with PHOTO_SEND_LATENCY.time(mode="url"):
+            return await bot.send_photo(chat_id, image, **kwargs)
+
+    file_id = assets.file_id(image)
+    if file_id:
+        try:
+            with PHOTO_SEND_LATENCY.time(mode="file_id"):
+                sent = await bot.send_photo(chat_id, file_id, **kwargs)
+            assets.reused += 1
+            return sent
+        except TelegramBadRequest as e:
+            logger.warning("file_id изображения %s не принят: %s", image, e)
+            assets.forget(image)
+
+    data, filename = await assets.read(image)
+    with PHOTO_SEND_LATENCY.time(mode="upload"):
+        sent = await bot.send_photo(chat_id, BufferedInputFile(data, filename), **kwargs)
+    assets.remember(image, sent.photo[-1].file_id)
+    return sent
@@ -0,0 +1,332 @@
+"""
+Распределение пользователей бота по нескольким процессам
+"""
+import asyncio
+import bisect
+import dataclasses
+import hashlib
+import logging
+import multiprocessing
+import queue
+import signal
+import time
+from typing import Any, Dict, List, Optional
+import httpx
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from config import Config, DEFAULT_TELEGRAM_API_URL, load_config
+from bot.webhook import UpdateFeeder, WebhookServer, install_stop_signals, update_user_id
+from utils.logger import setup_logging_from_config
+from utils.metrics import QUEUE_DEPTH
+
+logger = logging.getLogger(__name__)
+
+# Интервал обновления отметки жизни воркера, сек
+HEARTBEAT_INTERVAL = 1.0
+
+# Тайм-аут long polling в запросе getUpdates, сек
+POLLING_TIMEOUT = 25
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Консистентное хеширование пользователей по шардам
+
+    При изменении числа шардов переезжает только небольшая доля
+    пользователей, остальные остаются в прежних процессах.
+    """
+
+    def __init__(self, shards: int, replicas: int = 100):
+        """
+        Args:
+            shards: число шардов
+            replicas: число виртуальных узлов на шард
+        """
+        points = sorted(
+            (_hash(f"{shard}:{replica}"), shard)
+            for shard in range(shards)
+            for replica in range(replicas)
+        )
+        self._keys = [key for key, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def shard(self, user_id: int) -> int:
+        """Номер шарда пользователя"""
+        index = bisect.bisect(self._keys, _hash(str(user_id))) % len(self._keys)
+        return self._shards[index]
+
+
+class ShardSupervisor:
+    """
+    Запуск и контроль процессов-шардов
+
+    Каждый шард - отдельный процесс со своим ботом, диспетчером,
+    ContextManager и пулом соединений AIService. Обновления одного
+    пользователя всегда попадают в один шард и обрабатываются там
+    по порядку, поэтому общего состояния между процессами нет.
+    Процессы, которые завершились или перестали обновлять отметку
+    жизни, перезапускаются.
+    """
+
+    def __init__(
+        self,
+        shards: int,
+        queue_size: int = 1000,
+        heartbeat_timeout: float = 30.0,
+        check_interval: float = 5.0
+    ):
+        """
+        Args:
+            shards: число процессов
+            queue_size: предел очереди обновлений каждого процесса
+            heartbeat_timeout: через сколько секунд без отметки жизни процесс перезапускается
+            check_interval: период проверки процессов, сек
+        """
+        logger.info(f"Инициализация ShardSupervisor: {shards} процессов")
+        self.shards = shards
+        self.queue_size = queue_size
+        self.heartbeat_timeout = heartbeat_timeout
+        self.check_interval = check_interval
+        self.ring = HashRing(shards)
+        self.restarts = 0
+        self._mp = multiprocessing.get_context("spawn")
+        self._queues: List[Any] = [None] * shards
+        self._heartbeats: List[Any] = [None] * shards
+        self._processes: List[Any] = [None] * shards
+        self._monitor: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Запуск всех процессов и контроля их состояния"""
+        for index in range(self.shards):
+            self._spawn(index)
+        self._monitor = asyncio.create_task(self._watch())
+
+    def submit(self, update: Dict[str, Any]) -> bool:
+        """
+        Передача обновления в шард его пользователя
+
+        Returns:
+            bool: False, если очередь шарда переполнена
+        """
+        index = self.ring.shard(update_user_id(update))
+        try:
+            self._queues[index].put_nowait(update)
+        except queue.Full:
+            logger.warning(f"Очередь шарда {index} переполнена, update {update.get('update_id')} отклонен")
+            return False
+        return True
+
+    async def stop(self, timeout: float = 10.0):
+        """Остановка процессов с дообработкой их очередей"""
+        if self._monitor:
+            self._monitor.cancel()
+            await asyncio.gather(self._monitor, return_exceptions=True)
+        deadline = time.monotonic() + timeout
+        for updates in self._queues:
+            try:
+                await asyncio.to_thread(updates.put, None, True, max(0.1, deadline - time.monotonic()))
+            except queue.Full:
+                pass
+        for index, process in enumerate(self._processes):
+            await asyncio.to_thread(process.join, max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning(f"Шард {index} не остановился вовремя, завершение")
+                process.terminate()
+                await asyncio.to_thread(process.join, 5)
+        logger.info(f"Шарды остановлены, перезапусков за время работы: {self.restarts}")
+
+    def _spawn(self, index: int, pending: Optional[List[Dict[str, Any]]] = None):
+        updates = self._mp.Queue(self.queue_size)
+        for update in pending or []:
+            updates.put_nowait(update)
+        # Запас времени на инициализацию бота в новом процессе
+        heartbeat = self._mp.Value("d", time.time() + self.heartbeat_timeout, lock=False)
+        process = self._mp.Process(
+            target=_worker_entry,
+            args=(index, updates, heartbeat),
+            name=f"bot-shard-{index}"
+        )
+        process.start()
+        self._queues[index] = updates
+        self._heartbeats[index] = heartbeat
+        self._processes[index] = process
+        logger.info(f"Шард {index} запущен, pid {process.pid}")
+
+    async def _restart(self, index: int):
+        process = self._processes[index]
+        if process.is_alive():
+            process.terminate()
+            await asyncio.to_thread(process.join, 5)
+        # Необработанные обновления переносятся в очередь нового процесса
+        pending = []
+        old_queue = self._queues[index]
+        try:
+            while len(pending) < self.queue_size:
+                update = old_queue.get_nowait()
+                if update is not None:
+                    pending.append(update)
+        except (queue.Empty, OSError, EOFError):
+            pass
+        old_queue.close()
+        self.restarts += 1
+        self._spawn(index, pending)
+
+    async def _watch(self):
+        """Проверка процессов и перезапуск зависших и завершившихся"""
+        while True:
+            await asyncio.sleep(self.check_interval)
+            now = time.time()
+            for index, process in enumerate(self._processes):
+                stale = now - self._heartbeats[index].value > self.heartbeat_timeout
+                if process.is_alive() and not stale:
+                    continue
+                reason = "не отвечает" if process.is_alive() else f"завершился с кодом {process.exitcode}"
+                logger.error(f"Шард {index} {reason}, перезапуск")
+                await self._restart(index)
+
+
+def _worker_entry(index: int, updates, heartbeat):
+    """Точка входа процесса-шарда"""
+    # Остановкой управляет основной процесс
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_worker_main(index, updates, heartbeat))
+
+
+async def _worker_main(index: int, updates, heartbeat):
+    """Обработка обновлений своего шарда до получения None"""
+    # Сервисы нужны только шардам, основной процесс их не загружает
+    from bot.bot import close_services, create_bot, start_diagnostics
+
+    config = load_config()
+    setup_logging_from_config(config)
+    # Каждый шард отдает метрики на своем порту
+    config = dataclasses.replace(config, metrics_port=config.metrics_port + index + 1)
+    diagnostics = None
+    if config.diagnostics_enabled:
+        diagnostics = start_diagnostics(config, name=f"shard-{index}")
+    bot, dp = await create_bot(config)
+    dp["diagnostics"] = diagnostics
+    feeder = UpdateFeeder(
+        bot, dp,
+        queue_size=config.webhook_queue_size,
+        workers=config.webhook_workers
+    )
+    QUEUE_DEPTH.set_function(lambda: feeder.queue_size, queue="shard_updates")
+
+    async def beat():
+        while True:
+            heartbeat.value = time.time()
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+    beat_task = asyncio.create_task(beat())
+    await dp.emit_startup(bot=bot, **dp.workflow_data)
+    feeder.start()
+    logger.info(f"Шард {index} готов к работе")
+    try:
+        while True:
+            try:
+                update = await asyncio.to_thread(updates.get, True, HEARTBEAT_INTERVAL)
+            except queue.Empty:
+                continue
+            if update is None:
+                break
+            while not feeder.submit(update):
+                await asyncio.sleep(0.05)
+    finally:
+        await feeder.drain(config.webhook_drain_timeout)
+        beat_task.cancel()
+        await dp.emit_shutdown(bot=bot, **dp.workflow_data)
+        await close_services(dp)
+        await bot.session.close()
+        if diagnostics:
+            await diagnostics.stop()
+        logger.info(f"Шард {index} остановлен")
+
+
+async def poll_updates(
+    token: str,
+    supervisor: ShardSupervisor,
+    stop_event: asyncio.Event,
+    api_url: str = DEFAULT_TELEGRAM_API_URL
+):
+    """
+    Получение обновлений через getUpdates без разбора в aiogram
+
+    Обновления передаются в шарды как есть, подтверждение (offset)
+    отправляется только после постановки в очередь шарда.
+    """
+    url = f"{api_url.rstrip('/')}/bot{token}/getUpdates"
+    offset = 0
+    async with httpx.AsyncClient(timeout=POLLING_TIMEOUT + 10) as client:
+        try:
+            while not stop_event.is_set():
+                try:
+                    response = await client.post(
+                        url, json={"offset": offset, "timeout": POLLING_TIMEOUT}
+                    )
+                    payload = response.json()
+                except (httpx.HTTPError, ValueError) as e:
+                    logger.error(f"Ошибка получения обновлений: {str(e)}")
+                    await asyncio.sleep(1)
+                    continue
+                if not payload.get("ok"):
+                    logger.error(f"Telegram отклонил getUpdates: {payload.get('description')}")
+                    await asyncio.sleep(payload.get("parameters", {}).get("retry_after", 1))
+                    continue
+                for update in payload["result"]:
+                    while not supervisor.submit(update):
+                        await asyncio.sleep(0.05)
+                    offset = update["update_id"] + 1
+        finally:
+            if offset:
+                # Подтверждение последних обновлений, чтобы они не пришли повторно
+                try:
+                    await client.post(url, json={"offset": offset, "timeout": 0})
+                except httpx.HTTPError as e:
+                    logger.error(f"Не удалось подтвердить обновления: {str(e)}")
+
+
+async def run_sharded(config: Config):
+    """Запуск основного процесса: прием обновлений и маршрутизация по шардам"""
+    supervisor = ShardSupervisor(
+        config.shard_workers,
+        queue_size=config.shard_queue_size,
+        heartbeat_timeout=config.shard_heartbeat_timeout
+    )
+    supervisor.start()
+    try:
+        if config.webhook_enabled:
+            bot = Bot(
+                token=config.telegram_token,
+                session=AiohttpSession(api=TelegramAPIServer.from_base(config.telegram_api_url))
+            )
+            server = WebhookServer(
+                bot,
+                path=config.webhook_path,
+                secret_token=config.webhook_secret,
+                submit=supervisor.submit
+            )
+            try:
+                await server.serve(
+                    config.webhook_host, config.webhook_port,
+                    url=config.webhook_url,
+                    drain_timeout=config.webhook_drain_timeout
+                )
+            finally:
+                await bot.session.close()
+        else:
+            stop_event = asyncio.Event()
+            install_stop_signals(stop_event.set)
+            polling = asyncio.create_task(poll_updates(
+                config.telegram_token, supervisor, stop_event, config.telegram_api_url
+            ))
+            await stop_event.wait()
+            polling.cancel()
+            await asyncio.gather(polling, return_exceptions=True)
+    finally:
+        await supervisor.stop(config.webhook_drain_timeout)
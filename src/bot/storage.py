@@ -0,0 +1,182 @@
+"""
+Хранилище состояний FSM и защита от повторной обработки обновлений
+"""
+import json
+import logging
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional
+from aiogram import BaseMiddleware
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import TelegramObject, Update
+from utils.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_UPDATES = REGISTRY.counter(
+    "bot_duplicate_updates_total", "Повторно доставленные обновления, пропущенные без обработки"
+)
+
+# Telegram хранит неподтвержденные обновления до суток
+DEFAULT_UPDATE_TTL = 86400.0
+# Интервал удаления устаревших id обновлений, сек
+PURGE_INTERVAL = 60.0
+
+
+def _state_name(state: StateType) -> Optional[str]:
+    return state.state if isinstance(state, State) else state
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище состояний и данных FSM в SQLite
+
+    Состояния переживают перезапуск, а базу можно разделять между
+    процессами (шарды, отдельный обработчик задач). Запись - одна
+    строка на ключ: данные хранятся в JSON.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: путь к файлу базы данных
+        """
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS fsm ("
+            "key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL DEFAULT '{}', "
+            "updated_at REAL NOT NULL)"
+        )
+        self._db.commit()
+        logger.info("Хранилище состояний FSM SQLite: %s", path)
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return ":".join(
+            str(part) for part in (key.bot_id, key.chat_id, key.user_id, key.thread_id or "", key.destiny)
+        )
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        self._db.execute(
+            "INSERT INTO fsm (key, state, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+            (self._key(key), _state_name(state), time.time())
+        )
+        self._db.commit()
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        row = self._db.execute("SELECT state FROM fsm WHERE key = ?", (self._key(key),)).fetchone()
+        return row[0] if row else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        self._db.execute(
+            "INSERT INTO fsm (key, data, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+            (self._key(key), json.dumps(data, ensure_ascii=False), time.time())
+        )
+        self._db.commit()
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        row = self._db.execute("SELECT data FROM fsm WHERE key = ?", (self._key(key),)).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    async def close(self) -> None:
+        self._db.close()
+
+
+def create_storage(db_path: str | None = None) -> BaseStorage:
+    """
+    Создание хранилища FSM по настройкам
+
+    Args:
+        db_path: путь к базе SQLite; если не задан, состояния хранятся только в памяти
+    """
+    if not db_path:
+        logger.warning("Состояния FSM хранятся только в памяти, при перезапуске они будут потеряны")
+        return MemoryStorage()
+    return SQLiteStorage(db_path)
+
+
+class UpdateDeduplicator:
+    """
+    Индекс обработанных update_id в SQLite
+
+    id обновления захватывается вставкой до обработки: повторно
+    доставленное после перезапуска или сбоя обновление не захватывается
+    и пропускается, в том числе если его получил другой процесс.
+    Обновление, обработка которого прервалась сбоем, не повторяется:
+    лишний ответ и повторная оплата запросов к OpenAI хуже пропуска.
+    """
+
+    def __init__(self, path: str, ttl: float = DEFAULT_UPDATE_TTL):
+        """
+        Args:
+            path: путь к файлу базы данных
+            ttl: сколько секунд хранить id обработанного обновления
+        """
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.duplicates = 0
+        self._purged = 0.0
+        self._db = sqlite3.connect(path, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS processed_updates ("
+            "bot_id INTEGER NOT NULL, update_id INTEGER NOT NULL, created_at REAL NOT NULL, "
+            "PRIMARY KEY (bot_id, update_id)) WITHOUT ROWID"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS processed_updates_created ON processed_updates (created_at)"
+        )
+        self._db.commit()
+        logger.info("Индекс обработанных обновлений SQLite: %s", path)
+
+    def claim(self, bot_id: int, update_id: int) -> bool:
+        """
+        Захват обновления на обработку
+
+        Returns:
+            bool: False, если обновление уже обработано
+        """
+        now = time.time()
+        if now - self._purged > PURGE_INTERVAL:
+            self._purged = now
+            self._db.execute("DELETE FROM processed_updates WHERE created_at < ?", (now - self.ttl,))
+        cursor = self._db.execute(
+            "INSERT OR IGNORE INTO processed_updates (bot_id, update_id, created_at) VALUES (?, ?, ?)",
+            (bot_id, update_id, now)
+        )
+        self._db.commit()
+        if cursor.rowcount:
+            return True
+        self.duplicates += 1
+        DUPLICATE_UPDATES.inc()
+        return False
+
+    def close(self):
+        self._db.close()
+
+
+class UpdateDedupMiddleware(BaseMiddleware):
+    """Внешний middleware dp.update: повторно доставленные обновления не обрабатываются"""
+
+    def __init__(self, deduplicator: UpdateDeduplicator):
+        self.deduplicator = deduplicator
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        if isinstance(event, Update) and not self.deduplicator.claim(data["bot"].id, event.update_id):
+            logger.info("Обновление %s уже обработано, пропуск", event.update_id)
+            return None
+        return await handler(event, data)
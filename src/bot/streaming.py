@@ -0,0 +1,76 @@
+"""
+Потоковый вывод текста в сообщение Telegram
+"""
+import asyncio
+import logging
+import time
+from aiogram import types
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Максимальная длина текста сообщения Telegram
+MAX_MESSAGE_LENGTH = 4096
+
+
+class MessageStreamer:
+    """
+    Постепенное заполнение сообщения текстом из потока
+
+    Сообщение редактируется не чаще одного раза в interval секунд,
+    чтобы не упираться в лимиты Bot API. Разметка при редактировании
+    не используется: незаконченный фрагмент может содержать
+    незакрытые HTML-теги.
+    """
+
+    def __init__(self, message: types.Message, interval: float = 1.0, cursor: str = " ▌"):
+        """
+        Args:
+            message: сообщение бота, которое будет редактироваться
+            interval: минимальный интервал между редактированиями, сек
+            cursor: маркер, который показывается, пока текст не готов
+        """
+        self.message = message
+        self.interval = interval
+        self.cursor = cursor
+        self.text = ""
+        self._sent = ""
+        self._next_edit = 0.0
+
+    async def feed(self, chunk: str):
+        """Добавление фрагмента текста и, если пора, обновление сообщения"""
+        self.text += chunk
+        if time.monotonic() >= self._next_edit:
+            await self._edit(self.text + self.cursor, final=False)
+
+    async def finish(self) -> str:
+        """
+        Вывод окончательного текста
+
+        Returns:
+            str: полный текст
+        """
+        await self._edit(self.text, final=True)
+        return self.text
+
+    async def _edit(self, text: str, final: bool):
+        text = text[:MAX_MESSAGE_LENGTH]
+        if not text.strip() or text == self._sent:
+            return
+        while True:
+            try:
+                await self.message.edit_text(text, parse_mode=None)
+                break
+            except TelegramRetryAfter as e:
+                logger.warning("Лимит редактирования сообщений, пауза %s сек", e.retry_after)
+                if not final:
+                    # Промежуточное обновление пропускаем, следующее - после паузы
+                    self._next_edit = time.monotonic() + e.retry_after
+                    return
+                await asyncio.sleep(e.retry_after)
+            except TelegramBadRequest as e:
+                if "message is not modified" not in str(e):
+                    raise
+                break
+        self._sent = text
+        self._next_edit = time.monotonic() + self.interval
@@ -0,0 +1,271 @@
+"""
+Прием обновлений Telegram через webhook
+"""
+import asyncio
+import hmac
+import logging
+import signal
+from typing import Any, Callable, Dict, List, Optional
+from aiogram import Bot, Dispatcher
+from aiohttp import web
+from config import Config
+from utils.metrics import QUEUE_DEPTH
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# Типы обновлений, в которых есть отправитель
+_USER_UPDATE_TYPES = (
+    "message", "edited_message", "callback_query", "inline_query",
+    "chosen_inline_result", "my_chat_member", "chat_member", "chat_join_request",
+    "pre_checkout_query", "shipping_query",
+)
+
+
+def update_user_id(update: Dict[str, Any]) -> int:
+    """ID отправителя обновления (или update_id, если отправителя нет)"""
+    for update_type in _USER_UPDATE_TYPES:
+        payload = update.get(update_type)
+        if payload and "from" in payload:
+            return payload["from"]["id"]
+    return update.get("update_id", 0)
+
+
+class UpdateFeeder:
+    """
+    Передача принятых обновлений в диспетчер
+
+    Очереди разделены по пользователям: обновления одного пользователя
+    попадают в одну очередь и обрабатываются по порядку, а разные
+    пользователи обслуживаются параллельно.
+    """
+
+    def __init__(self, bot: Bot, dp: Dispatcher, queue_size: int = 1000, workers: int = 16):
+        """
+        Args:
+            bot: экземпляр бота
+            dp: диспетчер
+            queue_size: общий предел очереди необработанных обновлений
+            workers: число обработчиков (и очередей)
+        """
+        self.bot = bot
+        self.dp = dp
+        per_worker = max(1, queue_size // workers)
+        self._queues: List[asyncio.Queue] = [asyncio.Queue(per_worker) for _ in range(workers)]
+        self._workers: List[asyncio.Task] = []
+
+    @property
+    def queue_size(self) -> int:
+        """Число обновлений, ожидающих обработки"""
+        return sum(queue.qsize() for queue in self._queues)
+
+    def start(self):
+        """Запуск обработчиков"""
+        self._workers = [
+            asyncio.create_task(self._work(queue), name=f"update-worker-{index}")
+            for index, queue in enumerate(self._queues)
+        ]
+
+    def submit(self, update: Dict[str, Any]) -> bool:
+        """
+        Постановка обновления в очередь его пользователя
+
+        Returns:
+            bool: False, если очередь переполнена
+        """
+        queue = self._queues[update_user_id(update) % len(self._queues)]
+        try:
+            queue.put_nowait(update)
+        except asyncio.QueueFull:
+            logger.warning(f"Очередь обновлений переполнена, update {update.get('update_id')} отклонен")
+            return False
+        return True
+
+    async def drain(self, timeout: float = 10.0):
+        """Дообработка принятых обновлений и остановка обработчиков"""
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(queue.join() for queue in self._queues)), timeout
+            )
+        except asyncio.TimeoutError:
+            logger.warning(f"Не дообработано обновлений: {self.queue_size}")
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+    async def _work(self, queue: asyncio.Queue):
+        """Последовательная обработка обновлений одной очереди"""
+        while True:
+            update = await queue.get()
+            try:
+                await self.dp.feed_raw_update(self.bot, update)
+            except Exception as e:
+                logger.error(
+                    f"Ошибка при обработке update {update.get('update_id')}: {str(e)}",
+                    exc_info=True
+                )
+            finally:
+                queue.task_done()
+
+
+class WebhookServer:
+    """
+    Встроенный aiohttp-сервер для приема обновлений
+
+    Запрос подтверждается ответом 200 сразу после проверки секретного
+    токена и постановки обновления в очередь, обработка идет в фоне
+    (UpdateFeeder или переданный submit, например маршрутизатор шардов).
+    При переполнении или остановке сервер отвечает 503, и Telegram
+    повторит доставку позже (в том числе в другой процесс за балансировщиком).
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        dp: Optional[Dispatcher] = None,
+        path: str = "/webhook",
+        secret_token: str = "",
+        queue_size: int = 1000,
+        workers: int = 16,
+        submit: Optional[Callable[[Dict[str, Any]], bool]] = None
+    ):
+        """
+        Args:
+            bot: экземпляр бота
+            dp: диспетчер (не нужен, если задан submit)
+            path: путь, на который Telegram отправляет обновления
+            secret_token: секрет из заголовка X-Telegram-Bot-Api-Secret-Token
+            queue_size: общий предел очереди необработанных обновлений
+            workers: число обработчиков (и очередей)
+            submit: собственный обработчик принятых обновлений
+        """
+        logger.info("Инициализация WebhookServer")
+        if not secret_token:
+            logger.warning("Секретный токен webhook не задан, запросы не проверяются")
+        self.bot = bot
+        self.dp = dp
+        self.path = path
+        self.secret_token = secret_token
+        self.feeder = UpdateFeeder(bot, dp, queue_size, workers) if submit is None else None
+        self._submit = submit or self.feeder.submit
+        self._runner: Optional[web.AppRunner] = None
+        self._accepting = False
+        self._stop_event = asyncio.Event()
+        self.app = web.Application()
+        self.app.router.add_post(path, self.handle)
+        self.app.router.add_get("/healthz", self.health)
+
+    @property
+    def queue_size(self) -> int:
+        """Число обновлений, ожидающих обработки"""
+        return self.feeder.queue_size if self.feeder else 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        """Прием обновления от Telegram"""
+        if self.secret_token:
+            token = request.headers.get(SECRET_HEADER, "")
+            if not hmac.compare_digest(token, self.secret_token):
+                logger.warning(f"Запрос webhook с неверным токеном от {request.remote}")
+                return web.Response(status=401)
+        if not self._accepting:
+            return web.Response(status=503)
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        if not self._submit(update):
+            return web.Response(status=503)
+        return web.Response()
+
+    async def health(self, request: web.Request) -> web.Response:
+        """Проверка состояния для балансировщика"""
+        return web.json_response(
+            {"accepting": self._accepting, "queue": self.queue_size},
+            status=200 if self._accepting else 503
+        )
+
+    async def start(self, host: str, port: int, url: str = ""):
+        """
+        Запуск обработчиков и HTTP-сервера
+
+        Args:
+            host: адрес для прослушивания
+            port: порт
+            url: публичный адрес webhook для регистрации в Telegram (необязательно)
+        """
+        if self.feeder:
+            await self.dp.emit_startup(bot=self.bot, **self.dp.workflow_data)
+            self.feeder.start()
+        self._runner = web.AppRunner(self.app, handle_signals=False)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        self._accepting = True
+        logger.info(f"Webhook-сервер слушает {host}:{port}{self.path}")
+
+        if url:
+            allowed_updates = self.dp.resolve_used_update_types() if self.dp else None
+            await self.bot.set_webhook(
+                url,
+                secret_token=self.secret_token or None,
+                allowed_updates=allowed_updates
+            )
+            logger.info(f"Webhook зарегистрирован: {url}")
+
+    async def stop(self, drain_timeout: float = 10.0):
+        """
+        Остановка с дообработкой принятых обновлений
+
+        Новые обновления получают 503, уже принятые обрабатываются
+        не дольше drain_timeout секунд.
+        """
+        self._accepting = False
+        logger.info(f"Остановка webhook-сервера, в очереди {self.queue_size} обновлений")
+        if self.feeder:
+            await self.feeder.drain(drain_timeout)
+        if self._runner:
+            await self._runner.cleanup()
+        if self.feeder:
+            await self.dp.emit_shutdown(bot=self.bot, **self.dp.workflow_data)
+        logger.info("Webhook-сервер остановлен")
+
+    def request_stop(self):
+        """Запрос остановки (например, из обработчика сигнала)"""
+        self._stop_event.set()
+
+    async def serve(self, host: str, port: int, url: str = "", drain_timeout: float = 10.0):
+        """Работа до сигнала остановки (SIGINT/SIGTERM) или отмены"""
+        install_stop_signals(self.request_stop)
+        await self.start(host, port, url)
+        try:
+            await self._stop_event.wait()
+        finally:
+            await self.stop(drain_timeout)
+
+
+def install_stop_signals(callback: Callable[[], None]):
+    """Остановка по SIGINT/SIGTERM через цикл событий (где это поддерживается)"""
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, callback)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher, config: Config):
+    """Запуск бота в режиме webhook по настройкам"""
+    server = WebhookServer(
+        bot, dp,
+        path=config.webhook_path,
+        secret_token=config.webhook_secret,
+        queue_size=config.webhook_queue_size,
+        workers=config.webhook_workers
+    )
+    dp["webhook_server"] = server
+    QUEUE_DEPTH.set_function(lambda: server.queue_size, queue="webhook_updates")
+    await server.serve(
+        config.webhook_host, config.webhook_port,
+        url=config.webhook_url,
+        drain_timeout=config.webhook_drain_timeout
+    )
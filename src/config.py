@@ -10,6 +10,167 @@ DEFAULT_PROXY_ENABLED = True  # Включить/выключить прокси
 DEFAULT_PROXY_HOST = "185.89.41.214"  # Адрес прокси-сервера (например, "proxy.example.com")
 DEFAULT_PROXY_PORT = 8000  # Порт прокси-сервера (например, 8080)
 
+# Константы для пула HTTP-соединений к OpenAI
+DEFAULT_OPENAI_MAX_CONNECTIONS = 100  # Максимум одновременных соединений
+DEFAULT_OPENAI_MAX_KEEPALIVE = 20  # Максимум простаивающих keep-alive соединений
+DEFAULT_OPENAI_KEEPALIVE_EXPIRY = 30.0  # Время жизни keep-alive соединения, сек
+DEFAULT_OPENAI_HTTP2 = True  # Использовать HTTP/2 (при наличии пакета h2)
+
+# Константы для адресов API (переопределяются для бенчмарков с локальными серверами)
+DEFAULT_OPENAI_BASE_URL = ""  # Адрес OpenAI API ("" - адрес по умолчанию клиента OpenAI)
+DEFAULT_TELEGRAM_API_URL = "https://api.telegram.org"  # Адрес Telegram Bot API
+
+# Константы для планировщика запросов к OpenAI
+DEFAULT_SCHEDULER_ENABLED = True  # Включить очередь и лимиты запросов
+DEFAULT_SCHEDULER_MAX_QUEUE = 200  # Максимум ожидающих запросов
+DEFAULT_SCHEDULER_MAX_USER_QUEUE = 3  # Максимум ожидающих запросов одного пользователя
+DEFAULT_SCHEDULER_MAX_CONCURRENCY = 0  # Общий лимит параллельных запросов (0 - без лимита)
+DEFAULT_GPT4O_MINI_CONCURRENCY = 20  # gpt-4o-mini: параллельные запросы
+DEFAULT_GPT4O_MINI_RPM = 500  # gpt-4o-mini: запросов в минуту
+DEFAULT_GPT4O_MINI_TPM = 200000  # gpt-4o-mini: токенов в минуту
+DEFAULT_GPT4O_CONCURRENCY = 10  # gpt-4o: параллельные запросы
+DEFAULT_GPT4O_RPM = 500  # gpt-4o: запросов в минуту
+DEFAULT_GPT4O_TPM = 30000  # gpt-4o: токенов в минуту
+DEFAULT_DALLE3_CONCURRENCY = 3  # dall-e-3: параллельные запросы
+DEFAULT_DALLE3_RPM = 5  # dall-e-3: изображений в минуту
+
+# Константы для потоковой отправки поздравлений
+DEFAULT_GREETING_STREAMING = True  # Выводить текст поздравления по мере генерации
+DEFAULT_STREAM_EDIT_INTERVAL = 1.0  # Минимальный интервал между редактированиями сообщения, сек
+
+# Константы для упреждающей генерации поздравлений
+DEFAULT_SPECULATIVE_ENABLED = False  # Генерировать поздравление заранее, до нажатия кнопки
+DEFAULT_SPECULATIVE_DELAY = 3.0  # Сколько секунд резюме должно не меняться перед запуском
+DEFAULT_SPECULATIVE_IMAGE = False  # Генерировать заранее и изображение
+DEFAULT_SPECULATIVE_MAX_INFLIGHT = 5  # Максимум одновременных упреждающих генераций
+DEFAULT_SPECULATIVE_MAX_PER_HOUR = 60  # Максимум упреждающих генераций в час
+DEFAULT_SPECULATIVE_TTL = 900.0  # Время хранения невостребованного результата, сек
+
+# Константы для объединения сообщений пользователя
+DEFAULT_MESSAGE_QUIET_WINDOW = 1.0  # Сколько секунд ждать следующего сообщения перед анализом
+
+# Константы для хранилища контекстов
+DEFAULT_CONTEXT_DB_PATH = "data/contexts.sqlite3"  # База SQLite для контекстов ("" - только память)
+DEFAULT_CONTEXT_CACHE_SIZE = 10000  # Максимум контекстов в памяти
+DEFAULT_CONTEXT_IDLE_TTL = 3600.0  # Время простоя контекста в памяти до вытеснения, сек
+
+# Константы для анализа контекста
+DEFAULT_SUMMARY_TOKEN_BUDGET = 400  # Предел размера резюме в токенах (0 - без предела)
+DEFAULT_ANALYSIS_DELTA_MODE = True  # Структурированные факты: модель возвращает только изменения полей
+
+# Константы для кеша результатов генерации
+DEFAULT_RESULT_CACHE_ENABLED = True  # Переиспользовать поздравления для одинаковых контекстов
+DEFAULT_RESULT_CACHE_SIZE = 1000  # Максимум записей в памяти
+DEFAULT_RESULT_CACHE_TTL = 86400.0  # Время жизни поздравления в кеше, сек
+DEFAULT_IMAGE_CACHE_TTL = 3000.0  # Время жизни ссылки на изображение, сек (ссылки DALL-E живут около часа)
+DEFAULT_RESULT_CACHE_DB_PATH = "data/results.sqlite3"  # База SQLite для кеша ("" - только память)
+
+# Константы для хранения изображений
+DEFAULT_IMAGE_ASSETS_ENABLED = True  # Сохранять изображения локально и отправлять по file_id
+DEFAULT_IMAGE_ASSETS_DIR = "data/images"  # Каталог изображений и индекса file_id
+DEFAULT_IMAGE_FORMAT = "JPEG"  # Формат пересжатия (JPEG или WEBP, нужен пакет Pillow)
+DEFAULT_IMAGE_QUALITY = 85  # Начальное качество сжатия
+DEFAULT_IMAGE_MAX_SIDE = 1024  # Максимальная сторона изображения, px
+DEFAULT_IMAGE_MAX_BYTES = 524288  # Предел размера файла, байт (0 - без предела)
+DEFAULT_IMAGE_ASSETS_TTL = 2592000.0  # Время хранения файлов, сек
+
+# Константы для режима webhook
+DEFAULT_WEBHOOK_ENABLED = False  # Принимать обновления через webhook вместо long polling
+DEFAULT_WEBHOOK_URL = ""  # Публичный адрес webhook для регистрации в Telegram ("" - не регистрировать)
+DEFAULT_WEBHOOK_PATH = "/webhook"  # Путь, на который приходят обновления
+DEFAULT_WEBHOOK_HOST = "0.0.0.0"  # Адрес встроенного сервера
+DEFAULT_WEBHOOK_PORT = 8080  # Порт встроенного сервера
+DEFAULT_WEBHOOK_SECRET = ""  # Секретный токен для проверки запросов Telegram
+DEFAULT_WEBHOOK_QUEUE_SIZE = 1000  # Максимум принятых, но не обработанных обновлений
+DEFAULT_WEBHOOK_WORKERS = 16  # Число параллельных обработчиков обновлений
+DEFAULT_WEBHOOK_DRAIN_TIMEOUT = 10.0  # Сколько секунд дообрабатывать очередь при остановке
+
+# Константы для работы в нескольких процессах
+DEFAULT_SHARD_WORKERS = 0  # Число процессов-шардов (0 - все в одном процессе)
+DEFAULT_SHARD_QUEUE_SIZE = 1000  # Предел очереди обновлений одного шарда
+DEFAULT_SHARD_HEARTBEAT_TIMEOUT = 30.0  # Через сколько секунд без отметки жизни шард перезапускается
+
+# Константы для очереди задач генерации
+DEFAULT_JOB_QUEUE_ENABLED = True  # Генерировать поздравления в пуле обработчиков вне обработчиков сообщений
+DEFAULT_JOB_DB_PATH = "data/jobs.sqlite3"  # База SQLite очереди задач
+DEFAULT_JOB_WORKERS = 4  # Число обработчиков в процессе бота (0 - только отдельный src/worker.py)
+DEFAULT_JOB_MAX_ATTEMPTS = 3  # Максимум попыток выполнения задачи
+DEFAULT_JOB_RETRY_BACKOFF = 5.0  # Задержка перед первым повтором, сек (дальше удваивается)
+DEFAULT_JOB_POLL_INTERVAL = 1.0  # Период проверки очереди, сек
+
+# Константы для надежности вызовов OpenAI
+DEFAULT_RESILIENCE_ENABLED = True  # Сроки, повторы, хеджирование и выключатель для вызовов OpenAI
+DEFAULT_OPENAI_TIMEOUT_ANALYSIS = 20.0  # gpt-4o-mini: срок вызова вместе с повторами, сек
+DEFAULT_OPENAI_TIMEOUT_GREETING = 60.0  # gpt-4o: срок вызова вместе с повторами, сек
+DEFAULT_OPENAI_TIMEOUT_IMAGE = 120.0  # dall-e-3: срок вызова вместе с повторами, сек
+DEFAULT_OPENAI_RETRIES = 2  # Число повторов после временной ошибки
+DEFAULT_OPENAI_RETRY_BACKOFF = 0.5  # Задержка перед первым повтором, сек (дальше удваивается)
+DEFAULT_OPENAI_RETRY_MAX_BACKOFF = 8.0  # Максимальная задержка между повторами, сек
+DEFAULT_OPENAI_HEDGE_AFTER = 3.0  # gpt-4o-mini: дублирующий запрос через столько секунд (0 - выключено)
+DEFAULT_CIRCUIT_FAILURE_THRESHOLD = 5  # Ошибок подряд до отключения модели
+DEFAULT_CIRCUIT_RESET_TIMEOUT = 30.0  # Через сколько секунд пробовать отключенную модель снова
+DEFAULT_GREETING_FALLBACK_ENABLED = True  # Генерировать поздравление на gpt-4o-mini, если gpt-4o недоступен
+
+# Константы для метрик
+DEFAULT_METRICS_ENABLED = True  # Отдавать метрики Prometheus на /metrics
+DEFAULT_METRICS_HOST = "127.0.0.1"  # Адрес сервера метрик (по умолчанию только локальный)
+DEFAULT_METRICS_PORT = 9100  # Порт сервера метрик (шарды используют следующие порты)
+DEFAULT_TRACING_ENABLED = False  # Спаны OpenTelemetry (нужен пакет opentelemetry-api)
+
+# Константы для диагностики цикла событий
+DEFAULT_DIAGNOSTICS_ENABLED = False  # Следить за блокировками цикла событий
+DEFAULT_DIAGNOSTICS_DIR = "data/diagnostics"  # Каталог отчетов о блокировках и профилей
+DEFAULT_LOOP_LAG_THRESHOLD = 0.25  # Блокировка цикла дольше стольких секунд попадает в отчет
+DEFAULT_PROFILE_INTERVAL = 0.005  # Период сэмплирования профилировщика, сек
+DEFAULT_PROFILE_MAX_DURATION = 60.0  # Максимальная длительность /profile, сек
+
+# Константы для важных дат
+DEFAULT_REMINDERS_ENABLED = True  # Напоминания о важных датах (/adddate, /dates, /deldate)
+DEFAULT_REMINDER_DB_PATH = "data/reminders.db"  # Файл базы важных дат
+DEFAULT_REMINDER_TIMEZONE = "Europe/Moscow"  # Часовой пояс дат и ночного окна
+DEFAULT_REMINDER_HOUR = 9  # Час доставки поздравления в день события
+DEFAULT_REMINDER_PREPARE_START = 2  # Начало ночного окна заблаговременной генерации, час
+DEFAULT_REMINDER_PREPARE_END = 6  # Конец ночного окна, час
+DEFAULT_REMINDER_LOOKAHEAD_DAYS = 3  # За сколько дней до события готовить поздравление
+DEFAULT_REMINDER_PREPARE_CONCURRENCY = 2  # Одновременных генераций в ночном окне
+DEFAULT_REMINDER_DELIVERY_RATE = 20.0  # Максимум доставок в секунду
+DEFAULT_REMINDER_MAX_PER_USER = 50  # Максимум дат у одного пользователя
+
+# Константы для промптов
+DEFAULT_PROMPT_VARIANT = "full"  # Основной вариант шаблонов промптов: full или compact
+DEFAULT_PROMPT_AB_VARIANT = "compact"  # Вариант шаблонов для экспериментальной группы
+DEFAULT_PROMPT_AB_SHARE = 0.0  # Доля пользователей в экспериментальной группе (0 - без эксперимента)
+
+# Константы для логирования
+DEFAULT_LOG_LEVEL = "INFO"  # Уровень корневого логгера
+DEFAULT_LOG_LEVELS = "httpx=WARNING,aiogram.event=WARNING"  # Уровни отдельных модулей: "имя=УРОВЕНЬ,..."
+DEFAULT_LOG_FORMAT = "text"  # Формат записей: text или json
+DEFAULT_LOG_FILE = ""  # Файл журнала с ротацией (пусто - только stderr)
+DEFAULT_LOG_MAX_LENGTH = 2000  # Сообщения длиннее обрезаются, символов
+DEFAULT_LOG_SAMPLE_RATE = 1.0  # Доля сохраняемых записей DEBUG
+DEFAULT_LOG_QUEUE_SIZE = 10000  # Записей в очереди до отбрасывания
+
+# Константы для локального фильтра сообщений
+DEFAULT_PREFILTER_ENABLED = True  # Отвечать на служебные реплики, повторы и опечатки в кнопках без анализа
+DEFAULT_PREFILTER_BUTTON_CUTOFF = 0.8  # Минимальное сходство текста с кнопкой (0-1)
+DEFAULT_PREFILTER_CLASSIFIER_ENABLED = False  # Пропускать анализ коротких реплик по оценке классификатора
+DEFAULT_PREFILTER_CLASSIFIER_THRESHOLD = 0.9  # Вероятность "без сведений", с которой анализ пропускается
+
+# Константы для режима вариантов поздравления
+DEFAULT_GREETING_VARIANTS = 1  # Вариантов поздравления за один запрос (1 - режим выключен, рекомендуется 3)
+DEFAULT_VARIANTS_DB_PATH = "data/variants.db"  # Файл базы наборов вариантов
+DEFAULT_VARIANTS_TTL = 86400.0  # Время жизни набора вариантов, сек
+
+# Константы для состояний FSM и повторно доставленных обновлений
+DEFAULT_FSM_DB_PATH = "data/fsm.sqlite3"  # База SQLite для состояний FSM ("" - только память)
+DEFAULT_UPDATE_DEDUP_ENABLED = True  # Не обрабатывать повторно доставленные обновления
+DEFAULT_UPDATE_DEDUP_DB_PATH = "data/updates.sqlite3"  # База SQLite с id обработанных обновлений
+DEFAULT_UPDATE_DEDUP_TTL = 86400.0  # Сколько хранить id обработанного обновления, сек
+
+# Константы для пакетной генерации (src/batch.py)
+DEFAULT_BATCH_CONCURRENCY = 8  # Одновременно обрабатываемых записей
+DEFAULT_BATCH_POLL_INTERVAL = 30.0  # Интервал опроса статуса OpenAI Batch API, сек
+
 
 @dataclass
 class Config:
@@ -21,16 +182,158 @@ class Config:
     openai_proxy_port: int | None
     openai_proxy_username: str | None
     openai_proxy_password: str | None
+    openai_max_connections: int = DEFAULT_OPENAI_MAX_CONNECTIONS
+    openai_max_keepalive_connections: int = DEFAULT_OPENAI_MAX_KEEPALIVE
+    openai_keepalive_expiry: float = DEFAULT_OPENAI_KEEPALIVE_EXPIRY
+    openai_http2: bool = DEFAULT_OPENAI_HTTP2
+    openai_base_url: str = DEFAULT_OPENAI_BASE_URL
+    telegram_api_url: str = DEFAULT_TELEGRAM_API_URL
+    scheduler_enabled: bool = DEFAULT_SCHEDULER_ENABLED
+    scheduler_max_queue: int = DEFAULT_SCHEDULER_MAX_QUEUE
+    scheduler_max_user_queue: int = DEFAULT_SCHEDULER_MAX_USER_QUEUE
+    scheduler_max_concurrency: int = DEFAULT_SCHEDULER_MAX_CONCURRENCY
+    gpt4o_mini_concurrency: int = DEFAULT_GPT4O_MINI_CONCURRENCY
+    gpt4o_mini_rpm: int = DEFAULT_GPT4O_MINI_RPM
+    gpt4o_mini_tpm: int = DEFAULT_GPT4O_MINI_TPM
+    gpt4o_concurrency: int = DEFAULT_GPT4O_CONCURRENCY
+    gpt4o_rpm: int = DEFAULT_GPT4O_RPM
+    gpt4o_tpm: int = DEFAULT_GPT4O_TPM
+    dalle3_concurrency: int = DEFAULT_DALLE3_CONCURRENCY
+    dalle3_rpm: int = DEFAULT_DALLE3_RPM
+    greeting_streaming: bool = DEFAULT_GREETING_STREAMING
+    stream_edit_interval: float = DEFAULT_STREAM_EDIT_INTERVAL
+    speculative_enabled: bool = DEFAULT_SPECULATIVE_ENABLED
+    speculative_delay: float = DEFAULT_SPECULATIVE_DELAY
+    speculative_image: bool = DEFAULT_SPECULATIVE_IMAGE
+    speculative_max_inflight: int = DEFAULT_SPECULATIVE_MAX_INFLIGHT
+    speculative_max_per_hour: int = DEFAULT_SPECULATIVE_MAX_PER_HOUR
+    speculative_ttl: float = DEFAULT_SPECULATIVE_TTL
+    message_quiet_window: float = DEFAULT_MESSAGE_QUIET_WINDOW
+    context_db_path: str = DEFAULT_CONTEXT_DB_PATH
+    context_cache_size: int = DEFAULT_CONTEXT_CACHE_SIZE
+    context_idle_ttl: float = DEFAULT_CONTEXT_IDLE_TTL
+    summary_token_budget: int = DEFAULT_SUMMARY_TOKEN_BUDGET
+    analysis_delta_mode: bool = DEFAULT_ANALYSIS_DELTA_MODE
+    result_cache_enabled: bool = DEFAULT_RESULT_CACHE_ENABLED
+    result_cache_size: int = DEFAULT_RESULT_CACHE_SIZE
+    result_cache_ttl: float = DEFAULT_RESULT_CACHE_TTL
+    image_cache_ttl: float = DEFAULT_IMAGE_CACHE_TTL
+    result_cache_db_path: str = DEFAULT_RESULT_CACHE_DB_PATH
+    image_assets_enabled: bool = DEFAULT_IMAGE_ASSETS_ENABLED
+    image_assets_dir: str = DEFAULT_IMAGE_ASSETS_DIR
+    image_format: str = DEFAULT_IMAGE_FORMAT
+    image_quality: int = DEFAULT_IMAGE_QUALITY
+    image_max_side: int = DEFAULT_IMAGE_MAX_SIDE
+    image_max_bytes: int = DEFAULT_IMAGE_MAX_BYTES
+    image_assets_ttl: float = DEFAULT_IMAGE_ASSETS_TTL
+    webhook_enabled: bool = DEFAULT_WEBHOOK_ENABLED
+    webhook_url: str = DEFAULT_WEBHOOK_URL
+    webhook_path: str = DEFAULT_WEBHOOK_PATH
+    webhook_host: str = DEFAULT_WEBHOOK_HOST
+    webhook_port: int = DEFAULT_WEBHOOK_PORT
+    webhook_secret: str = DEFAULT_WEBHOOK_SECRET
+    webhook_queue_size: int = DEFAULT_WEBHOOK_QUEUE_SIZE
+    webhook_workers: int = DEFAULT_WEBHOOK_WORKERS
+    webhook_drain_timeout: float = DEFAULT_WEBHOOK_DRAIN_TIMEOUT
+    shard_workers: int = DEFAULT_SHARD_WORKERS
+    shard_queue_size: int = DEFAULT_SHARD_QUEUE_SIZE
+    shard_heartbeat_timeout: float = DEFAULT_SHARD_HEARTBEAT_TIMEOUT
+    job_queue_enabled: bool = DEFAULT_JOB_QUEUE_ENABLED
+    job_db_path: str = DEFAULT_JOB_DB_PATH
+    job_workers: int = DEFAULT_JOB_WORKERS
+    job_max_attempts: int = DEFAULT_JOB_MAX_ATTEMPTS
+    job_retry_backoff: float = DEFAULT_JOB_RETRY_BACKOFF
+    job_poll_interval: float = DEFAULT_JOB_POLL_INTERVAL
+    resilience_enabled: bool = DEFAULT_RESILIENCE_ENABLED
+    openai_timeout_analysis: float = DEFAULT_OPENAI_TIMEOUT_ANALYSIS
+    openai_timeout_greeting: float = DEFAULT_OPENAI_TIMEOUT_GREETING
+    openai_timeout_image: float = DEFAULT_OPENAI_TIMEOUT_IMAGE
+    openai_retries: int = DEFAULT_OPENAI_RETRIES
+    openai_retry_backoff: float = DEFAULT_OPENAI_RETRY_BACKOFF
+    openai_retry_max_backoff: float = DEFAULT_OPENAI_RETRY_MAX_BACKOFF
+    openai_hedge_after: float = DEFAULT_OPENAI_HEDGE_AFTER
+    circuit_failure_threshold: int = DEFAULT_CIRCUIT_FAILURE_THRESHOLD
+    circuit_reset_timeout: float = DEFAULT_CIRCUIT_RESET_TIMEOUT
+    greeting_fallback_enabled: bool = DEFAULT_GREETING_FALLBACK_ENABLED
+    metrics_enabled: bool = DEFAULT_METRICS_ENABLED
+    metrics_host: str = DEFAULT_METRICS_HOST
+    metrics_port: int = DEFAULT_METRICS_PORT
+    tracing_enabled: bool = DEFAULT_TRACING_ENABLED
+    diagnostics_enabled: bool = DEFAULT_DIAGNOSTICS_ENABLED
+    diagnostics_dir: str = DEFAULT_DIAGNOSTICS_DIR
+    loop_lag_threshold: float = DEFAULT_LOOP_LAG_THRESHOLD
+    profile_interval: float = DEFAULT_PROFILE_INTERVAL
+    profile_max_duration: float = DEFAULT_PROFILE_MAX_DURATION
+    admin_ids: tuple[int, ...] = ()
+    reminders_enabled: bool = DEFAULT_REMINDERS_ENABLED
+    reminder_db_path: str = DEFAULT_REMINDER_DB_PATH
+    reminder_timezone: str = DEFAULT_REMINDER_TIMEZONE
+    reminder_hour: int = DEFAULT_REMINDER_HOUR
+    reminder_prepare_start: int = DEFAULT_REMINDER_PREPARE_START
+    reminder_prepare_end: int = DEFAULT_REMINDER_PREPARE_END
+    reminder_lookahead_days: int = DEFAULT_REMINDER_LOOKAHEAD_DAYS
+    reminder_prepare_concurrency: int = DEFAULT_REMINDER_PREPARE_CONCURRENCY
+    reminder_delivery_rate: float = DEFAULT_REMINDER_DELIVERY_RATE
+    reminder_max_per_user: int = DEFAULT_REMINDER_MAX_PER_USER
+    prompt_variant: str = DEFAULT_PROMPT_VARIANT
+    prompt_ab_variant: str = DEFAULT_PROMPT_AB_VARIANT
+    prompt_ab_share: float = DEFAULT_PROMPT_AB_SHARE
+    log_level: str = DEFAULT_LOG_LEVEL
+    log_levels: str = DEFAULT_LOG_LEVELS
+    log_format: str = DEFAULT_LOG_FORMAT
+    log_file: str = DEFAULT_LOG_FILE
+    log_max_length: int = DEFAULT_LOG_MAX_LENGTH
+    log_sample_rate: float = DEFAULT_LOG_SAMPLE_RATE
+    log_queue_size: int = DEFAULT_LOG_QUEUE_SIZE
+    prefilter_enabled: bool = DEFAULT_PREFILTER_ENABLED
+    prefilter_button_cutoff: float = DEFAULT_PREFILTER_BUTTON_CUTOFF
+    prefilter_classifier_enabled: bool = DEFAULT_PREFILTER_CLASSIFIER_ENABLED
+    prefilter_classifier_threshold: float = DEFAULT_PREFILTER_CLASSIFIER_THRESHOLD
+    greeting_variants: int = DEFAULT_GREETING_VARIANTS
+    variants_db_path: str = DEFAULT_VARIANTS_DB_PATH
+    variants_ttl: float = DEFAULT_VARIANTS_TTL
+    fsm_db_path: str = DEFAULT_FSM_DB_PATH
+    update_dedup_enabled: bool = DEFAULT_UPDATE_DEDUP_ENABLED
+    update_dedup_db_path: str = DEFAULT_UPDATE_DEDUP_DB_PATH
+    update_dedup_ttl: float = DEFAULT_UPDATE_DEDUP_TTL
+    batch_concurrency: int = DEFAULT_BATCH_CONCURRENCY
+    batch_poll_interval: float = DEFAULT_BATCH_POLL_INTERVAL
+
 
+def _get_bool(name: str, default: bool) -> bool:
+    """Чтение логического флага из переменной окружения"""
+    return os.getenv(name, str(default)).lower() == "true"
 
-def load_config() -> Config:
+
+def _get_int(name: str, default: int) -> int:
+    """Чтение целого числа из переменной окружения"""
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def _get_float(name: str, default: float) -> float:
+    """Чтение числа с плавающей точкой из переменной окружения"""
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+def _get_int_list(name: str) -> tuple[int, ...]:
+    """Чтение списка целых чисел через запятую из переменной окружения"""
+    value = os.getenv(name, "")
+    return tuple(int(item) for item in value.replace(" ", "").split(",") if item)
+
+
+def load_config(require_telegram: bool = True) -> Config:
     """
     Загрузка конфигурации из переменных окружения
+
+    Args:
+        require_telegram: требовать TELEGRAM_TOKEN (не нужен пакетной генерации)
     """
     load_dotenv()
 
-    telegram_token = os.getenv("TELEGRAM_TOKEN")
-    if not telegram_token:
+    telegram_token = os.getenv("TELEGRAM_TOKEN", "")
+    if not telegram_token and require_telegram:
         raise ValueError("TELEGRAM_TOKEN не найден в переменных окружения")
 
     openai_api_key = os.getenv("OPENAI_API_KEY")
@@ -56,4 +359,170 @@ def load_config() -> Config:
                   openai_proxy_host=proxy_host,
                   openai_proxy_port=proxy_port,
                   openai_proxy_username=proxy_username,
-                  openai_proxy_password=proxy_password)
+                  openai_proxy_password=proxy_password,
+                  openai_max_connections=_get_int(
+                      "OPENAI_MAX_CONNECTIONS", DEFAULT_OPENAI_MAX_CONNECTIONS),
+                  openai_max_keepalive_connections=_get_int(
+                      "OPENAI_MAX_KEEPALIVE_CONNECTIONS", DEFAULT_OPENAI_MAX_KEEPALIVE),
+                  openai_keepalive_expiry=_get_float(
+                      "OPENAI_KEEPALIVE_EXPIRY", DEFAULT_OPENAI_KEEPALIVE_EXPIRY),
+                  openai_http2=_get_bool("OPENAI_HTTP2", DEFAULT_OPENAI_HTTP2),
+                  openai_base_url=os.getenv("OPENAI_BASE_URL", DEFAULT_OPENAI_BASE_URL),
+                  telegram_api_url=os.getenv("TELEGRAM_API_URL", DEFAULT_TELEGRAM_API_URL),
+                  scheduler_enabled=_get_bool(
+                      "SCHEDULER_ENABLED", DEFAULT_SCHEDULER_ENABLED),
+                  scheduler_max_queue=_get_int(
+                      "SCHEDULER_MAX_QUEUE", DEFAULT_SCHEDULER_MAX_QUEUE),
+                  scheduler_max_user_queue=_get_int(
+                      "SCHEDULER_MAX_USER_QUEUE", DEFAULT_SCHEDULER_MAX_USER_QUEUE),
+                  scheduler_max_concurrency=_get_int(
+                      "SCHEDULER_MAX_CONCURRENCY", DEFAULT_SCHEDULER_MAX_CONCURRENCY),
+                  gpt4o_mini_concurrency=_get_int(
+                      "GPT4O_MINI_CONCURRENCY", DEFAULT_GPT4O_MINI_CONCURRENCY),
+                  gpt4o_mini_rpm=_get_int("GPT4O_MINI_RPM", DEFAULT_GPT4O_MINI_RPM),
+                  gpt4o_mini_tpm=_get_int("GPT4O_MINI_TPM", DEFAULT_GPT4O_MINI_TPM),
+                  gpt4o_concurrency=_get_int("GPT4O_CONCURRENCY", DEFAULT_GPT4O_CONCURRENCY),
+                  gpt4o_rpm=_get_int("GPT4O_RPM", DEFAULT_GPT4O_RPM),
+                  gpt4o_tpm=_get_int("GPT4O_TPM", DEFAULT_GPT4O_TPM),
+                  dalle3_concurrency=_get_int("DALLE3_CONCURRENCY", DEFAULT_DALLE3_CONCURRENCY),
+                  dalle3_rpm=_get_int("DALLE3_RPM", DEFAULT_DALLE3_RPM),
+                  greeting_streaming=_get_bool(
+                      "GREETING_STREAMING", DEFAULT_GREETING_STREAMING),
+                  stream_edit_interval=_get_float(
+                      "STREAM_EDIT_INTERVAL", DEFAULT_STREAM_EDIT_INTERVAL),
+                  speculative_enabled=_get_bool(
+                      "SPECULATIVE_ENABLED", DEFAULT_SPECULATIVE_ENABLED),
+                  speculative_delay=_get_float(
+                      "SPECULATIVE_DELAY", DEFAULT_SPECULATIVE_DELAY),
+                  speculative_image=_get_bool(
+                      "SPECULATIVE_IMAGE", DEFAULT_SPECULATIVE_IMAGE),
+                  speculative_max_inflight=_get_int(
+                      "SPECULATIVE_MAX_INFLIGHT", DEFAULT_SPECULATIVE_MAX_INFLIGHT),
+                  speculative_max_per_hour=_get_int(
+                      "SPECULATIVE_MAX_PER_HOUR", DEFAULT_SPECULATIVE_MAX_PER_HOUR),
+                  speculative_ttl=_get_float(
+                      "SPECULATIVE_TTL", DEFAULT_SPECULATIVE_TTL),
+                  message_quiet_window=_get_float(
+                      "MESSAGE_QUIET_WINDOW", DEFAULT_MESSAGE_QUIET_WINDOW),
+                  context_db_path=os.getenv("CONTEXT_DB_PATH", DEFAULT_CONTEXT_DB_PATH),
+                  context_cache_size=_get_int(
+                      "CONTEXT_CACHE_SIZE", DEFAULT_CONTEXT_CACHE_SIZE),
+                  context_idle_ttl=_get_float(
+                      "CONTEXT_IDLE_TTL", DEFAULT_CONTEXT_IDLE_TTL),
+                  summary_token_budget=_get_int(
+                      "SUMMARY_TOKEN_BUDGET", DEFAULT_SUMMARY_TOKEN_BUDGET),
+                  analysis_delta_mode=_get_bool(
+                      "ANALYSIS_DELTA_MODE", DEFAULT_ANALYSIS_DELTA_MODE),
+                  result_cache_enabled=_get_bool(
+                      "RESULT_CACHE_ENABLED", DEFAULT_RESULT_CACHE_ENABLED),
+                  result_cache_size=_get_int(
+                      "RESULT_CACHE_SIZE", DEFAULT_RESULT_CACHE_SIZE),
+                  result_cache_ttl=_get_float(
+                      "RESULT_CACHE_TTL", DEFAULT_RESULT_CACHE_TTL),
+                  image_cache_ttl=_get_float(
+                      "IMAGE_CACHE_TTL", DEFAULT_IMAGE_CACHE_TTL),
+                  result_cache_db_path=os.getenv(
+                      "RESULT_CACHE_DB_PATH", DEFAULT_RESULT_CACHE_DB_PATH),
+                  image_assets_enabled=_get_bool(
+                      "IMAGE_ASSETS_ENABLED", DEFAULT_IMAGE_ASSETS_ENABLED),
+                  image_assets_dir=os.getenv("IMAGE_ASSETS_DIR", DEFAULT_IMAGE_ASSETS_DIR),
+                  image_format=os.getenv("IMAGE_FORMAT", DEFAULT_IMAGE_FORMAT),
+                  image_quality=_get_int("IMAGE_QUALITY", DEFAULT_IMAGE_QUALITY),
+                  image_max_side=_get_int("IMAGE_MAX_SIDE", DEFAULT_IMAGE_MAX_SIDE),
+                  image_max_bytes=_get_int("IMAGE_MAX_BYTES", DEFAULT_IMAGE_MAX_BYTES),
+                  image_assets_ttl=_get_float(
+                      "IMAGE_ASSETS_TTL", DEFAULT_IMAGE_ASSETS_TTL),
+                  webhook_enabled=_get_bool("WEBHOOK_ENABLED", DEFAULT_WEBHOOK_ENABLED),
+                  webhook_url=os.getenv("WEBHOOK_URL", DEFAULT_WEBHOOK_URL),
+                  webhook_path=os.getenv("WEBHOOK_PATH", DEFAULT_WEBHOOK_PATH),
+                  webhook_host=os.getenv("WEBHOOK_HOST", DEFAULT_WEBHOOK_HOST),
+                  webhook_port=_get_int("WEBHOOK_PORT", DEFAULT_WEBHOOK_PORT),
+                  webhook_secret=os.getenv("WEBHOOK_SECRET", DEFAULT_WEBHOOK_SECRET),
+                  webhook_queue_size=_get_int(
+                      "WEBHOOK_QUEUE_SIZE", DEFAULT_WEBHOOK_QUEUE_SIZE),
+                  webhook_workers=_get_int("WEBHOOK_WORKERS", DEFAULT_WEBHOOK_WORKERS),
+                  webhook_drain_timeout=_get_float(
+                      "WEBHOOK_DRAIN_TIMEOUT", DEFAULT_WEBHOOK_DRAIN_TIMEOUT),
+                  shard_workers=_get_int("SHARD_WORKERS", DEFAULT_SHARD_WORKERS),
+                  shard_queue_size=_get_int("SHARD_QUEUE_SIZE", DEFAULT_SHARD_QUEUE_SIZE),
+                  shard_heartbeat_timeout=_get_float(
+                      "SHARD_HEARTBEAT_TIMEOUT", DEFAULT_SHARD_HEARTBEAT_TIMEOUT),
+                  job_queue_enabled=_get_bool("JOB_QUEUE_ENABLED", DEFAULT_JOB_QUEUE_ENABLED),
+                  job_db_path=os.getenv("JOB_DB_PATH", DEFAULT_JOB_DB_PATH),
+                  job_workers=_get_int("JOB_WORKERS", DEFAULT_JOB_WORKERS),
+                  job_max_attempts=_get_int("JOB_MAX_ATTEMPTS", DEFAULT_JOB_MAX_ATTEMPTS),
+                  job_retry_backoff=_get_float(
+                      "JOB_RETRY_BACKOFF", DEFAULT_JOB_RETRY_BACKOFF),
+                  job_poll_interval=_get_float(
+                      "JOB_POLL_INTERVAL", DEFAULT_JOB_POLL_INTERVAL),
+                  resilience_enabled=_get_bool("RESILIENCE_ENABLED", DEFAULT_RESILIENCE_ENABLED),
+                  openai_timeout_analysis=_get_float(
+                      "OPENAI_TIMEOUT_ANALYSIS", DEFAULT_OPENAI_TIMEOUT_ANALYSIS),
+                  openai_timeout_greeting=_get_float(
+                      "OPENAI_TIMEOUT_GREETING", DEFAULT_OPENAI_TIMEOUT_GREETING),
+                  openai_timeout_image=_get_float(
+                      "OPENAI_TIMEOUT_IMAGE", DEFAULT_OPENAI_TIMEOUT_IMAGE),
+                  openai_retries=_get_int("OPENAI_RETRIES", DEFAULT_OPENAI_RETRIES),
+                  openai_retry_backoff=_get_float(
+                      "OPENAI_RETRY_BACKOFF", DEFAULT_OPENAI_RETRY_BACKOFF),
+                  openai_retry_max_backoff=_get_float(
+                      "OPENAI_RETRY_MAX_BACKOFF", DEFAULT_OPENAI_RETRY_MAX_BACKOFF),
+                  openai_hedge_after=_get_float("OPENAI_HEDGE_AFTER", DEFAULT_OPENAI_HEDGE_AFTER),
+                  circuit_failure_threshold=_get_int(
+                      "CIRCUIT_FAILURE_THRESHOLD", DEFAULT_CIRCUIT_FAILURE_THRESHOLD),
+                  circuit_reset_timeout=_get_float(
+                      "CIRCUIT_RESET_TIMEOUT", DEFAULT_CIRCUIT_RESET_TIMEOUT),
+                  greeting_fallback_enabled=_get_bool(
+                      "GREETING_FALLBACK_ENABLED", DEFAULT_GREETING_FALLBACK_ENABLED),
+                  metrics_enabled=_get_bool("METRICS_ENABLED", DEFAULT_METRICS_ENABLED),
+                  metrics_host=os.getenv("METRICS_HOST", DEFAULT_METRICS_HOST),
+                  metrics_port=_get_int("METRICS_PORT", DEFAULT_METRICS_PORT),
+                  tracing_enabled=_get_bool("TRACING_ENABLED", DEFAULT_TRACING_ENABLED),
+                  diagnostics_enabled=_get_bool("DIAGNOSTICS_ENABLED", DEFAULT_DIAGNOSTICS_ENABLED),
+                  diagnostics_dir=os.getenv("DIAGNOSTICS_DIR", DEFAULT_DIAGNOSTICS_DIR),
+                  loop_lag_threshold=_get_float("LOOP_LAG_THRESHOLD", DEFAULT_LOOP_LAG_THRESHOLD),
+                  profile_interval=_get_float("PROFILE_INTERVAL", DEFAULT_PROFILE_INTERVAL),
+                  profile_max_duration=_get_float(
+                      "PROFILE_MAX_DURATION", DEFAULT_PROFILE_MAX_DURATION),
+                  admin_ids=_get_int_list("ADMIN_IDS"),
+                  reminders_enabled=_get_bool("REMINDERS_ENABLED", DEFAULT_REMINDERS_ENABLED),
+                  reminder_db_path=os.getenv("REMINDER_DB_PATH", DEFAULT_REMINDER_DB_PATH),
+                  reminder_timezone=os.getenv("REMINDER_TIMEZONE", DEFAULT_REMINDER_TIMEZONE),
+                  reminder_hour=_get_int("REMINDER_HOUR", DEFAULT_REMINDER_HOUR),
+                  reminder_prepare_start=_get_int(
+                      "REMINDER_PREPARE_START", DEFAULT_REMINDER_PREPARE_START),
+                  reminder_prepare_end=_get_int("REMINDER_PREPARE_END", DEFAULT_REMINDER_PREPARE_END),
+                  reminder_lookahead_days=_get_int(
+                      "REMINDER_LOOKAHEAD_DAYS", DEFAULT_REMINDER_LOOKAHEAD_DAYS),
+                  reminder_prepare_concurrency=_get_int(
+                      "REMINDER_PREPARE_CONCURRENCY", DEFAULT_REMINDER_PREPARE_CONCURRENCY),
+                  reminder_delivery_rate=_get_float(
+                      "REMINDER_DELIVERY_RATE", DEFAULT_REMINDER_DELIVERY_RATE),
+                  reminder_max_per_user=_get_int("REMINDER_MAX_PER_USER", DEFAULT_REMINDER_MAX_PER_USER),
+                  prompt_variant=os.getenv("PROMPT_VARIANT", DEFAULT_PROMPT_VARIANT),
+                  prompt_ab_variant=os.getenv("PROMPT_AB_VARIANT", DEFAULT_PROMPT_AB_VARIANT),
+                  prompt_ab_share=_get_float("PROMPT_AB_SHARE", DEFAULT_PROMPT_AB_SHARE),
+                  log_level=os.getenv("LOG_LEVEL", DEFAULT_LOG_LEVEL),
+                  log_levels=os.getenv("LOG_LEVELS", DEFAULT_LOG_LEVELS),
+                  log_format=os.getenv("LOG_FORMAT", DEFAULT_LOG_FORMAT),
+                  log_file=os.getenv("LOG_FILE", DEFAULT_LOG_FILE),
+                  log_max_length=_get_int("LOG_MAX_LENGTH", DEFAULT_LOG_MAX_LENGTH),
+                  log_sample_rate=_get_float("LOG_SAMPLE_RATE", DEFAULT_LOG_SAMPLE_RATE),
+                  log_queue_size=_get_int("LOG_QUEUE_SIZE", DEFAULT_LOG_QUEUE_SIZE),
+                  prefilter_enabled=_get_bool("PREFILTER_ENABLED", DEFAULT_PREFILTER_ENABLED),
+                  prefilter_button_cutoff=_get_float(
+                      "PREFILTER_BUTTON_CUTOFF", DEFAULT_PREFILTER_BUTTON_CUTOFF),
+                  prefilter_classifier_enabled=_get_bool(
+                      "PREFILTER_CLASSIFIER_ENABLED", DEFAULT_PREFILTER_CLASSIFIER_ENABLED),
+                  prefilter_classifier_threshold=_get_float(
+                      "PREFILTER_CLASSIFIER_THRESHOLD", DEFAULT_PREFILTER_CLASSIFIER_THRESHOLD),
+                  greeting_variants=_get_int("GREETING_VARIANTS", DEFAULT_GREETING_VARIANTS),
+                  variants_db_path=os.getenv("VARIANTS_DB_PATH", DEFAULT_VARIANTS_DB_PATH),
+                  variants_ttl=_get_float("VARIANTS_TTL", DEFAULT_VARIANTS_TTL),
+                  fsm_db_path=os.getenv("FSM_DB_PATH", DEFAULT_FSM_DB_PATH),
+                  update_dedup_enabled=_get_bool("UPDATE_DEDUP_ENABLED", DEFAULT_UPDATE_DEDUP_ENABLED),
+                  update_dedup_db_path=os.getenv("UPDATE_DEDUP_DB_PATH", DEFAULT_UPDATE_DEDUP_DB_PATH),
+                  update_dedup_ttl=_get_float("UPDATE_DEDUP_TTL", DEFAULT_UPDATE_DEDUP_TTL),
+                  batch_concurrency=_get_int("BATCH_CONCURRENCY", DEFAULT_BATCH_CONCURRENCY),
+                  batch_poll_interval=_get_float(
+                      "BATCH_POLL_INTERVAL", DEFAULT_BATCH_POLL_INTERVAL))
@@ -9,20 +9,12 @@ from pathlib import Path
 # Добавляем корневую директорию проекта в PYTHONPATH
 sys.path.append(str(Path(__file__).parent.parent))
 
-from src.bot.bot import create_bot
+from src.bot.bot import create_bot, close_services, start_diagnostics
+from src.bot.webhook import run_webhook
+from src.bot.sharding import run_sharded
 from src.config import load_config
-
-# Настройка логирования
-logging.basicConfig(
-    level=logging.DEBUG,  # Временно установим уровень DEBUG для отладки
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-
-# Установка уровня INFO для конкретных логгеров
-logging.getLogger('httpcore.http11').setLevel(logging.INFO)
-logging.getLogger('httpcore.connection').setLevel(logging.INFO)
-logging.getLogger('openai._base_client').setLevel(logging.INFO)
-logging.getLogger('models.context').setLevel(logging.INFO)
+# Без префикса src: контекст журнала должен быть общим с модулями бота
+from utils.logger import setup_logging_from_config
 
 logger = logging.getLogger(__name__)
 
@@ -30,23 +22,42 @@ async def main():
     """
     Точка входа в приложение
     """
+    diagnostics = None
     try:
-        # Загрузка конфигурации
-        logger.info("Загрузка конфигурации приложения")
+        # Загрузка конфигурации; уровни и формат журнала задаются в ней же
         config = load_config()
-        logger.debug("Конфигурация успешно загружена")
+        setup_logging_from_config(config)
+        logger.info("Запуск приложения бота")
+
+        if config.diagnostics_enabled:
+            diagnostics = start_diagnostics(config)
+
+        if config.shard_workers:
+            logger.info(f"Запуск бота в {config.shard_workers} процессах")
+            await run_sharded(config)
+            return
 
         # Создание и запуск бота
         logger.info("Создание экземпляра бота")
         bot, dp = await create_bot(config)
+        # Профилировщик для команды /profile
+        dp["diagnostics"] = diagnostics
 
-        logger.info("Запуск бота")
-        await dp.start_polling(bot)
+        if config.webhook_enabled:
+            logger.info("Запуск бота в режиме webhook")
+            await run_webhook(bot, dp, config)
+        else:
+            logger.info("Запуск бота")
+            await dp.start_polling(bot)
 
     except Exception as e:
         logger.error(f"Критическая ошибка при запуске бота: {str(e)}", exc_info=True)
         raise
     finally:
+        if 'dp' in locals():
+            await close_services(dp)
+        if diagnostics:
+            await diagnostics.stop()
         if 'bot' in locals():
             if bot.session:
                 logger.info("Закрытие сессии бота")
@@ -54,7 +65,6 @@ async def main():
 
 if __name__ == '__main__':
     try:
-        logger.info("Запуск приложения бота")
         asyncio.run(main())
     except (KeyboardInterrupt, SystemExit):
         logger.info("Бот остановлен")
@@ -1,17 +1,48 @@
 """
 Модель контекста диалога
 """
-from dataclasses import dataclass, field
-from typing import List
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Optional, Tuple
+import hashlib
+import json
 import logging
+import struct
+import zlib
+from models.facts import Facts, copy_facts
 
 logger = logging.getLogger(__name__)
 
-@dataclass
+# Сколько последних сообщений хранится в контексте
+RECENT_MESSAGES_LIMIT = 3
+# Максимальная длина сохраняемого сообщения
+MAX_STORED_MESSAGE_LENGTH = 1000
+
+# Версия двоичного формата сериализации
+FORMAT_VERSION = 2
+# Флаг сжатия тела в заголовке
+_FLAG_COMPRESSED = 0x01
+# Тело короче этого размера не сжимается
+_COMPRESS_THRESHOLD = 256
+
+_HEADER = struct.Struct(">BB")
+_BODY_HEADER = struct.Struct(">IIB")
+_LENGTH = struct.Struct(">I")
+
+
+@dataclass(slots=True)
 class Context:
-    """Класс для хранения контекста диалога"""
+    """
+    Класс для хранения контекста диалога
+
+    Полная история сообщений не хранится: для работы нужны только резюме,
+    счетчик сообщений и несколько последних сообщений. В режиме
+    инкрементального анализа типизированные факты хранятся в facts,
+    а резюме строится из них локально.
+    """
     summory: str = ""
-    messages: List[str] = field(default_factory=list)
+    message_count: int = 0
+    recent_messages: Tuple[str, ...] = ()
+    facts: Optional[Facts] = None
 
     def add_message(self, message: str):
         """
@@ -24,24 +55,125 @@ class Context:
             return
 
         logger.debug(f"Добавление сообщения в контекст: {message[:50]}...")
-        self.messages.append(message)
+        self.message_count += 1
+        recent = self.recent_messages + (message[:MAX_STORED_MESSAGE_LENGTH],)
+        self.recent_messages = recent[-RECENT_MESSAGES_LIMIT:]
 
     def update_summory(self, updated_summory):
         """
         Обновление usummory
-        
+
         Args:
             updated_summory: новый контекст
         """
         self.summory = updated_summory
-        
-    
 
     def get_summory(self) -> str:
         return self.summory
 
+    def apply_delta(self, patch: Dict[str, Any], removed: Iterable[str] = ()):
+        """
+        Локальное слияние изменений фактов и пересборка резюме
+
+        Args:
+            patch: новые значения полей фактов
+            removed: поля, которые пользователь отменил
+        """
+        if self.facts is None:
+            self.facts = Facts()
+        self.facts.merge(patch, removed)
+        self.summory = self.facts.render()
+
+    def replace_facts(self, facts: Facts):
+        """Полная замена фактов (например, после сжатия)"""
+        self.facts = facts
+        self.summory = facts.render()
+
+    def prompt_text(self) -> str:
+        """Компактное описание для промпта генерации"""
+        if self.facts:
+            return self.facts.render(compact=True)
+        return self.summory
+
+    def cache_key(self) -> str:
+        """
+        Ключ для кеширования результатов по содержимому контекста
+
+        Для структурированных фактов - хеш нормализованных полей,
+        иначе - хеш нормализованного резюме.
+        """
+        if self.facts:
+            return self.facts.cache_key()
+        normalized = " ".join(self.summory.lower().split())
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+    def snapshot(self) -> "Context":
+        """Копия резюме и фактов, не зависящая от дальнейших изменений"""
+        return Context(summory=self.summory, facts=copy_facts(self.facts))
+
+    def to_bytes(self) -> bytes:
+        """
+        Сериализация в версионированный двоичный формат
+
+        Формат: версия (1 байт), флаги (1 байт), тело. Тело: счетчик
+        сообщений, длина резюме, число последних сообщений, затем строки
+        UTF-8 с префиксом длины; с версии 2 в конце - факты в JSON с
+        префиксом длины. Длинное тело сжимается zlib.
+        """
+        summory = self.summory.encode("utf-8")
+        parts = [_BODY_HEADER.pack(self.message_count, len(summory), len(self.recent_messages)),
+                 summory]
+        for message in self.recent_messages:
+            encoded = message.encode("utf-8")
+            parts.append(_LENGTH.pack(len(encoded)))
+            parts.append(encoded)
+        facts = b""
+        if self.facts:
+            facts = json.dumps(self.facts.to_dict(), ensure_ascii=False).encode("utf-8")
+        parts.append(_LENGTH.pack(len(facts)))
+        parts.append(facts)
+        body = b"".join(parts)
+
+        flags = 0
+        if len(body) >= _COMPRESS_THRESHOLD:
+            body = zlib.compress(body)
+            flags |= _FLAG_COMPRESSED
+        return _HEADER.pack(FORMAT_VERSION, flags) + body
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "Context":
+        """
+        Восстановление контекста из двоичного формата
+
+        Raises:
+            ValueError: если версия формата не поддерживается
+        """
+        version, flags = _HEADER.unpack_from(data)
+        if version not in (1, FORMAT_VERSION):
+            raise ValueError(f"Неподдерживаемая версия формата контекста: {version}")
+        body = data[_HEADER.size:]
+        if flags & _FLAG_COMPRESSED:
+            body = zlib.decompress(body)
+
+        message_count, summory_length, recent_count = _BODY_HEADER.unpack_from(body)
+        offset = _BODY_HEADER.size
+        summory = body[offset:offset + summory_length].decode("utf-8")
+        offset += summory_length
+        recent = []
+        for _ in range(recent_count):
+            (length,) = _LENGTH.unpack_from(body, offset)
+            offset += _LENGTH.size
+            recent.append(body[offset:offset + length].decode("utf-8"))
+            offset += length
+        facts = None
+        if version >= 2:
+            (length,) = _LENGTH.unpack_from(body, offset)
+            offset += _LENGTH.size
+            if length:
+                facts = Facts.from_dict(json.loads(body[offset:offset + length].decode("utf-8")))
+        return cls(summory=summory, message_count=message_count,
+                   recent_messages=tuple(recent), facts=facts)
+
     def __str__(self) -> str:
         """Строковое представление контекста"""
         return self.summory
-
-    
\ No newline at end of file
@@ -0,0 +1,173 @@
+"""
+Структурированные факты о поздравляемом
+"""
+from dataclasses import dataclass, fields
+from typing import Any, Dict, Iterable, Optional, Tuple
+import hashlib
+import json
+
+# Подписи полей для показа пользователю и для промптов
+FIELD_LABELS = {
+    "event": "Событие",
+    "name": "Имя",
+    "age": "Возраст",
+    "gender": "Пол",
+    "relation": "Родство или близость",
+    "profession": "Профессия",
+    "hobbies": "Хобби",
+    "character": "Характер",
+    "family": "Семья",
+    "pets": "Питомцы",
+    "features": "Особенности",
+    "attitude": "Отношение",
+    "format": "Формат",
+    "style": "Стиль",
+    "notes": "Прочее",
+}
+
+
+@dataclass(slots=True)
+class Facts:
+    """Типизированные факты, собранные из сообщений пользователя"""
+    event: str = ""
+    name: str = ""
+    age: str = ""
+    gender: str = ""
+    relation: str = ""
+    profession: str = ""
+    hobbies: Tuple[str, ...] = ()
+    character: str = ""
+    family: str = ""
+    pets: str = ""
+    features: str = ""
+    attitude: str = ""
+    format: str = ""
+    style: str = ""
+    notes: str = ""
+
+    def __bool__(self) -> bool:
+        return any(getattr(self, f.name) for f in fields(self))
+
+    def merge(self, patch: Dict[str, Any], removed: Iterable[str] = ()):
+        """
+        Локальное слияние изменений без обращения к модели
+
+        Args:
+            patch: новые значения полей; None или отсутствие поля - без изменений
+            removed: поля, которые нужно очистить
+        """
+        for name in removed:
+            if name in FIELD_LABELS:
+                setattr(self, name, () if name == "hobbies" else "")
+        for name, value in patch.items():
+            if name not in FIELD_LABELS or value is None:
+                continue
+            if name == "hobbies":
+                if isinstance(value, str):
+                    value = value.split(",")
+                value = tuple(str(item).strip() for item in value if str(item).strip())
+            else:
+                value = str(value).strip()
+            setattr(self, name, value)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Непустые поля в виде словаря"""
+        result = {}
+        for f in fields(self):
+            value = getattr(self, f.name)
+            if value:
+                result[f.name] = list(value) if f.name == "hobbies" else value
+        return result
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Facts":
+        """
+        Восстановление фактов из словаря
+
+        Неизвестные ключи (например, свободные факты прежних версий)
+        переносятся в поле notes.
+        """
+        facts = cls()
+        facts.merge({key: value for key, value in data.items() if key in FIELD_LABELS})
+        unknown = [f"{key}: {value}" for key, value in data.items() if key not in FIELD_LABELS]
+        if unknown:
+            facts.notes = "; ".join(filter(None, [facts.notes, *unknown]))
+        return facts
+
+    def render(self, compact: bool = False) -> str:
+        """
+        Текстовое представление фактов
+
+        Args:
+            compact: одной строкой для промпта вместо списка для пользователя
+        """
+        parts = []
+        for name, label in FIELD_LABELS.items():
+            value = getattr(self, name)
+            if value:
+                if name == "hobbies":
+                    value = ", ".join(value)
+                parts.append(f"{label}: {value}")
+        return "; ".join(parts) if compact else "\n".join(parts)
+
+    def cache_key(self) -> str:
+        """
+        Хеш нормализованных фактов
+
+        Регистр, лишние пробелы и порядок хобби не влияют на ключ,
+        поэтому одинаковые по смыслу наборы фактов совпадают.
+        """
+        normalized = {}
+        for name, value in self.to_dict().items():
+            if name == "hobbies":
+                normalized[name] = sorted(_normalize(item) for item in value)
+            else:
+                normalized[name] = _normalize(value)
+        payload = json.dumps(normalized, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _normalize(value: str) -> str:
+    return " ".join(value.lower().split())
+
+
+def facts_json_schema(with_remove: bool = True) -> Dict[str, Any]:
+    """
+    JSON-схема ответа модели для structured output
+
+    Все поля обязательны (требование strict-режима), null означает
+    «без изменений».
+    """
+    properties: Dict[str, Any] = {}
+    for name in FIELD_LABELS:
+        if name == "hobbies":
+            properties[name] = {"type": ["array", "null"], "items": {"type": "string"}}
+        else:
+            properties[name] = {"type": ["string", "null"]}
+    if with_remove:
+        properties["remove"] = {
+            "type": "array",
+            "items": {"type": "string", "enum": list(FIELD_LABELS)}
+        }
+    return {
+        "name": "facts_patch" if with_remove else "facts",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": properties,
+            "required": list(properties),
+            "additionalProperties": False
+        }
+    }
+
+
+def parse_facts_patch(payload: Dict[str, Any]) -> Tuple[Dict[str, Any], list[str]]:
+    """Разбор ответа модели на изменения полей и список очищаемых полей"""
+    removed = [name for name in payload.get("remove") or [] if name in FIELD_LABELS]
+    patch = {name: payload[name] for name in FIELD_LABELS if payload.get(name) is not None}
+    return patch, removed
+
+
+def copy_facts(facts: Optional[Facts]) -> Optional[Facts]:
+    """Независимая копия фактов"""
+    return Facts.from_dict(facts.to_dict()) if facts is not None else None
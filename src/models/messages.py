@@ -25,4 +25,30 @@ HELP_MESSAGE = """
 /start - Перезапустить бота
 /help - Показать это сообщение
 /congratulation - Создать поздравление
+/adddate - Добавить важную дату
+/dates - Список важных дат
+/deldate - Удалить важную дату
 """
+
+ADDDATE_USAGE = """Использование: /adddate ДД.ММ[.ГГГГ] Название события
+Например: /adddate 15.03.1990 День рождения мамы
+
+В день события я пришлю готовое поздравление с открыткой. Для поздравления я возьму то, что вы успели рассказать о человеке до добавления даты."""
+
+DATE_ADDED_MESSAGE = "🗓 Дата {date} «{title}» добавлена (№{id}). Поздравление придет в день события."
+
+REMINDER_MESSAGE = "🗓 Сегодня {date}: {title}\n\n{greeting}"
+
+REMINDER_FALLBACK_MESSAGE = "🗓 Сегодня {date}: {title}\n\nПоздравление подготовить не удалось - нажмите «✨ Создать поздравление», чтобы попробовать ещё раз."
+
+VARIANT_MESSAGE = "Вариант {number} из {count}:\n\n{text}"
+
+VARIANT_CHOSEN_MESSAGE = "Отличный выбор! Рисую открытку..."
+
+SMALLTALK_MESSAGE = "Расскажите о человеке, которого хотите поздравить: кто он, какой повод, чем увлекается. Когда будете готовы - нажмите «✨ Создать поздравление»."
+
+UNKNOWN_COMMAND_MESSAGE = "Такой команды нет. Список команд - /help"
+
+QUEUE_MESSAGE = "⏳ Сейчас много запросов. Ваша позиция в очереди: {position}. Я отвечу, как только подойдёт ваша очередь."
+
+OVERLOAD_MESSAGE = "😔 Бот сейчас перегружен запросами. Пожалуйста, повторите попытку через минуту."
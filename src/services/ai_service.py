@@ -1,14 +1,42 @@
 """
 Сервис для работы с OpenAI API
 """
+import importlib.util
 import json
 import logging
+import time
+from contextlib import AsyncExitStack, nullcontext
+from typing import AsyncContextManager, AsyncIterator, Callable, Optional
 import httpx
-from openai import OpenAI, OpenAIError
+from openai import AsyncOpenAI, OpenAIError
+from openai.types.chat import ChatCompletion
 from models.context import Context
+from models.facts import Facts, facts_json_schema, parse_facts_patch
+from services.prompts import PromptRegistry, PromptTemplate
+from services.resilience import CircuitOpenError, ResiliencePolicy, is_retryable
+from utils.metrics import (
+    OPENAI_ERRORS,
+    OPENAI_LATENCY,
+    OPENAI_STREAM_LATENCY,
+    record_usage,
+    span,
+)
 
 logger = logging.getLogger(__name__)
 
+# Модели OpenAI, используемые сервисом
+ANALYSIS_MODEL = "gpt-4o-mini"
+GREETING_MODEL = "gpt-4o"
+IMAGE_MODEL = "dall-e-3"
+
+# Слот планировщика для запроса к модели: основная и запасная модели
+# поздравлений учитываются каждая в своих лимитах
+SlotFactory = Callable[[str], AsyncContextManager[None]]
+
+
+def _no_slot(model: str) -> AsyncContextManager[None]:
+    return nullcontext()
+
 class AIService:
     """Класс для работы с OpenAI API"""
 
@@ -19,177 +47,482 @@ class AIService:
         proxy_host: str | None = None,
         proxy_port: int | None = None,
         proxy_username: str | None = None,
-        proxy_password: str | None = None
+        proxy_password: str | None = None,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        http2: bool = True,
+        policy: ResiliencePolicy | None = None,
+        greeting_fallback_model: str | None = None,
+        base_url: str | None = None,
+        prompts: PromptRegistry | None = None
     ):
-        """Инициализация клиента OpenAI с поддержкой HTTPS-прокси"""
+        """
+        Инициализация асинхронного клиента OpenAI с поддержкой HTTPS-прокси
+
+        Все запросы идут через один долгоживущий httpx.AsyncClient с общим
+        пулом соединений, поэтому вызовы разных пользователей выполняются
+        конкурентно и не блокируют цикл событий aiogram.
+
+        Если задана политика надежности, сроки и повторы вызовов
+        определяет она, а встроенные повторы клиента OpenAI отключаются.
+        Если основная модель поздравлений недоступна, используется
+        greeting_fallback_model. Тексты запросов берутся из реестра
+        промптов prompts; вариант шаблона выбирается по user_id,
+        переданному в метод, - тому же, по которому вызывающий код
+        строит ключи кеша и оценку токенов.
+        """
         logger.info("Инициализация AIService")
-        
+
+        if http2 and importlib.util.find_spec("h2") is None:
+            logger.warning("Пакет h2 не установлен, HTTP/2 отключен")
+            http2 = False
+
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        logger.info(
+            f"Пул соединений OpenAI: max={max_connections}, "
+            f"keepalive={max_keepalive_connections}, expiry={keepalive_expiry}s, "
+            f"http2={http2}"
+        )
+
+        proxy_url = None
         # Настройка прокси, если включен
         if proxy_enabled and proxy_host and proxy_port:
             # Формирование URL прокси с авторизацией
             if proxy_username and proxy_password:
                 proxy_url = f"https://{proxy_username}:{proxy_password}@{proxy_host}:{proxy_port}"
-                logger.info(f"OpenAI подключение через HTTPS прокси: {proxy_host}:{proxy_port} (с авторизацией)")
+                logger.info("OpenAI подключение через HTTPS прокси: %s:%s (с авторизацией)", proxy_host, proxy_port)
             else:
                 proxy_url = f"https://{proxy_host}:{proxy_port}"
-                logger.info(f"OpenAI подключение через HTTPS прокси: {proxy_host}:{proxy_port}")
-            
-            # Создание HTTP-клиента с прокси
-            http_client = httpx.Client(
-                proxy=proxy_url
-            )
-            self.client = OpenAI(api_key=api_key, http_client=http_client)
+                logger.info("OpenAI подключение через HTTPS прокси: %s:%s", proxy_host, proxy_port)
         else:
             logger.info("OpenAI подключение напрямую (без прокси)")
-            self.client = OpenAI(api_key=api_key)
 
-    async def analyze_context(self, text: str, prev_context=None) -> str:
+        # Создание общего HTTP-клиента (с прокси или без)
+        self._http_client = httpx.AsyncClient(
+            proxy=proxy_url,
+            limits=limits,
+            http2=http2
+        )
+        self.policy = policy
+        self.greeting_fallback_model = greeting_fallback_model
+        self.prompts = prompts or PromptRegistry()
+        client_options = {}
+        if policy:
+            # Тайм-аут чтения ограничивает и паузы внутри потоковых ответов
+            client_options = {"max_retries": 0, "timeout": policy.max_timeout()}
+        self.client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url or None,
+            http_client=self._http_client,
+            **client_options
+        )
+
+    @property
+    def http_client(self) -> httpx.AsyncClient:
+        """Общий HTTP-клиент (с настройками прокси и пула)"""
+        return self._http_client
+
+    async def _call(self, operation: str, model: str, func, prompt: PromptTemplate | None = None):
+        """
+        Вызов API через политику надежности, если она настроена,
+        с учетом длительности, ошибок и токенов в метриках
+        """
+        start = time.perf_counter()
+        try:
+            with span(f"openai {operation}", model=model):
+                if not self.policy:
+                    response = await func()
+                else:
+                    response = await self.policy.call(model, func)
+        except Exception as e:
+            OPENAI_ERRORS.inc(model=model, operation=operation, error=type(e).__name__)
+            raise
+        finally:
+            OPENAI_LATENCY.observe(time.perf_counter() - start, model=model, operation=operation)
+        usage = getattr(response, "usage", None)
+        record_usage(model, usage)
+        if prompt:
+            self.prompts.record(prompt, usage)
+        return response
+
+    def _greeting_models(self) -> list[str]:
+        """Модель поздравлений и запасная модель"""
+        if self.greeting_fallback_model and self.greeting_fallback_model != GREETING_MODEL:
+            return [GREETING_MODEL, self.greeting_fallback_model]
+        return [GREETING_MODEL]
+
+    def _should_fallback(self, model: str, error: Exception) -> bool:
+        """Переключаться ли на запасную модель после ошибки"""
+        models = self._greeting_models()
+        if model == models[-1]:
+            return False
+        if isinstance(error, CircuitOpenError) or is_retryable(error):
+            logger.warning(f"Модель {model} недоступна ({type(error).__name__}), "
+                           f"переключение на {models[-1]}")
+            return True
+        return False
+
+    async def close(self):
+        """Закрытие HTTP-клиента и всех соединений пула"""
+        if self.prompts.stats():
+            logger.info("Токены промптов: %s", self.prompts.stats())
+        logger.info("Закрытие HTTP-клиента OpenAI")
+        await self.client.close()
+        await self._http_client.aclose()
+
+    async def analyze_context(self, text: str, prev_context=None, user_id: Optional[int] = None) -> str:
         """
         Анализ контекста сообщения и извлечение ключевой информации
         """
-        logger.debug(f"Анализ контекста сообщения: {text[:50]}...")
-        messages = [
-            {
-                "role": "system",
-                "content": """Ты — помощник чат-бота в Telegram, который помогает пользователю
-                составлять персонализированные поздравления для друзей, родных и коллег.
-                
-                
-                Твоя задача:
-
-                Проанализировать полученную информацию, посмотреть есть ли "Ранее собранные данные". Если они были то, ты их найдешь после строки "Ранее собранные данные:", между двумя строками "***". Остальная информация - "Новая информация" находится после строки "Новая информация:", между двумя строками "---". Ты анализируешь новую информацию
-
-                И собираешь ключевые факты, которые могут пригодиться для создания поздравления.                
-                
-                Это могут быть:                    
-                    Событие с которым поздравляют (переезд, отпуск, свадьба, развод, новый проект, и т.д. и т.п.), если не указано, то не пиши про это.
-                    Имя, возраст, родство или степень близости
-                    Профессия, хобби, характер
-                    Семейное положение, дети, питомцы
-                    Интересные или забавные особенности
-                    Отношение пользователя к адресату (уважение, дружба, ирония и т.д. и т.п.)                    
-                    Пожелания пользователя о формате (стихотворение, хокку, проза и т.д. и т.п.) или стиле поздравления (официальное, игривое, романтическое, подкол и т.д. и т.п.). Если не указано, то не надо про это писать.
-                    Собранные ключевые факты должны быть записаны кратко и информативно, без лишних слов (чтобы экономить токены).
-                    Не придумывай факты и не фантазируй — только на основе полученной информации. Не пиши поздравлений, твоя цель — только структурировать факты для будущего поздравления.
-                    
-                    Если не было Ранее собранных данных, то твоим ответом будут Собранные ключевые факты.
-                    
-                    Если были Ранее собранные данные, их надо дополнить или скорректировать/уточнить собранными ключевыми фактами.
-                    Собранные ключевые факты могут:
-                    - Добавиться к фактам из Ранее собранных данных
-                    - Уточнить или исправить факты в Ранее собранных данных
-                    Твоим ответом в этом случае будут обновленные с учетом Собранных ключевых фактов Ранее собранные данные.
-                    Ответ должен быть кратким и информативным, без лишних слов (чтобы экономить токены)                   
-                
-                """
-            },
-            
-        ]
-        if prev_context:
-            old_content = f'Ранее собранные данные:\n***\n{prev_context.summory}\n***'
-            messages.append({"role": "user", "content": old_content})
-        new_content = f'Новая информация:\n---\n{text}\n---'
-        messages.append({"role": "user", "content": new_content})
+        logger.debug("Анализ контекста сообщения: %.50s...", text)
+        prompt = self.prompts.select("analysis", user_id)
+        messages = prompt.messages(
+            summary=prev_context.summory if prev_context else None,
+            text=text
+        )
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",  # Using standard GPT-4o model
-                messages=messages,                
-            )
+            response = await self._call("analyze_context", ANALYSIS_MODEL, lambda: self.client.chat.completions.create(
+                model=ANALYSIS_MODEL,
+                messages=messages,
+            ), prompt)
             result = response.choices[0].message.content
-            logger.debug(f"Анализ контекста успешно завершен: {result}")
+            logger.debug("Анализ контекста успешно завершен: %s", result)
             return result
         except OpenAIError as e:
-            logger.error(f"Ошибка OpenAI API: {str(e)}", exc_info=True)
+            logger.error("Ошибка OpenAI API: %s", e, exc_info=True)
             return prev_context.summory if prev_context else ""
         
         except Exception as e:
-            logger.error(f"Неожиданная ошибка при анализе контекста: {str(e)}", exc_info=True)
+            logger.error("Неожиданная ошибка при анализе контекста: %s", e, exc_info=True)
             return prev_context.summory if prev_context else ""
 
-    async def generate_greeting(self, context: Context) -> str:
+    async def analyze_context_delta(
+        self,
+        text: str,
+        prev_context: Context | None = None,
+        user_id: Optional[int] = None
+    ) -> tuple[dict, list[str]]:
+        """
+        Инкрементальный анализ сообщения со structured output
+
+        Модель получает текущие факты и возвращает только измененные поля
+        по JSON-схеме, поэтому размер ответа не растет с длиной диалога,
+        а слияние выполняется локально.
+
+        Returns:
+            tuple: (новые значения полей, очищаемые поля)
+        """
+        logger.debug("Инкрементальный анализ сообщения: %.50s...", text)
+        facts = None
+        if prev_context and prev_context.facts:
+            facts = json.dumps(prev_context.facts.to_dict(), ensure_ascii=False)
+        prompt = self.prompts.select("delta_analysis", user_id)
+        messages = prompt.messages(facts=facts, text=text)
+        try:
+            response = await self._call("analyze_context_delta", ANALYSIS_MODEL, lambda: self.client.chat.completions.create(
+                model=ANALYSIS_MODEL,
+                messages=messages,
+                response_format={"type": "json_schema", "json_schema": facts_json_schema()}
+            ), prompt)
+            patch, removed = parse_facts_patch(json.loads(response.choices[0].message.content))
+            logger.debug("Изменения фактов: %s, очищено: %s", patch, removed)
+            return patch, removed
+        except OpenAIError as e:
+            logger.error("Ошибка OpenAI API: %s", e, exc_info=True)
+            return {}, []
+        except Exception as e:
+            logger.error("Неожиданная ошибка при анализе контекста: %s", e, exc_info=True)
+            return {}, []
+
+    async def compact_summary(self, summary: str, token_budget: int, user_id: Optional[int] = None) -> str:
+        """
+        Сжатие текстового резюме до заданного бюджета токенов
+
+        При ошибке возвращает исходное резюме.
+        """
+        logger.debug("Сжатие резюме до %s токенов", token_budget)
+        prompt = self.prompts.select("compact_summary", user_id)
+        messages = prompt.messages(budget=token_budget, chars=token_budget * 3, summary=summary)
+        try:
+            response = await self._call("compact_summary", ANALYSIS_MODEL, lambda: self.client.chat.completions.create(
+                model=ANALYSIS_MODEL,
+                messages=messages,
+                max_tokens=token_budget
+            ), prompt)
+            return response.choices[0].message.content or summary
+        except Exception as e:
+            logger.error("Ошибка при сжатии резюме: %s", e, exc_info=True)
+            return summary
+
+    async def compact_facts(self, facts: Facts, token_budget: int, user_id: Optional[int] = None) -> Facts:
+        """
+        Сжатие структурированных фактов до заданного бюджета токенов
+
+        При ошибке возвращает исходные факты.
+        """
+        logger.debug("Сжатие фактов до %s токенов", token_budget)
+        prompt = self.prompts.select("compact_facts", user_id)
+        messages = prompt.messages(
+            budget=token_budget,
+            chars=token_budget * 3,
+            facts=json.dumps(facts.to_dict(), ensure_ascii=False)
+        )
+        try:
+            response = await self._call("compact_facts", ANALYSIS_MODEL, lambda: self.client.chat.completions.create(
+                model=ANALYSIS_MODEL,
+                messages=messages,
+                response_format={
+                    "type": "json_schema",
+                    "json_schema": facts_json_schema(with_remove=False)
+                },
+                max_tokens=token_budget * 2
+            ), prompt)
+            patch, _ = parse_facts_patch(json.loads(response.choices[0].message.content))
+            compacted = Facts()
+            compacted.merge(patch)
+            return compacted or facts
+        except Exception as e:
+            logger.error("Ошибка при сжатии фактов: %s", e, exc_info=True)
+            return facts
+
+    def _greeting_prompt(self, context: Context, user_id: Optional[int]) -> tuple[PromptTemplate, list[dict]]:
+        """
+        Шаблон и сообщения запроса на генерацию поздравления
+        """
+        prompt = self.prompts.select("greeting", user_id)
+        return prompt, prompt.messages(instructions=context.prompt_text())
+
+    async def generate_greeting(
+        self,
+        context: Context,
+        user_id: Optional[int] = None,
+        slot: Optional[SlotFactory] = None
+    ) -> tuple[str, str]:
         """
         Генерация текста поздравления на основе контекста
+
+        Запрос к каждой модели (основной, затем запасной) выполняется
+        в слоте slot(model), если он задан.
+
+        Returns:
+            tuple: (текст поздравления, модель, которая его создала) -
+                при недоступности основной модели это запасная модель
         """
         logger.debug("Начало генерации текста поздравления")
+        greetings, model = await self._generate_greetings("generate_greeting", context, 1, user_id, slot)
+        return greetings[0], model
+
+    async def generate_greetings(
+        self,
+        context: Context,
+        n: int,
+        user_id: Optional[int] = None,
+        slot: Optional[SlotFactory] = None
+    ) -> list[str]:
+        """
+        Генерация n вариантов поздравления одним запросом
+
+        Варианты приходят как n choices одного ответа: промпт
+        передается и оплачивается один раз.
+        """
+        logger.debug("Начало генерации %s вариантов поздравления", n)
+        greetings, _ = await self._generate_greetings("generate_greetings", context, n, user_id, slot)
+        return greetings
+
+    async def _generate_greetings(
+        self,
+        operation: str,
+        context: Context,
+        n: int,
+        user_id: Optional[int],
+        slot: Optional[SlotFactory]
+    ) -> tuple[list[str], str]:
+        """Запрос поздравлений с переключением на запасную модель; возвращает и модель"""
+        prompt, messages = self._greeting_prompt(context, user_id)
+        # n передается только при нескольких вариантах: одиночный запрос не меняется
+        options = {"n": n} if n > 1 else {}
+        slot = slot or _no_slot
+        for model in self._greeting_models():
+            # Отказ планировщика (QueueFullError) передается вызывающему как есть
+            async with slot(model):
+                try:
+                    response = await self._call(operation, model, lambda model=model: self.client.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        max_tokens=500,
+                        **options
+                    ), prompt)
+                    greetings = [choice.message.content for choice in response.choices]
+                    logger.debug("Поздравление успешно сгенерировано (%s): %.50s...", model, greetings[0])
+                    return greetings, model
+                except OpenAIError as e:
+                    if self._should_fallback(model, e):
+                        continue
+                    error_msg = f"Ошибка OpenAI API при генерации поздравления: {str(e)}"
+                    logger.error(error_msg, exc_info=True)
+                    raise Exception(error_msg)
+                except Exception as e:
+                    if self._should_fallback(model, e):
+                        continue
+                    error_msg = f"Неожиданная ошибка при генерации поздравления: {str(e)}"
+                    logger.error(error_msg, exc_info=True)
+                    raise Exception(error_msg)
+
+    async def stream_greeting(
+        self,
+        context: Context,
+        on_model: Optional[Callable[[str], None]] = None,
+        user_id: Optional[int] = None,
+        slot: Optional[SlotFactory] = None
+    ) -> AsyncIterator[str]:
+        """
+        Потоковая генерация текста поздравления
+
+        На запасную модель можно переключиться только до начала потока.
+
+        Args:
+            on_model: вызывается с моделью, которая отвечает, до первого фрагмента
+            slot: слот планировщика для модели; удерживается до конца потока
+
+        Yields:
+            str: очередной фрагмент текста по мере его генерации моделью
+        """
+        logger.debug("Начало потоковой генерации текста поздравления")
+        stream = None
+        prompt, messages = self._greeting_prompt(context, user_id)
+        slot = slot or _no_slot
+        for model in self._greeting_models():
+            model_slot = AsyncExitStack()
+            await model_slot.enter_async_context(slot(model))
+            try:
+                stream = await self._call("stream_greeting", model, lambda model=model: self.client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    max_tokens=500,
+                    stream=True,
+                    stream_options={"include_usage": True}
+                ))
+                break
+            except Exception as e:
+                await model_slot.aclose()
+                if self._should_fallback(model, e):
+                    continue
+                error_msg = f"Ошибка OpenAI API при генерации поздравления: {str(e)}"
+                logger.error(error_msg, exc_info=True)
+                raise Exception(error_msg)
+            except BaseException:
+                await model_slot.aclose()
+                raise
+        if on_model:
+            on_model(model)
+        start = time.perf_counter()
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": """Ты — мастер создания тёплых, уместных и запоминающихся поздравлений. На вход ты получаешь краткое описание фактов о человеке и пожелания к формату поздравления, собранные в ходе переписки.
-                        
-                        Твоя задача:
-                        На основе предоставленных фактов о человеке и пожеланий создать одно персонализированное поздравление, подходящее для отправки в мессенджере вместе с открыткой. Если по полученной информации невозможно понять с каким событием поздравляют, ни что в поздравлении не должно быть однозначной привязкой к какому-то конкретному празднику.
-
-                        Поздравление должно быть:
-
-                            Ярким, образным, тёплым уместным по стилю. (Возможны разные варианты стилей: официальный, игривый, романтический, нежный, поэтический и т.д. — смотри указания к поздравлению). По умолчанию стиль - яркая проза. Используй эмодзи, если это необходимо.
-
-                            Не длиннее 1000 символов!
-
-                        Не повторяй факты дословно, используй их творчески.
-                        Если указан поэтический формат — пиши стихами (например, четверостишия, хокку, белый стих, и т.д и т.п.).
-
-                        Если стиль не указан — подбери нейтрально-дружелюбный тон, яркая проза.
-                        
-                        Подпись в конце не нужна.
-                        """
-                    },
-                    {"role": "user", "content": f'Указания к поздравлению: *** {context.summory} ***'}
-                ],
-                max_tokens=500
-            )
-            greeting_text = response.choices[0].message.content
-            logger.debug(f"Поздравление успешно сгенерировано: {greeting_text[:50]}...")
-            return greeting_text
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+                # Последний фрагмент содержит только usage
+                if chunk.usage:
+                    record_usage(model, chunk.usage)
+                    self.prompts.record(prompt, chunk.usage)
+            OPENAI_STREAM_LATENCY.observe(time.perf_counter() - start, model=model)
+            logger.debug("Потоковая генерация поздравления завершена")
         except OpenAIError as e:
             error_msg = f"Ошибка OpenAI API при генерации поздравления: {str(e)}"
             logger.error(error_msg, exc_info=True)
             raise Exception(error_msg)
-        except Exception as e:
-            error_msg = f"Неожиданная ошибка при генерации поздравления: {str(e)}"
-            logger.error(error_msg, exc_info=True)
-            raise Exception(error_msg)
+        finally:
+            # Слот модели освобождается только после конца потока
+            await model_slot.aclose()
 
-    async def generate_image(self, greeting_text) -> str:
+    def greeting_request(self, context: Context, user_id: Optional[int] = None) -> dict:
         """
-        Генерация изображения для поздравления
+        Тело запроса поздравления для OpenAI Batch API
+
+        Совпадает с запросом generate_greeting, но без запасной модели:
+        пакет целиком выполняется основной моделью.
         """
-        logger.debug("Начало генерации изображения")
-        
-        try:
-            prompt = f"""Ты — генератор образных и эстетически приятных изображений-открыток. 
-            На вход ты получаешь поздравление в виде текста.
+        _, messages = self._greeting_prompt(context, user_id)
+        return {"model": GREETING_MODEL, "messages": messages, "max_tokens": 500}
 
-            Твоя задача:
+    def greeting_from_batch(self, body: dict, user_id: Optional[int] = None) -> str:
+        """Текст поздравления из ответа пакета с учетом токенов в метриках"""
+        response = ChatCompletion.model_validate(body)
+        record_usage(GREETING_MODEL, response.usage)
+        self.prompts.record(self.prompts.select("greeting", user_id), response.usage)
+        return response.choices[0].message.content
 
-            Создай изображение, подходящее для поздравительной открытки, основываясь на Информацию АЛЬФА1. Если по информации АЛЬФА1 невозможно понять с каким событием поздравляют, ни что на изображении не должно быть однозначной привязкой к какому-то конкретному празднику.
+    async def create_batch(self, requests: list[dict]) -> str:
+        """
+        Загрузка запросов и создание пакета OpenAI Batch API
 
-            изображение должно передавать настроение, атмосферу события и детали связанные с поздравляемым. Изображение не должно содержать текста.
+        Args:
+            requests: строки входного файла ({"custom_id", "method", "url", "body"})
+
+        Returns:
+            str: id пакета
+        """
+        data = "".join(json.dumps(request, ensure_ascii=False) + "\n" for request in requests)
+        upload = await self.client.files.create(
+            file=("greetings.jsonl", data.encode("utf-8")),
+            purpose="batch"
+        )
+        batch = await self.client.batches.create(
+            input_file_id=upload.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        logger.info("Создан пакет OpenAI %s: %s запросов", batch.id, len(requests))
+        return batch.id
 
-            Изображение должно быть:
+    async def get_batch(self, batch_id: str):
+        """Текущее состояние пакета OpenAI Batch API"""
+        return await self.client.batches.retrieve(batch_id)
 
-                Ярким, но не перегруженным
+    async def batch_file(self, file_id: str) -> list[dict]:
+        """Строки файла результатов или ошибок пакета"""
+        content = await self.client.files.content(file_id)
+        return [json.loads(line) for line in content.text.splitlines() if line.strip()]
+
+    async def generate_image(
+        self, greeting_text, response_format: str = "url", user_id: Optional[int] = None
+    ) -> str:
+        """
+        Генерация изображения для поздравления
+
+        Args:
+            greeting_text: текст поздравления
+            response_format: "url" - временная ссылка OpenAI,
+                "b64_json" - содержимое изображения в base64
+
+        Returns:
+            str: ссылка или base64 в зависимости от response_format
+        """
+        logger.debug("Начало генерации изображения")
+        
+        try:
+            template = self.prompts.select("image", user_id)
+            # Инструкции идут первыми, текст поздравления - в конце промпта
+            prompt = template.text(greeting=greeting_text)
 
-                В соответствии с указанным стилем поздравления. По умолчанию открытка в стиле профессионального фото.
-                            
-            Информация АЛЬФА1:
-            ***
-            {greeting_text}
-            ***
-            """
-            
-            logger.debug(f"Промпт для генерации изображения: {prompt}")
+            logger.debug("Промпт для генерации изображения: %s", prompt)
 
-            response = self.client.images.generate(
-                model="dall-e-3",
+            response = await self._call("generate_image", IMAGE_MODEL, lambda: self.client.images.generate(
+                model=IMAGE_MODEL,
                 prompt=prompt,
                 n=1,
-                size="1024x1024"
-            )
+                size="1024x1024",
+                response_format=response_format
+            ))
+            if response_format == "b64_json":
+                logger.debug("Изображение успешно сгенерировано (b64_json)")
+                return response.data[0].b64_json
             image_url = response.data[0].url
-            logger.debug(f"Изображение успешно сгенерировано: {image_url}")
+            logger.debug("Изображение успешно сгенерировано: %s", image_url)
             return image_url
         except OpenAIError as e:
             error_msg = f"Ошибка OpenAI API при генерации изображения: {str(e)}"
@@ -0,0 +1,375 @@
+"""
+Пакетная генерация поздравлений: входные записи, контрольные точки и режимы выполнения
+"""
+import asyncio
+import csv
+import json
+import logging
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
+from openai import OpenAIError
+from models.context import Context
+from services.ai_service import AIService
+from services.content_generator import ContentGenerator
+from services.image_assets import ImageAssets
+from services.scheduler import Priority
+from utils.logger import log_context
+
+logger = logging.getLogger(__name__)
+
+# Поле входной записи с идентификатором человека
+ID_FIELD = "id"
+# Предел числа запросов в одном пакете OpenAI Batch API
+BATCH_MAX_REQUESTS = 50000
+# Статусы пакета, после которых он больше не меняется
+BATCH_FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+# Интервал записи прогресса в журнал, сек
+PROGRESS_INTERVAL = 10.0
+
+
+@dataclass(slots=True)
+class BulkItem:
+    """Одна запись входного файла"""
+    id: str
+    index: int
+    context: Context
+
+
+def _describe(row: Dict[str, Any]) -> str:
+    """Резюме для промпта: все поля записи, кроме id, в виде "поле: значение" """
+    lines = []
+    for key, value in row.items():
+        if key is None or key == ID_FIELD or value in (None, "", [], {}):
+            continue
+        if isinstance(value, (list, tuple)):
+            value = ", ".join(str(part) for part in value)
+        elif isinstance(value, dict):
+            value = json.dumps(value, ensure_ascii=False)
+        lines.append(f"{key}: {str(value).strip()}")
+    return "\n".join(lines)
+
+
+def read_items(path: str) -> Iterator[BulkItem]:
+    """
+    Ленивое чтение записей из CSV с заголовком или из JSONL
+
+    Набор колонок свободный (имя, повод, увлечения и т.п.): все поля,
+    кроме id, попадают в резюме. Без колонки id идентификатором
+    служит номер записи.
+    """
+    with open(path, encoding="utf-8-sig", newline="") as file:
+        if Path(path).suffix.lower() == ".csv":
+            rows: Iterable[Dict[str, Any]] = csv.DictReader(file)
+        else:
+            rows = (json.loads(line) for line in file if line.strip())
+        for index, row in enumerate(rows, 1):
+            item_id = str(row.get(ID_FIELD) or index)
+            yield BulkItem(item_id, index, Context(summory=_describe(row)))
+
+
+class BulkOutput:
+    """
+    Файл результатов JSONL, он же контрольная точка
+
+    Каждый результат дописывается сразу после генерации. При повторном
+    запуске успешно обработанные id пропускаются, а записи с ошибкой
+    обрабатываются снова. Строка, оборванная при сбое, отбрасывается.
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.done: Set[str] = set()
+        self.written = 0
+        self.failed = 0
+        self.skipped = 0
+        self._load()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def _load(self):
+        """Чтение готовых id из результатов прошлого запуска"""
+        if not self.path.exists():
+            return
+        with open(self.path, "rb+") as file:
+            data = file.read()
+            end = data.rfind(b"\n") + 1
+            if end < len(data):
+                logger.warning("Оборванная строка в конце %s отброшена", self.path)
+                file.truncate(end)
+        for line in data[:end].splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if "error" not in record:
+                self.done.add(str(record["id"]))
+        if self.done:
+            logger.info("Продолжение %s: готово %s записей", self.path, len(self.done))
+
+    def pending(self, items: Iterable[BulkItem]) -> Iterator[BulkItem]:
+        """Записи, которых еще нет среди готовых"""
+        for item in items:
+            if item.id in self.done:
+                self.skipped += 1
+                continue
+            yield item
+
+    def write(self, record: Dict[str, Any]):
+        """Дозапись результата с немедленным сбросом на диск"""
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self.written += 1
+        if "error" in record:
+            self.failed += 1
+        else:
+            self.done.add(record["id"])
+
+    def close(self):
+        self._file.close()
+
+
+class _Progress:
+    """Периодическая запись прогресса в журнал"""
+
+    def __init__(self, output: BulkOutput):
+        self.output = output
+        self.started = time.monotonic()
+        self.logged = self.started
+
+    def tick(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self.logged < PROGRESS_INTERVAL:
+            return
+        self.logged = now
+        elapsed = max(now - self.started, 1e-9)
+        logger.info(
+            "Обработано %s записей (ошибок %s, пропущено готовых %s), %.1f в минуту",
+            self.output.written, self.output.failed, self.output.skipped,
+            self.output.written * 60 / elapsed
+        )
+
+
+class BulkGenerator:
+    """
+    Генерация поздравлений по записям через ContentGenerator
+
+    Записи читаются лениво, одновременно обрабатывается не больше
+    concurrency записей, а лимиты моделей по-прежнему соблюдает
+    планировщик, поэтому размер входного файла не влияет ни на память,
+    ни на нагрузку на OpenAI.
+    """
+
+    def __init__(
+        self,
+        content_generator: ContentGenerator,
+        output: BulkOutput,
+        concurrency: int = 8,
+        with_image: bool = False,
+        assets: Optional[ImageAssets] = None
+    ):
+        """
+        Args:
+            content_generator: генератор контента
+            output: файл результатов
+            concurrency: максимум одновременно обрабатываемых записей
+            with_image: генерировать ли изображения
+            assets: локальное хранилище изображений (в результат пишется путь к файлу)
+        """
+        self.content_generator = content_generator
+        self.output = output
+        self.concurrency = concurrency
+        self.with_image = with_image
+        self.assets = assets
+
+    async def run(self, items: Iterable[BulkItem]):
+        """Обработка всех еще не готовых записей"""
+        progress = _Progress(self.output)
+        # Общий итератор: каждый обработчик берет следующую запись, когда освобождается
+        pending = self.output.pending(items)
+
+        async def worker():
+            for item in pending:
+                await self._process(item)
+                progress.tick()
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        progress.tick(force=True)
+
+    async def _process(self, item: BulkItem):
+        """Генерация поздравления (и изображения) для одной записи"""
+        with log_context(item.index, f"b{item.id}"):
+            if not item.context.summory:
+                self.output.write({"id": item.id, "error": "пустая запись"})
+                return
+            try:
+                greeting = await self.content_generator.generate_greeting(
+                    item.context, item.index, priority=Priority.GREETING
+                )
+            except Exception as e:
+                logger.warning("Поздравление для %s не создано: %s", item.id, e)
+                self.output.write({"id": item.id, "error": str(e)})
+                return
+            record = {"id": item.id, "greeting": greeting}
+            if self.with_image:
+                try:
+                    image = await self.content_generator.generate_image(greeting, item.index)
+                    record["image"] = self._image_ref(image)
+                except Exception as e:
+                    # Текст уже готов: запись считается выполненной и без изображения
+                    logger.warning("Изображение для %s не создано: %s", item.id, e)
+                    record["image_error"] = str(e)
+            self.output.write(record)
+
+    def _image_ref(self, image: str) -> str:
+        """Путь к сохраненному файлу или ссылка OpenAI"""
+        if self.assets and self.assets.is_asset(image):
+            path = self.assets.path(image)
+            if path:
+                return str(path)
+        return image
+
+
+class BatchApiGenerator:
+    """
+    Генерация через OpenAI Batch API
+
+    Запросы отправляются файлом и выполняются асинхронно в течение
+    суток: вдвое дешевле онлайн-запросов и без лимитов RPM/TPM бота.
+    Id созданных пакетов сохраняются в файл состояния рядом с файлом
+    результатов, поэтому после перезапуска опрос продолжается, а не
+    создаются новые пакеты. Изображения этим способом не генерируются.
+    """
+
+    def __init__(
+        self,
+        ai_service: AIService,
+        output: BulkOutput,
+        poll_interval: float = 30.0,
+        max_requests: int = BATCH_MAX_REQUESTS
+    ):
+        """
+        Args:
+            ai_service: сервис OpenAI
+            output: файл результатов
+            poll_interval: интервал опроса статуса пакета, сек
+            max_requests: максимум запросов в одном пакете
+        """
+        self.ai_service = ai_service
+        self.output = output
+        self.poll_interval = poll_interval
+        self.max_requests = max_requests
+        self.state_path = output.path.with_name(output.path.name + ".batches.json")
+
+    async def run(self, items: Iterable[BulkItem]):
+        """
+        Отправка пакетов и сбор результатов
+
+        Если остались пакеты прошлого запуска, собираются только они;
+        записи, которые в них не вошли, обрабатывает следующий запуск.
+        """
+        progress = _Progress(self.output)
+        batches = self._load_state()
+        if batches:
+            logger.info("Продолжение опроса пакетов: %s", ", ".join(batches))
+        else:
+            batches = await self._submit(self.output.pending(items))
+        for batch_id in batches:
+            await self._collect(batch_id)
+        self.state_path.unlink(missing_ok=True)
+        progress.tick(force=True)
+
+    def _load_state(self) -> List[str]:
+        if not self.state_path.exists():
+            return []
+        return json.loads(self.state_path.read_text(encoding="utf-8"))["batches"]
+
+    def _save_state(self, batches: List[str]):
+        tmp_path = self.state_path.with_name(self.state_path.name + ".tmp")
+        tmp_path.write_text(json.dumps({"batches": batches}), encoding="utf-8")
+        tmp_path.replace(self.state_path)
+
+    async def _submit(self, items: Iterable[BulkItem]) -> List[str]:
+        """Создание пакетов по max_requests запросов"""
+        batches: List[str] = []
+        chunk: List[dict] = []
+        seen: Set[str] = set()
+
+        async def flush():
+            batches.append(await self.ai_service.create_batch(chunk))
+            # Состояние сохраняется сразу: пакет уже оплачивается
+            self._save_state(batches)
+            chunk.clear()
+
+        for item in items:
+            if item.id in seen:
+                # custom_id в пакете должен быть уникальным
+                logger.warning("Повторный id %s пропущен", item.id)
+                continue
+            if not item.context.summory:
+                self.output.write({"id": item.id, "error": "пустая запись"})
+                continue
+            seen.add(item.id)
+            chunk.append({
+                "custom_id": item.id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": self.ai_service.greeting_request(item.context),
+            })
+            if len(chunk) >= self.max_requests:
+                await flush()
+        if chunk:
+            await flush()
+        return batches
+
+    async def _collect(self, batch_id: str):
+        """Ожидание завершения пакета и запись его результатов"""
+        while True:
+            try:
+                batch = await self.ai_service.get_batch(batch_id)
+            except OpenAIError as e:
+                logger.warning("Не удалось получить статус пакета %s: %s", batch_id, e)
+                batch = None
+            if batch is not None:
+                if batch.status in BATCH_FINAL_STATUSES:
+                    break
+                counts = batch.request_counts
+                logger.info(
+                    "Пакет %s: %s, выполнено %s из %s", batch_id, batch.status,
+                    counts.completed if counts else 0, counts.total if counts else "?"
+                )
+            await asyncio.sleep(self.poll_interval)
+
+        if batch.status == "failed":
+            errors = batch.errors.data if batch.errors and batch.errors.data else []
+            logger.error(
+                "Пакет %s отклонен: %s", batch_id,
+                "; ".join(error.message or "" for error in errors) or "без описания"
+            )
+            return
+        logger.info("Пакет %s завершен со статусом %s", batch_id, batch.status)
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                for line in await self.ai_service.batch_file(file_id):
+                    self._write_result(line)
+
+    def _write_result(self, line: Dict[str, Any]):
+        """Запись одной строки файла результатов пакета"""
+        item_id = line["custom_id"]
+        if item_id in self.output.done:
+            return
+        response = line.get("response") or {}
+        body = response.get("body") or {}
+        if response.get("status_code") == 200:
+            try:
+                greeting = self.ai_service.greeting_from_batch(body)
+                self.output.write({"id": item_id, "greeting": greeting})
+                return
+            except Exception as e:
+                error = str(e)
+        else:
+            details = line.get("error") or body.get("error") or {}
+            error = details.get("message") or f"HTTP {response.get('status_code')}"
+        logger.warning("Поздравление для %s не создано: %s", item_id, error)
+        self.output.write({"id": item_id, "error": error})
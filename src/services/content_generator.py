@@ -1,27 +1,277 @@
 """
 Генератор контента для поздравлений
 """
-from services.ai_service import AIService
+import asyncio
+import logging
+from typing import AsyncIterator, Callable, Optional
+from services.ai_service import AIService, GREETING_MODEL, IMAGE_MODEL, SlotFactory
+from services.scheduler import AIScheduler, Priority, QueueCallback
+from services.result_cache import ResultCache, Uncached
+from services.image_assets import ImageAssets
+from utils.tokens import estimate_tokens
 from models.context import Context
 
+logger = logging.getLogger(__name__)
+
+# Параметры запросов, входящие в ключ кеша
+GREETING_MAX_TOKENS = 500
+IMAGE_SIZE = "1024x1024"
+
+# Ссылки DALL-E 3 действительны около часа
+DEFAULT_IMAGE_CACHE_TTL = 3000.0
+
 class ContentGenerator:
     """Класс для генерации поздравлений и изображений"""
 
-    def __init__(self, ai_service: AIService):
-        """Инициализация генератора контента"""
+    def __init__(
+        self,
+        ai_service: AIService,
+        scheduler: Optional[AIScheduler] = None,
+        cache: Optional[ResultCache] = None,
+        image_cache_ttl: float = DEFAULT_IMAGE_CACHE_TTL,
+        assets: Optional[ImageAssets] = None
+    ):
+        """
+        Инициализация генератора контента
+
+        Args:
+            ai_service: сервис OpenAI
+            scheduler: планировщик запросов (необязательно)
+            cache: кеш готовых поздравлений и изображений (необязательно)
+            image_cache_ttl: время жизни ссылки на изображение в кеше, сек
+            assets: локальное хранилище изображений (необязательно)
+        """
         self.ai_service = ai_service
+        self.scheduler = scheduler
+        self.cache = cache
+        self.image_cache_ttl = image_cache_ttl
+        self.assets = assets
 
-    async def generate_content(self, context: Context) -> tuple[str, str]:
+    async def generate_content(
+        self,
+        context: Context,
+        user_id: int = 0,
+        on_queued: Optional[QueueCallback] = None
+    ) -> tuple[str, Optional[str]]:
         """
         Генерация поздравления и изображения
 
+        Args:
+            context: контекст диалога
+            user_id: ID пользователя для очереди планировщика
+            on_queued: уведомление о позиции в очереди планировщика
+
         Returns:
-            tuple: (текст_поздравления, url_изображения)
+            tuple: (текст_поздравления, url_изображения или None, если
+                изображение создать не удалось)
         """
         # Генерация текста поздравления
-        greeting_text = await self.ai_service.generate_greeting(context)
+        greeting_text = await self.generate_greeting(context, user_id, on_queued)
+
+        # Генерация изображения; без него отправляется только текст
+        try:
+            image_url = await self.generate_image(greeting_text, user_id, on_queued)
+        except Exception as e:
+            logger.error(f"Изображение не создано, будет отправлен только текст: {str(e)}")
+            image_url = None
+
+        return greeting_text, image_url
+
+    async def generate_greeting(
+        self,
+        context: Context,
+        user_id: int = 0,
+        on_queued: Optional[QueueCallback] = None,
+        priority: Priority = Priority.GREETING
+    ) -> str:
+        """
+        Генерация текста поздравления
+
+        Готовый текст для такого же контекста берется из кеша, только если
+        этот пользователь его еще не получал: повторный запрос дает новый.
+
+        Returns:
+            str: текст поздравления
+        """
+        async def request():
+            text, model = await self.ai_service.generate_greeting(
+                context, user_id,
+                self._slot(user_id, priority, self._greeting_tokens(context, user_id), on_queued)
+            )
+            # Ответ запасной модели не кешируется под ключом основной
+            return text if model == GREETING_MODEL else Uncached(text)
+
+        if not self.cache:
+            result = await request()
+            return result.value if isinstance(result, Uncached) else result
+        return await self.cache.get_or_create(
+            self._greeting_key(context, user_id), request, user_id=user_id
+        )
+
+    async def generate_greetings(
+        self,
+        context: Context,
+        user_id: int = 0,
+        count: int = 3,
+        on_queued: Optional[QueueCallback] = None,
+        priority: Priority = Priority.GREETING
+    ) -> list[str]:
+        """
+        Генерация нескольких вариантов поздравления одним запросом
+
+        Результат не кешируется: варианты хранит GreetingVariants.
+
+        Returns:
+            list[str]: тексты вариантов
+        """
+        return await self.ai_service.generate_greetings(
+            context, count, user_id,
+            self._slot(user_id, priority, self._greeting_tokens(context, user_id, count), on_queued)
+        )
+
+    def _greeting_tokens(self, context: Context, user_id: int, count: int = 1) -> int:
+        """Оценка токенов запроса поздравления вместе с неизменной частью промпта"""
+        return (
+            estimate_tokens(context.prompt_text(), completion=GREETING_MAX_TOKENS * count)
+            + self.ai_service.prompts.prefix_tokens("greeting", user_id)
+        )
+
+    async def stream_greeting(
+        self,
+        context: Context,
+        user_id: int = 0,
+        on_queued: Optional[QueueCallback] = None
+    ) -> AsyncIterator[str]:
+        """
+        Потоковая генерация текста поздравления
+
+        Слот планировщика удерживается до конца потока. Готовый или уже
+        генерируемый для такого же контекста текст отдается целиком.
 
-        # Генерация изображения
-        image_url = await self.ai_service.generate_image(greeting_text)
+        Yields:
+            str: очередной фрагмент текста
+        """
+        if not self.cache:
+            async for chunk in self._stream(context, user_id, on_queued):
+                yield chunk
+            return
+
+        key = self._greeting_key(context, user_id)
+        cached = self.cache.get(key, user_id)
+        if cached is not None:
+            self.cache.hits += 1
+            yield cached
+            return
+        future = self.cache.inflight(key)
+        while future is not None:
+            self.cache.coalesced += 1
+            text = await self.cache.join(future)
+            if text is not None:
+                self.cache.mark_served(key, user_id)
+                yield text
+                return
+            future = self.cache.inflight(key)
+
+        self.cache.misses += 1
+        future = self.cache.start_flight(key)
+        parts = []
+        models = []
+        try:
+            async for chunk in self._stream(context, user_id, on_queued, models.append):
+                parts.append(chunk)
+                yield chunk
+            text = "".join(parts)
+            # Ответ запасной модели не кешируется под ключом основной
+            result = text if models == [GREETING_MODEL] else Uncached(text)
+            self.cache.finish_flight(key, future, result, user_id=user_id)
+        except GeneratorExit:
+            # Поток бросили, не дочитав: ожидающие получат отмену
+            self.cache.finish_flight(key, future, error=asyncio.CancelledError())
+            raise
+        except BaseException as e:
+            self.cache.finish_flight(key, future, error=e)
+            raise
+
+    async def _stream(
+        self,
+        context: Context,
+        user_id: int,
+        on_queued: Optional[QueueCallback],
+        on_model: Optional[Callable[[str], None]] = None
+    ) -> AsyncIterator[str]:
+        """Потоковый запрос через слот планировщика"""
+        slot = self._slot(user_id, Priority.GREETING, self._greeting_tokens(context, user_id), on_queued)
+        async for chunk in self.ai_service.stream_greeting(context, on_model, user_id, slot):
+            yield chunk
+
+    async def generate_image(
+        self,
+        greeting_text: str,
+        user_id: int = 0,
+        on_queued: Optional[QueueCallback] = None,
+        priority: Priority = Priority.IMAGE
+    ) -> str:
+        """
+        Генерация изображения к готовому тексту поздравления
+
+        Если настроено хранилище изображений, картинка запрашивается
+        в base64 и сохраняется локально, поэтому результат не зависит
+        от времени жизни ссылок OpenAI.
+
+        Returns:
+            str: url изображения или ссылка asset:<id> на сохраненный файл
+        """
+        async def request():
+            if not self.assets:
+                return await self._schedule(
+                    IMAGE_MODEL, user_id, priority,
+                    lambda: self.ai_service.generate_image(greeting_text, user_id=user_id),
+                    0, on_queued
+                )
+            image = await self._schedule(
+                IMAGE_MODEL, user_id, priority,
+                lambda: self.ai_service.generate_image(greeting_text, response_format="b64_json", user_id=user_id),
+                0, on_queued
+            )
+            return await self.assets.ingest(image)
+
+        if not self.cache:
+            return await request()
+        key = ResultCache.make_key(
+            "image", IMAGE_MODEL, IMAGE_SIZE, bool(self.assets),
+            self.ai_service.prompts.select("image", user_id).key, greeting_text.strip()
+        )
+        ttl = None if self.assets else self.image_cache_ttl
+        return await self.cache.get_or_create(key, request, ttl=ttl)
+
+    def _greeting_key(self, context: Context, user_id: int) -> str:
+        """Ключ кеша поздравления: модель, параметры, версия промпта и хеш нормализованного контекста"""
+        return ResultCache.make_key(
+            "greeting", GREETING_MODEL, GREETING_MAX_TOKENS,
+            self.ai_service.prompts.select("greeting", user_id).key, context.cache_key()
+        )
+
+    def _slot(
+        self,
+        user_id: int,
+        priority: Priority,
+        tokens: int,
+        on_queued: Optional[QueueCallback]
+    ) -> Optional[SlotFactory]:
+        """
+        Слоты планировщика для запроса поздравления
+
+        Слот берется отдельно для каждой модели, к которой идет запрос,
+        поэтому переход на запасную модель учитывается в ее лимитах.
+        """
+        if not self.scheduler:
+            return None
+        return lambda model: self.scheduler.slot(model, user_id, priority, tokens, on_queued)
 
-        return greeting_text, image_url
\ No newline at end of file
+    async def _schedule(self, model, user_id, priority, func, tokens, on_queued):
+        """Выполнение запроса через планировщик, если он настроен"""
+        if not self.scheduler:
+            return await func()
+        return await self.scheduler.run(
+            model, user_id, priority, func, tokens=tokens, on_queued=on_queued
+        )
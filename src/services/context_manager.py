@@ -1,77 +1,267 @@
 """
 Менеджер контекста диалога
 """
-from typing import Dict, Optional
+from typing import Dict, List, Optional
+import asyncio
 import logging
 from models.context import Context
-from services.ai_service import AIService
+from services.ai_service import AIService, ANALYSIS_MODEL
+from services.context_store import ContextStore, MemoryContextStore
+from services.scheduler import AIScheduler, Priority, QueueCallback, QueueFullError
+from utils.tokens import count_tokens, estimate_tokens
 
 logger = logging.getLogger(__name__)
 
 class ContextManager:
     """Класс для управления контекстом диалога с пользователем"""
 
-    def __init__(self, ai_service: AIService):
+    def __init__(
+        self,
+        ai_service: AIService,
+        scheduler: Optional[AIScheduler] = None,
+        quiet_window: float = 0.0,
+        store: Optional[ContextStore] = None,
+        summary_token_budget: int = 0,
+        delta_mode: bool = False
+    ):
         """
         Инициализация хранилища контекстов
         Args:
             ai_service: Сервис для работы с ИИ
+            scheduler: Планировщик запросов к OpenAI (необязательно)
+            quiet_window: Сколько секунд ждать следующего сообщения перед анализом
+            store: Хранилище контекстов (по умолчанию - в памяти без ограничений)
+            summary_token_budget: Предел размера резюме в токенах, 0 - без предела
+            delta_mode: Модель возвращает только изменения фактов, слияние - локально
         """
         logger.info("Инициализация ContextManager")
-        self._contexts: Dict[int, Context] = {}
+        self._store = store or MemoryContextStore()
         self.ai_service = ai_service
+        self.scheduler = scheduler
+        self.quiet_window = quiet_window
+        self.summary_token_budget = summary_token_budget
+        self.delta_mode = delta_mode
+        # Буфер входящих сообщений, ещё не прошедших анализ
+        self._pending: Dict[int, List[str]] = {}
+        # Номер последнего сообщения пользователя, чтобы понять, кончилась ли серия
+        self._sequence: Dict[int, int] = {}
+        # Не более одного анализа на пользователя одновременно
+        self._locks: Dict[int, asyncio.Lock] = {}
+        # Счетчик очисток контекста во время анализа: результат анализа
+        # очищенного контекста не сохраняется
+        self._generation: Dict[int, int] = {}
 
     def get_context(self, user_id: int) -> Optional[Context]:
         """
         Получение контекста для пользователя
         """
-        return self._contexts.get(user_id)
+        return self._store.get(user_id)
 
-    async def update_context(self, user_id: int, message: str) -> Context:
+    async def update_context(
+        self,
+        user_id: int,
+        message: str,
+        on_queued: Optional[QueueCallback] = None
+    ) -> Optional[Context]:
         """
         Обновление контекста на основе нового сообщения
 
+        Сообщения, пришедшие с интервалом меньше quiet_window, объединяются
+        и анализируются одним запросом. Контекст возвращается только тому
+        вызову, который выполнил анализ; остальные получают None, так как
+        их сообщения вошли в общий ответ.
+
         Args:
             user_id: ID пользователя
             message: Текст сообщения
+            on_queued: Уведомление о позиции в очереди планировщика
 
         Returns:
-            Context: Обновленный контекст
+            Context | None: Обновленный контекст или None, если сообщение
+            обработано вместе с другими или контекст очистили во время анализа
+
+        Raises:
+            QueueFullError: если планировщик не принял запрос; сообщения
+                остаются в буфере и войдут в следующий анализ
         """
-        logger.debug(f"Обновление контекста для пользователя {user_id}")
+        logger.debug("Обновление контекста для пользователя %s", user_id)
+
+        self._pending.setdefault(user_id, []).append(message)
+        sequence = self._sequence.get(user_id, 0) + 1
+        self._sequence[user_id] = sequence
 
-        if user_id not in self._contexts:
-            logger.debug(f"Создание нового контекста для пользователя {user_id}")
-            self._contexts[user_id] = Context()
+        if self.quiet_window > 0:
+            await asyncio.sleep(self.quiet_window)
+            if self._sequence.get(user_id) != sequence:
+                logger.debug("Сообщение пользователя %s объединено со следующим", user_id)
+                return None
+
+        lock = self._locks.setdefault(user_id, asyncio.Lock())
+        try:
+            async with lock:
+                batch = self._pending.pop(user_id, [])
+                if not batch:
+                    # Сообщение уже вошло в анализ, выполненный другим вызовом
+                    return None
+                generation = self._generation.get(user_id, 0)
+                try:
+                    return await self._apply_batch(user_id, batch, on_queued, generation)
+                except QueueFullError:
+                    if self._generation.get(user_id, 0) == generation:
+                        # Пачка уже извлечена из буфера: возвращаем ее перед более новыми сообщениями
+                        self._pending[user_id] = batch + self._pending.get(user_id, [])
+                    raise
+        finally:
+            if not lock.locked() and user_id not in self._pending:
+                self._locks.pop(user_id, None)
+                self._sequence.pop(user_id, None)
+                self._generation.pop(user_id, None)
+
+    async def _apply_batch(
+        self,
+        user_id: int,
+        batch: List[str],
+        on_queued: Optional[QueueCallback],
+        generation: int = 0
+    ) -> Optional[Context]:
+        """
+        Анализ пачки сообщений одним запросом и обновление контекста
+
+        Если контекст очистили, пока шел анализ, результат не сохраняется
+        и возвращается None.
+        """
+        context = self._store.get(user_id)
+        if context is None:
+            logger.debug("Создание нового контекста для пользователя %s", user_id)
+            context = Context()
+
+        message = "\n".join(batch)
+        if len(batch) > 1:
+            logger.debug("Объединено %s сообщений пользователя %s", len(batch), user_id)
 
-        context = self._contexts[user_id]
-        
         # Анализ сообщения с помощью ИИ
         try:
-            analyzed_data = await self.ai_service.analyze_context(message, context)
-            logger.debug(f"Результат анализа контекста: {analyzed_data}")
-            
-            
-            # Обновление контекста с анализом
-            context.update_summory(analyzed_data)
-            
-
-            # Добавление исходного сообщения в историю
-            context.add_message(message)
-
-            logger.debug(f"Контекст успешно обновлен: {context}")
+            if self.delta_mode:
+                changed, removed = await self._analyze(
+                    user_id,
+                    lambda: self.ai_service.analyze_context_delta(message, context, user_id),
+                    estimate_tokens(message, context.summory, completion=100)
+                    + self._prefix_tokens("delta_analysis", user_id),
+                    on_queued
+                )
+                # Слияние изменений без пересказа всего резюме моделью
+                context.apply_delta(changed, removed)
+            else:
+                analyzed_data = await self._analyze(
+                    user_id,
+                    lambda: self.ai_service.analyze_context(message, context, user_id),
+                    estimate_tokens(message, context.summory, completion=300)
+                    + self._prefix_tokens("analysis", user_id),
+                    on_queued
+                )
+                logger.debug("Результат анализа контекста: %s", analyzed_data)
+
+                # Обновление контекста с анализом
+                context.update_summory(analyzed_data)
+
+            try:
+                await self._enforce_budget(user_id, context)
+            except QueueFullError:
+                # Анализ уже применен, повторять его нельзя: сжатие выполнится при следующем обновлении
+                logger.warning("Сжатие резюме пользователя %s отложено: очередь переполнена", user_id)
+
+            # Добавление исходных сообщений в историю
+            for item in batch:
+                context.add_message(item)
+            if self._cleared(user_id, generation):
+                return None
+            self._store.put(user_id, context)
+
+            logger.debug("Контекст успешно обновлен: %s", context)
             return context
 
+        except QueueFullError:
+            raise
         except Exception as e:
-            logger.error(f"Ошибка при анализе контекста: {str(e)}", exc_info=True)
-            # В случае ошибки анализа, просто сохраняем сообщение
-            context.add_message(message)
+            logger.error("Ошибка при анализе контекста: %s", e, exc_info=True)
+            # В случае ошибки анализа, просто сохраняем сообщения
+            for item in batch:
+                context.add_message(item)
+            if self._cleared(user_id, generation):
+                return None
+            self._store.put(user_id, context)
             return context
 
+    def _cleared(self, user_id: int, generation: int) -> bool:
+        """Очищен ли контекст после начала анализа"""
+        if self._generation.get(user_id, 0) == generation:
+            return False
+        logger.debug("Контекст пользователя %s очищен во время анализа, результат не сохраняется", user_id)
+        return True
+
+    def _prefix_tokens(self, name: str, user_id: int) -> int:
+        """Токены неизменной части промпта для оценки лимита планировщика"""
+        return self.ai_service.prompts.prefix_tokens(name, user_id)
+
+    async def _analyze(self, user_id: int, func, tokens: int, on_queued: Optional[QueueCallback]):
+        """Запрос к модели анализа через планировщик, если он настроен"""
+        if not self.scheduler:
+            return await func()
+        return await self.scheduler.run(
+            ANALYSIS_MODEL,
+            user_id,
+            Priority.ANALYSIS,
+            func,
+            tokens=tokens,
+            on_queued=on_queued
+        )
+
+    async def _enforce_budget(self, user_id: int, context: Context):
+        """
+        Сжатие резюме, если оно вышло за бюджет токенов
+
+        Благодаря этому размер запросов анализа и генерации не растет
+        с длиной диалога.
+        """
+        if not self.summary_token_budget:
+            return
+        tokens = count_tokens(context.summory)
+        if tokens <= self.summary_token_budget:
+            return
+
+        logger.info(
+            f"Резюме пользователя {user_id} превысило бюджет "
+            f"({tokens} > {self.summary_token_budget} токенов), сжатие"
+        )
+        budget = self.summary_token_budget
+        if context.facts:
+            facts = await self._analyze(
+                user_id,
+                lambda: self.ai_service.compact_facts(context.facts, budget, user_id),
+                estimate_tokens(context.summory, completion=budget * 2)
+                + self._prefix_tokens("compact_facts", user_id),
+                None
+            )
+            context.replace_facts(facts)
+        else:
+            summary = await self._analyze(
+                user_id,
+                lambda: self.ai_service.compact_summary(context.summory, budget, user_id),
+                estimate_tokens(context.summory, completion=budget)
+                + self._prefix_tokens("compact_summary", user_id),
+                None
+            )
+            context.update_summory(summary)
+        logger.debug("Резюме после сжатия: %s токенов", count_tokens(context.summory))
+
     def clear_context(self, user_id: int):
         """
         Очистка контекста пользователя
         """
-        if user_id in self._contexts:
-            logger.debug(f"Очистка контекста для пользователя {user_id}")
-            del self._contexts[user_id]
\ No newline at end of file
+        logger.debug("Очистка контекста для пользователя %s", user_id)
+        # Сообщения, не принятые на анализ при переполнении очереди, тоже удаляются
+        self._pending.pop(user_id, None)
+        if user_id in self._locks:
+            # Идущий анализ не должен вернуть очищенный контекст
+            self._generation[user_id] = self._generation.get(user_id, 0) + 1
+        self._store.delete(user_id)
\ No newline at end of file
@@ -0,0 +1,218 @@
+"""
+Хранилища контекстов диалога
+"""
+import json
+import logging
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Optional
+from models.context import Context
+
+logger = logging.getLogger(__name__)
+
+EvictCallback = Callable[[int, Context], None]
+
+
+class ContextStore(ABC):
+    """Интерфейс хранилища контекстов пользователей"""
+
+    @abstractmethod
+    def get(self, user_id: int) -> Optional[Context]:
+        """Получение контекста пользователя"""
+
+    @abstractmethod
+    def put(self, user_id: int, context: Context):
+        """Сохранение контекста пользователя"""
+
+    @abstractmethod
+    def delete(self, user_id: int):
+        """Удаление контекста пользователя"""
+
+    def close(self):
+        """Освобождение ресурсов хранилища"""
+
+
+class MemoryContextStore(ContextStore):
+    """
+    Хранилище в памяти с вытеснением по LRU и времени простоя
+
+    Записи упорядочены по времени последнего обращения, поэтому
+    устаревшие записи всегда находятся в начале и удаляются за O(1).
+    """
+
+    def __init__(
+        self,
+        max_size: int = 0,
+        idle_ttl: float = 0.0,
+        on_evict: Optional[EvictCallback] = None
+    ):
+        """
+        Args:
+            max_size: максимальное число контекстов, 0 - без ограничения
+            idle_ttl: время простоя в секундах до вытеснения, 0 - без ограничения
+            on_evict: вызывается для каждого вытесненного контекста
+        """
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self.on_evict = on_evict
+        self._items: "OrderedDict[int, tuple[Context, float]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, user_id: int) -> Optional[Context]:
+        item = self._items.get(user_id)
+        if item is None:
+            return None
+        context, touched = item
+        now = time.monotonic()
+        if self.idle_ttl and now - touched > self.idle_ttl:
+            self._evict(user_id)
+            return None
+        self._items[user_id] = (context, now)
+        self._items.move_to_end(user_id)
+        return context
+
+    def put(self, user_id: int, context: Context):
+        self._items[user_id] = (context, time.monotonic())
+        self._items.move_to_end(user_id)
+        self._expire()
+
+    def delete(self, user_id: int):
+        self._items.pop(user_id, None)
+
+    def _expire(self):
+        """Вытеснение устаревших и лишних записей с начала очереди"""
+        now = time.monotonic()
+        while self._items:
+            user_id, (_, touched) = next(iter(self._items.items()))
+            expired = self.idle_ttl and now - touched > self.idle_ttl
+            if not expired and not (self.max_size and len(self._items) > self.max_size):
+                break
+            self._evict(user_id)
+
+    def _evict(self, user_id: int):
+        context, _ = self._items.pop(user_id)
+        if self.on_evict:
+            self.on_evict(user_id, context)
+
+
+class SQLiteContextStore(ContextStore):
+    """Хранилище контекстов в локальной базе SQLite"""
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: путь к файлу базы данных
+        """
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS contexts ("
+            "user_id INTEGER PRIMARY KEY, data BLOB NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._db.commit()
+        logger.info(f"Хранилище контекстов SQLite: {path}")
+
+    def get(self, user_id: int) -> Optional[Context]:
+        row = self._db.execute(
+            "SELECT data FROM contexts WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        try:
+            return self._decode(row[0])
+        except Exception as e:
+            logger.error(f"Не удалось прочитать контекст {user_id}: {str(e)}", exc_info=True)
+            return None
+
+    def put(self, user_id: int, context: Context):
+        self._db.execute(
+            "INSERT INTO contexts (user_id, data, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, "
+            "updated_at = excluded.updated_at",
+            (user_id, self._encode(context), time.time())
+        )
+        self._db.commit()
+
+    def delete(self, user_id: int):
+        self._db.execute("DELETE FROM contexts WHERE user_id = ?", (user_id,))
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    @staticmethod
+    def _encode(context: Context) -> bytes:
+        return context.to_bytes()
+
+    @staticmethod
+    def _decode(data: bytes) -> Context:
+        if data[:1] == b"{":
+            # Записи в JSON от предыдущих версий бота
+            payload = json.loads(data)
+            context = Context(summory=payload["summory"])
+            for message in payload.get("messages", []):
+                context.add_message(message)
+            return context
+        return Context.from_bytes(data)
+
+
+class TieredContextStore(ContextStore):
+    """
+    Двухуровневое хранилище: LRU в памяти поверх SQLite
+
+    Каждое сохранение сразу записывается на диск, поэтому вытеснение
+    из памяти ничего не теряет, а перезапуск не сбрасывает диалоги.
+    Вытесненные контексты загружаются с диска при следующем обращении.
+    """
+
+    def __init__(self, memory: MemoryContextStore, disk: ContextStore):
+        self.memory = memory
+        self.disk = disk
+
+    def get(self, user_id: int) -> Optional[Context]:
+        context = self.memory.get(user_id)
+        if context is None:
+            context = self.disk.get(user_id)
+            if context is not None:
+                logger.debug(f"Контекст пользователя {user_id} загружен с диска")
+                self.memory.put(user_id, context)
+        return context
+
+    def put(self, user_id: int, context: Context):
+        self.memory.put(user_id, context)
+        self.disk.put(user_id, context)
+
+    def delete(self, user_id: int):
+        self.memory.delete(user_id)
+        self.disk.delete(user_id)
+
+    def close(self):
+        self.memory.close()
+        self.disk.close()
+
+
+def create_context_store(
+    db_path: str | None = None,
+    max_size: int = 0,
+    idle_ttl: float = 0.0
+) -> ContextStore:
+    """
+    Создание хранилища контекстов по настройкам
+
+    Args:
+        db_path: путь к базе SQLite; если не задан, контексты хранятся только в памяти
+        max_size: максимальное число контекстов в памяти
+        idle_ttl: время простоя контекста в памяти, сек
+    """
+    memory = MemoryContextStore(max_size=max_size, idle_ttl=idle_ttl)
+    if not db_path:
+        logger.warning("Хранилище контекстов только в памяти, при перезапуске они будут потеряны")
+        return memory
+    return TieredContextStore(memory, SQLiteContextStore(db_path))
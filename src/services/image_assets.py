@@ -0,0 +1,230 @@
+"""
+Подготовка изображений открыток и индекс загруженных в Telegram файлов
+"""
+import asyncio
+import base64
+import hashlib
+import importlib.util
+import io
+import logging
+import sqlite3
+import time
+from pathlib import Path
+from typing import Optional
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Префикс ссылки на сохраненное изображение (в отличие от URL OpenAI)
+ASSET_PREFIX = "asset:"
+
+# Ограничение размера скачиваемого изображения, байт
+MAX_DOWNLOAD_SIZE = 20 * 2**20
+
+# Нижняя граница качества при подгонке под размер
+MIN_QUALITY = 40
+
+_HAS_PILLOW = importlib.util.find_spec("PIL") is not None
+
+
+def _recompress(data: bytes, image_format: str, quality: int, max_side: int, max_bytes: int) -> bytes:
+    """
+    Пересжатие изображения с ограничением размера (выполняется в отдельном потоке)
+
+    Качество понижается ступенями, пока файл не уложится в max_bytes.
+    """
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as source:
+        image = source.convert("RGB")
+    if max_side and max(image.size) > max_side:
+        image.thumbnail((max_side, max_side))
+    while True:
+        output = io.BytesIO()
+        image.save(output, image_format, quality=quality, optimize=True)
+        if not max_bytes or output.tell() <= max_bytes or quality <= MIN_QUALITY:
+            return output.getvalue()
+        quality -= 10
+
+
+class ImageAssets:
+    """
+    Локальные копии изображений и file_id, полученные от Telegram
+
+    Изображение скачивается (или декодируется из b64_json) один раз,
+    пересжимается в отдельном потоке и сохраняется на диск. После первой
+    отправки Telegram возвращает file_id, и повторные отправки идут
+    без загрузки файла и без обращения к временной ссылке OpenAI.
+    """
+
+    def __init__(
+        self,
+        http_client: httpx.AsyncClient,
+        directory: str = "data/images",
+        image_format: str = "JPEG",
+        quality: int = 85,
+        max_side: int = 1024,
+        max_bytes: int = 512 * 1024,
+        ttl: float = 30 * 86400.0
+    ):
+        """
+        Args:
+            http_client: общий HTTP-клиент для скачивания изображений
+            directory: каталог для файлов и индекса
+            image_format: формат пересжатия (JPEG или WEBP)
+            quality: начальное качество сжатия
+            max_side: максимальная сторона изображения, px
+            max_bytes: предел размера файла, 0 - без предела
+            ttl: время хранения файлов, сек
+        """
+        logger.info("Инициализация ImageAssets")
+        if not _HAS_PILLOW:
+            logger.warning("Пакет Pillow не установлен, изображения не пересжимаются")
+        self._http_client = http_client
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.image_format = image_format.upper()
+        self.quality = quality
+        self.max_side = max_side
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.uploads = 0
+        self.reused = 0
+        self._db = sqlite3.connect(self.directory / "index.sqlite3")
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS images ("
+            "asset_id TEXT PRIMARY KEY, filename TEXT NOT NULL, "
+            "file_id TEXT, created_at REAL NOT NULL)"
+        )
+        self._db.commit()
+        self._prune()
+
+    @staticmethod
+    def is_asset(image: str) -> bool:
+        """Является ли ссылка ссылкой на сохраненное изображение"""
+        return image.startswith(ASSET_PREFIX)
+
+    async def ingest(self, source: str) -> str:
+        """
+        Сохранение изображения из ответа OpenAI
+
+        Args:
+            source: URL изображения или содержимое в base64 (b64_json)
+
+        Returns:
+            str: ссылка вида asset:<id>
+        """
+        if self.is_asset(source):
+            return source
+        if source.startswith(("http://", "https://")):
+            data = await self._download(source)
+        else:
+            data = base64.b64decode(source)
+        asset_id = hashlib.sha256(data).hexdigest()[:32]
+        if self._filename(asset_id) is None:
+            filename = await asyncio.to_thread(self._prepare, asset_id, data)
+            self._db.execute(
+                "INSERT OR REPLACE INTO images (asset_id, filename, file_id, created_at) "
+                "VALUES (?, ?, NULL, ?)",
+                (asset_id, filename, time.time())
+            )
+            self._db.commit()
+        return ASSET_PREFIX + asset_id
+
+    def file_id(self, image: str) -> Optional[str]:
+        """file_id изображения в Telegram, если оно уже отправлялось"""
+        row = self._db.execute(
+            "SELECT file_id FROM images WHERE asset_id = ?", (image[len(ASSET_PREFIX):],)
+        ).fetchone()
+        return row[0] if row else None
+
+    def remember(self, image: str, file_id: str):
+        """Сохранение file_id после первой загрузки в Telegram"""
+        self.uploads += 1
+        self._db.execute(
+            "UPDATE images SET file_id = ? WHERE asset_id = ?",
+            (file_id, image[len(ASSET_PREFIX):])
+        )
+        self._db.commit()
+
+    def forget(self, image: str):
+        """Сброс file_id, который Telegram больше не принимает"""
+        self._db.execute(
+            "UPDATE images SET file_id = NULL WHERE asset_id = ?", (image[len(ASSET_PREFIX):],)
+        )
+        self._db.commit()
+
+    def path(self, image: str) -> Optional[Path]:
+        """Путь к файлу сохраненного изображения или None, если файла нет"""
+        filename = self._filename(image[len(ASSET_PREFIX):])
+        return self.directory / filename if filename else None
+
+    async def read(self, image: str) -> tuple[bytes, str]:
+        """
+        Содержимое файла для загрузки в Telegram
+
+        Returns:
+            tuple: (данные, имя_файла)
+        """
+        filename = self._filename(image[len(ASSET_PREFIX):])
+        if filename is None:
+            raise FileNotFoundError(f"Изображение {image} не найдено")
+        data = await asyncio.to_thread((self.directory / filename).read_bytes)
+        return data, filename
+
+    def close(self):
+        """Закрытие индекса"""
+        logger.info(f"Изображения: загружено {self.uploads}, отправлено по file_id {self.reused}")
+        self._db.close()
+
+    async def _download(self, url: str) -> bytes:
+        """Потоковое скачивание изображения с ограничением размера"""
+        buffer = bytearray()
+        async with self._http_client.stream("GET", url) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes():
+                buffer.extend(chunk)
+                if len(buffer) > MAX_DOWNLOAD_SIZE:
+                    raise ValueError("Изображение превышает допустимый размер")
+        return bytes(buffer)
+
+    def _prepare(self, asset_id: str, data: bytes) -> str:
+        """Пересжатие и запись файла на диск"""
+        extension = "png"
+        if _HAS_PILLOW:
+            try:
+                data = _recompress(
+                    data, self.image_format, self.quality, self.max_side, self.max_bytes
+                )
+                extension = "jpg" if self.image_format == "JPEG" else self.image_format.lower()
+            except Exception as e:
+                logger.error(f"Не удалось пересжать изображение: {str(e)}", exc_info=True)
+        filename = f"{asset_id}.{extension}"
+        (self.directory / filename).write_bytes(data)
+        logger.debug(f"Изображение {filename} сохранено, {len(data)} байт")
+        return filename
+
+    def _filename(self, asset_id: str) -> Optional[str]:
+        row = self._db.execute(
+            "SELECT filename FROM images WHERE asset_id = ?", (asset_id,)
+        ).fetchone()
+        if row is None or not (self.directory / row[0]).exists():
+            return None
+        return row[0]
+
+    def _prune(self):
+        """Удаление файлов старше ttl"""
+        if not self.ttl:
+            return
+        expired = self._db.execute(
+            "SELECT asset_id, filename FROM images WHERE created_at < ?",
+            (time.time() - self.ttl,)
+        ).fetchall()
+        for asset_id, filename in expired:
+            (self.directory / filename).unlink(missing_ok=True)
+            self._db.execute("DELETE FROM images WHERE asset_id = ?", (asset_id,))
+        self._db.commit()
+        if expired:
+            logger.info(f"Удалено устаревших изображений: {len(expired)}")
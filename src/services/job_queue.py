@@ -0,0 +1,368 @@
+"""
+Долговременная очередь задач генерации и пул обработчиков
+"""
+import asyncio
+import json
+import logging
+import random
+import sqlite3
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from utils.logger import log_context
+from utils.metrics import JOB_LATENCY
+
+logger = logging.getLogger(__name__)
+
+# Состояния задачи
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Сколько хранить завершенные задачи, сек
+FINISHED_TTL = 86400.0
+
+
+@dataclass(slots=True)
+class Job:
+    """Задача генерации"""
+    id: int
+    kind: str
+    user_id: int
+    chat_id: int
+    payload: Dict[str, Any]
+    priority: int
+    attempts: int
+
+
+class JobQueue:
+    """
+    Очередь задач в SQLite
+
+    Задачи переживают перезапуск бота: выполняющаяся задача арендуется
+    обработчиком, и если аренду перестали продлевать (процесс остановлен),
+    задача возвращается в очередь. Выборка идет по
+    приоритету (меньше - раньше), затем по времени постановки. Для одного
+    ключа дедупликации одновременно может существовать только одна
+    незавершенная задача. Очередь можно разделять между процессами:
+    задача захватывается одним атомарным запросом.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: путь к файлу базы данных
+        """
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, "
+            "user_id INTEGER NOT NULL, chat_id INTEGER NOT NULL, payload TEXT NOT NULL, "
+            "priority INTEGER NOT NULL, status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, "
+            "run_after REAL NOT NULL, dedup_key TEXT, error TEXT, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, priority, run_after, id)"
+        )
+        self._db.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS jobs_dedup ON jobs (dedup_key) "
+            "WHERE status IN ('queued', 'running')"
+        )
+        self._db.commit()
+        logger.info("Очередь задач SQLite: %s", path)
+
+    def enqueue(
+        self,
+        kind: str,
+        user_id: int,
+        chat_id: int,
+        payload: Dict[str, Any],
+        priority: int = 0,
+        dedup_key: str | None = None,
+        delay: float = 0.0
+    ) -> Optional[int]:
+        """
+        Постановка задачи в очередь
+
+        Args:
+            kind: тип задачи
+            user_id: ID пользователя
+            chat_id: чат для доставки результата
+            payload: данные задачи (JSON)
+            priority: приоритет, меньше - раньше
+            dedup_key: ключ дедупликации незавершенных задач
+            delay: задержка перед первым запуском, сек
+
+        Returns:
+            ID задачи или None, если такая задача уже в очереди
+        """
+        now = time.time()
+        try:
+            cursor = self._db.execute(
+                "INSERT INTO jobs (kind, user_id, chat_id, payload, priority, status, "
+                "run_after, dedup_key, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (kind, user_id, chat_id, json.dumps(payload, ensure_ascii=False), priority,
+                 QUEUED, now + delay, dedup_key, now, now)
+            )
+        except sqlite3.IntegrityError:
+            return None
+        self._db.commit()
+        return cursor.lastrowid
+
+    def claim(self) -> Optional[Job]:
+        """Захват следующей готовой задачи"""
+        now = time.time()
+        row = self._db.execute(
+            "UPDATE jobs SET status = ?, attempts = attempts + 1, updated_at = ? "
+            "WHERE id = (SELECT id FROM jobs WHERE status = ? AND run_after <= ? "
+            "ORDER BY priority, id LIMIT 1) "
+            "RETURNING id, kind, user_id, chat_id, payload, priority, attempts",
+            (RUNNING, now, QUEUED, now)
+        ).fetchone()
+        self._db.commit()
+        if row is None:
+            return None
+        job_id, kind, user_id, chat_id, payload, priority, attempts = row
+        return Job(job_id, kind, user_id, chat_id, json.loads(payload), priority, attempts)
+
+    def complete(self, job_id: int):
+        """Отметка об успешном выполнении"""
+        self._finish(job_id, DONE, None)
+
+    def retry(self, job_id: int, delay: float, error: str):
+        """Возврат задачи в очередь после ошибки"""
+        now = time.time()
+        self._db.execute(
+            "UPDATE jobs SET status = ?, run_after = ?, error = ?, updated_at = ? WHERE id = ?",
+            (QUEUED, now + delay, error, now, job_id)
+        )
+        self._db.commit()
+
+    def fail(self, job_id: int, error: str):
+        """Окончательная ошибка задачи"""
+        self._finish(job_id, FAILED, error)
+
+    def touch(self, job_ids: List[int]):
+        """Продление аренды выполняющихся задач"""
+        if not job_ids:
+            return
+        placeholders = ", ".join("?" * len(job_ids))
+        self._db.execute(
+            f"UPDATE jobs SET updated_at = ? WHERE status = ? AND id IN ({placeholders})",
+            (time.time(), RUNNING, *job_ids)
+        )
+        self._db.commit()
+
+    def requeue_stale(self, lease: float) -> int:
+        """
+        Возврат в очередь задач, аренда которых истекла
+        (обработчик был остановлен или завершился аварийно)
+
+        Returns:
+            int: число возвращенных задач
+        """
+        now = time.time()
+        cursor = self._db.execute(
+            "UPDATE jobs SET status = ?, run_after = ?, updated_at = ? "
+            "WHERE status = ? AND updated_at < ?",
+            (QUEUED, now, now, RUNNING, now - lease)
+        )
+        self._db.execute(
+            "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+            (DONE, FAILED, now - FINISHED_TTL)
+        )
+        self._db.commit()
+        return cursor.rowcount
+
+    def next_run_at(self) -> Optional[float]:
+        """Время, когда будет готова ближайшая задача"""
+        row = self._db.execute(
+            "SELECT MIN(run_after) FROM jobs WHERE status = ?", (QUEUED,)
+        ).fetchone()
+        return row[0]
+
+    def pending(self) -> int:
+        """Число незавершенных задач"""
+        return self._db.execute(
+            "SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)
+        ).fetchone()[0]
+
+    def close(self):
+        self._db.close()
+
+    def _finish(self, job_id: int, status: str, error: str | None):
+        self._db.execute(
+            "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+            (status, error, time.time(), job_id)
+        )
+        self._db.commit()
+
+
+JobHandler = Callable[[Job], Awaitable[None]]
+FailureHandler = Callable[[Job, BaseException], Awaitable[None]]
+
+
+class JobWorkerPool:
+    """
+    Пул обработчиков очереди задач
+
+    Ошибка обработчика приводит к повтору с экспоненциальной задержкой
+    и случайным разбросом; после max_attempts попыток вызывается
+    on_failure (например, чтобы сообщить пользователю об ошибке).
+    """
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        handlers: Dict[str, JobHandler],
+        on_failure: Optional[FailureHandler] = None,
+        concurrency: int = 4,
+        max_attempts: int = 3,
+        backoff: float = 5.0,
+        max_backoff: float = 300.0,
+        poll_interval: float = 1.0,
+        lease: float = 60.0
+    ):
+        """
+        Args:
+            queue: очередь задач
+            handlers: обработчики по типам задач
+            on_failure: вызывается после последней неудачной попытки
+            concurrency: число одновременно выполняемых задач
+            max_attempts: максимум попыток выполнения задачи
+            backoff: задержка перед первым повтором, сек
+            max_backoff: максимальная задержка перед повтором, сек
+            poll_interval: период проверки очереди (для задач других процессов), сек
+            lease: через сколько секунд без продления задача другого обработчика
+                считается брошенной и возвращается в очередь
+        """
+        logger.info("Инициализация JobWorkerPool: %s обработчиков", concurrency)
+        self.queue = queue
+        self.handlers = handlers
+        self.on_failure = on_failure
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._running: set[int] = set()
+        self._workers: List[asyncio.Task] = []
+        self._keepalive: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Запуск обработчиков и продления аренды задач"""
+        self._workers = [
+            asyncio.create_task(self._work(), name=f"job-worker-{index}")
+            for index in range(self.concurrency)
+        ]
+        self._keepalive = asyncio.create_task(self._renew())
+
+    def notify(self):
+        """Пробуждение обработчиков после постановки задачи"""
+        self._wakeup.set()
+
+    async def stop(self, timeout: float = 10.0):
+        """
+        Остановка: новые задачи не берутся, текущие дорабатывают
+        не дольше timeout секунд, прерванные вернутся в очередь
+        после истечения аренды
+        """
+        self._stopping = True
+        self._wakeup.set()
+        if not self._workers:
+            return
+        _, pending = await asyncio.wait(self._workers, timeout=timeout)
+        for worker in pending:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._keepalive.cancel()
+        await asyncio.gather(self._keepalive, return_exceptions=True)
+        if pending:
+            logger.warning("Прервано задач при остановке: %s", len(pending))
+
+    async def _renew(self):
+        """Продление аренды своих задач и возврат брошенных чужих"""
+        while True:
+            self.queue.touch(list(self._running))
+            requeued = self.queue.requeue_stale(self.lease)
+            if requeued:
+                logger.info("Возвращено в очередь прерванных задач: %s", requeued)
+                self._wakeup.set()
+            await asyncio.sleep(self.lease / 3)
+
+    async def _work(self):
+        while not self._stopping:
+            job = self.queue.claim()
+            if job is None:
+                await self._sleep()
+                continue
+            self._running.add(job.id)
+            try:
+                await self._run(job)
+            finally:
+                self._running.discard(job.id)
+
+    async def _sleep(self):
+        """Ожидание новой задачи, ближайшего повтора или периода опроса"""
+        timeout = self.poll_interval
+        next_run = self.queue.next_run_at()
+        if next_run is not None:
+            timeout = min(timeout, max(0.0, next_run - time.time()))
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self, job: Job):
+        with log_context(job.user_id, f"j{job.id}"):
+            await self._execute(job)
+
+    async def _execute(self, job: Job):
+        handler = self.handlers.get(job.kind)
+        if handler is None:
+            logger.error("Нет обработчика для задачи %s типа %s", job.id, job.kind)
+            self.queue.fail(job.id, "unknown kind")
+            return
+        start = time.perf_counter()
+        try:
+            await handler(job)
+        except asyncio.CancelledError:
+            # Задача останется в состоянии running и вернется в очередь по истечении аренды
+            raise
+        except Exception as e:
+            JOB_LATENCY.observe(time.perf_counter() - start, kind=job.kind, status="error")
+            if job.attempts < self.max_attempts:
+                # TelegramRetryAfter сообщает, сколько ждать
+                delay = getattr(e, "retry_after", None) or self._backoff(job.attempts)
+                logger.warning(
+                    f"Задача {job.id} ({job.kind}) не выполнена, попытка {job.attempts}, "
+                    f"повтор через {delay:.1f} с: {str(e)}"
+                )
+                self.queue.retry(job.id, delay, str(e))
+                return
+            logger.error("Задача %s (%s) не выполнена: %s", job.id, job.kind, e, exc_info=True)
+            self.queue.fail(job.id, str(e))
+            if self.on_failure:
+                try:
+                    await self.on_failure(job, e)
+                except Exception as failure_error:
+                    logger.error("Ошибка обработки неудачной задачи %s: %s", job.id, failure_error)
+            return
+        JOB_LATENCY.observe(time.perf_counter() - start, kind=job.kind, status="ok")
+        self.queue.complete(job.id)
+        logger.debug("Задача %s (%s) выполнена", job.id, job.kind)
+
+    def _backoff(self, attempt: int) -> float:
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        return delay * random.uniform(0.5, 1.0)
@@ -0,0 +1,259 @@
+"""
+Локальный предварительный фильтр сообщений перед анализом контекста
+"""
+import difflib
+import logging
+import math
+import re
+from collections import Counter
+from dataclasses import dataclass
+from enum import Enum
+from typing import Dict, Iterable, Optional, Tuple
+from models.context import Context
+from utils.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+PREFILTER_RESULTS = REGISTRY.counter(
+    "bot_prefilter_total", "Решения локального фильтра сообщений", ("result",)
+)
+
+# Сообщения без сведений о человеке (после нормализации)
+STOP_PHRASES = frozenset((
+    "ок", "окей", "ok", "okay", "ага", "угу", "ну", "да", "нет", "неа", "хорошо",
+    "ладно", "ясно", "понятно", "понял", "поняла", "спасибо", "спс", "пасиб",
+    "благодарю", "привет", "здравствуйте", "пока", "супер", "класс", "круто",
+    "отлично", "норм", "хм", "ммм", "эээ", "тест", "test", "алло",
+))
+
+# Обучающие примеры классификатора: короткие реплики без фактов и с фактами
+NOISE_SAMPLES = (
+    "ок", "окей", "оки", "ок спасибо", "ага", "угу", "ну ок", "ну да", "да", "нет",
+    "неа", "хорошо", "ладно", "ну ладно", "ясно", "понятно", "понял", "поняла",
+    "ясненько", "спасибо", "спасибо большое", "спасибки", "спс", "пасиб", "благодарю",
+    "мерси", "привет", "приветик", "здравствуйте", "добрый день", "пока", "до свидания",
+    "супер", "класс", "круто", "отлично", "здорово", "норм", "нормально", "прикольно",
+    "хм", "ммм", "эээ", "хаха", "ахаха", "лол", "тест", "проверка", "алло", "ты тут",
+    "эй", "это все", "все", "больше ничего", "ничего", "не знаю", "пока нет",
+    "вот так", "как то так", "ну вот", "ок понял", "да да", "ага ясно", "ну и",
+    "давай", "продолжай", "что дальше", "ну что", "ещё", "и что",
+)
+INFO_SAMPLES = (
+    "мама", "папа", "жена", "муж", "сестра", "брат", "бабушка", "дедушка", "коллега",
+    "начальник", "подруга", "друг детства", "сын", "дочка", "теща", "свекровь",
+    "день рождения", "юбилей", "свадьба", "новоселье", "повышение", "выпускной",
+    "новый год", "8 марта", "любит рыбалку", "любит кофе", "обожает кошек",
+    "играет в футбол", "пишет стихи", "увлекается йогой", "занимается бегом",
+    "работает врачом", "он программист", "она учитель", "инженер", "бухгалтер",
+    "зовут анна", "игорь", "мария", "сергей", "ольга", "павел", "на ты", "на вы",
+    "официально", "с юмором", "в стихах", "трогательно", "коротко", "дружески",
+    "строго", "весело", "смешно", "забавно", "нежно", "серьезно", "романтично",
+    "ей 30", "ему 45 лет", "исполняется 50", "любит путешествия",
+    "фанат спартака", "вяжет", "печет торты", "садовод", "водит машину", "музыкант",
+    "поет в хоре", "рисует", "собака", "кот", "внуки", "двое детей", "живет в москве",
+    "хокку", "стихами", "открытка", "айтишник", "программист", "дача", "огород",
+    "тамада", "тост", "выпускница", "пенсионер", "студент", "учительница", "свекор",
+)
+
+# Классификатор применяется только к коротким сообщениям без цифр
+CLASSIFIER_MAX_WORDS = 3
+CLASSIFIER_MAX_LENGTH = 30
+
+_NON_WORD = re.compile(r"[^\w\s]+")
+_REPEATS = re.compile(r"(\w)\1{2,}")
+
+
+def normalize(text: str) -> str:
+    """Нижний регистр, без знаков и эмодзи, без растянутых букв ("окееей" -> "окей")"""
+    text = text.lower().replace("ё", "е")
+    text = _NON_WORD.sub(" ", text)
+    text = _REPEATS.sub(r"\1", text)
+    return " ".join(text.split())
+
+
+class Action(str, Enum):
+    """Что делать с сообщением"""
+    ANALYZE = "analyze"  # обычный анализ контекста моделью
+    SMALLTALK = "smalltalk"  # нет сведений о человеке
+    DUPLICATE = "duplicate"  # повтор недавнего сообщения
+    BUTTON = "button"  # опечатка в тексте кнопки или команде
+    COMMAND = "command"  # неизвестная команда
+
+
+@dataclass(slots=True, frozen=True)
+class Decision:
+    """Решение фильтра"""
+    action: Action
+    reason: str
+    button: Optional[str] = None
+
+
+ANALYZE = Decision(Action.ANALYZE, "analyze")
+
+
+class NaiveBayes:
+    """
+    Мультиномиальный наивный байесовский классификатор по символьным n-граммам
+
+    Обучается за миллисекунды на встроенных примерах и не требует
+    сети и внешних пакетов.
+    """
+
+    def __init__(self, samples: Dict[str, Iterable[str]], ngram: Tuple[int, int] = (2, 3), alpha: float = 1.0):
+        """
+        Args:
+            samples: обучающие тексты по классам
+            ngram: диапазон длин символьных n-грамм
+            alpha: сглаживание Лапласа
+        """
+        self.ngram = ngram
+        self._priors: Dict[str, float] = {}
+        self._likelihoods: Dict[str, Dict[str, float]] = {}
+        self._unknown: Dict[str, float] = {}
+        counts = {label: Counter() for label in samples}
+        documents = {label: 0 for label in samples}
+        for label, texts in samples.items():
+            for text in texts:
+                counts[label].update(self._features(text))
+                documents[label] += 1
+        vocabulary = set().union(*counts.values())
+        total_documents = sum(documents.values())
+        for label, counter in counts.items():
+            denominator = sum(counter.values()) + alpha * len(vocabulary)
+            self._priors[label] = math.log(documents[label] / total_documents)
+            self._likelihoods[label] = {
+                feature: math.log((count + alpha) / denominator) for feature, count in counter.items()
+            }
+            self._unknown[label] = math.log(alpha / denominator)
+
+    def _features(self, text: str) -> list[str]:
+        text = f" {normalize(text)} "
+        low, high = self.ngram
+        return [text[i:i + n] for n in range(low, high + 1) for i in range(len(text) - n + 1)]
+
+    def predict_proba(self, text: str) -> Dict[str, float]:
+        """Вероятности классов"""
+        features = self._features(text)
+        scores = {
+            label: prior + sum(
+                self._likelihoods[label].get(feature, self._unknown[label]) for feature in features
+            )
+            for label, prior in self._priors.items()
+        }
+        top = max(scores.values())
+        exp = {label: math.exp(score - top) for label, score in scores.items()}
+        total = sum(exp.values())
+        return {label: value / total for label, value in exp.items()}
+
+
+class MessagePrefilter:
+    """
+    Отсев сообщений, которым не нужен анализ моделью
+
+    Правила (эмодзи и знаки без слов, служебные реплики из списка,
+    повтор одного из последних сообщений, неизвестные команды) отвечают
+    без запроса к gpt-4o-mini. Опечатки в текстах кнопок и командах
+    распознаются по сходству строк (difflib) и передаются нужному
+    обработчику; другие формулировки кнопок - только при точном
+    совпадении, чтобы "поздравление маме" не запускало генерацию.
+    Классификатор коротких реплик выключен по умолчанию: он может
+    принять редкое слово с фактом ("хокку", "тамада") за пустую реплику.
+    Длинные сообщения и сообщения с цифрами всегда уходят на анализ:
+    лишний запрос дешевле потерянного факта.
+    """
+
+    def __init__(
+        self,
+        buttons: Dict[str, Iterable[str]],
+        commands: Dict[str, str],
+        button_cutoff: float = 0.8,
+        classifier: bool = False,
+        classifier_threshold: float = 0.9
+    ):
+        """
+        Args:
+            buttons: текст кнопки -> дополнительные формулировки того же действия
+            commands: имя команды без "/" -> текст кнопки с тем же действием
+            button_cutoff: минимальное сходство с текстом кнопки для распознавания (0-1)
+            classifier: пропускать анализ коротких реплик по оценке классификатора
+            classifier_threshold: минимальная вероятность "без сведений" для пропуска анализа
+        """
+        logger.info("Инициализация MessagePrefilter")
+        self.button_cutoff = button_cutoff
+        self.classifier_threshold = classifier_threshold
+        # Опечатки распознаются только в текстах кнопок, формулировки - точно
+        self._labels: Dict[str, str] = {normalize(button): button for button in buttons}
+        self._aliases: Dict[str, str] = {
+            normalize(alias): button for button, aliases in buttons.items() for alias in aliases
+        }
+        self._commands = dict(commands)
+        self._classifier = (
+            NaiveBayes({"noise": NOISE_SAMPLES, "info": INFO_SAMPLES}) if classifier else None
+        )
+        self._results: Counter = Counter()
+
+    def check(self, text: str, context: Optional[Context] = None) -> Decision:
+        """
+        Решение для сообщения пользователя
+
+        Args:
+            text: текст сообщения
+            context: текущий контекст пользователя (для поиска повторов)
+        """
+        decision = self._decide(text.strip(), context)
+        self._results[decision.reason] += 1
+        PREFILTER_RESULTS.inc(result=decision.reason)
+        if decision.action is not Action.ANALYZE:
+            logger.debug("Сообщение без анализа (%s): %.50s", decision.reason, text)
+        return decision
+
+    def _decide(self, text: str, context: Optional[Context]) -> Decision:
+        if text.startswith("/"):
+            return self._command(text)
+        normalized = normalize(text)
+        if not normalized:
+            return Decision(Action.SMALLTALK, "emoji")
+
+        button = self._match_button(normalized)
+        if button:
+            return Decision(Action.BUTTON, "button", button)
+        if context and any(normalize(message) == normalized for message in context.recent_messages):
+            return Decision(Action.DUPLICATE, "duplicate")
+        if normalized in STOP_PHRASES:
+            return Decision(Action.SMALLTALK, "phrase")
+        if (self._classifier
+                and len(normalized) <= CLASSIFIER_MAX_LENGTH
+                and len(normalized.split()) <= CLASSIFIER_MAX_WORDS
+                and not any(char.isdigit() for char in normalized)):
+            if self._classifier.predict_proba(normalized)["noise"] >= self.classifier_threshold:
+                return Decision(Action.SMALLTALK, "classifier")
+        return ANALYZE
+
+    def _command(self, text: str) -> Decision:
+        """Неизвестная команда: опечатка в известной или просто неизвестная"""
+        name = text[1:].split(maxsplit=1)[0].split("@")[0].lower() if len(text) > 1 else ""
+        match = difflib.get_close_matches(name, self._commands, n=1, cutoff=self.button_cutoff)
+        if match:
+            return Decision(Action.BUTTON, "button", self._commands[match[0]])
+        return Decision(Action.COMMAND, "command")
+
+    def _match_button(self, normalized: str) -> Optional[str]:
+        """Кнопка, с формулировкой которой сообщение совпадает или на текст которой похоже"""
+        if normalized in self._aliases:
+            return self._aliases[normalized]
+        # Опечатка не меняет число слов: "создай поздравление маме" - уже сведения
+        words = len(normalized.split())
+        labels = [label for label in self._labels if len(label.split()) == words]
+        match = difflib.get_close_matches(normalized, labels, n=1, cutoff=self.button_cutoff)
+        return self._labels[match[0]] if match else None
+
+    def stats(self) -> Dict[str, object]:
+        """Проверено сообщений, доля пропущенных запросов анализа и причины"""
+        checked = sum(self._results.values())
+        skipped = checked - self._results["analyze"]
+        return {
+            "checked": checked,
+            "skipped": skipped,
+            "skip_rate": round(100.0 * skipped / checked, 1) if checked else 0.0,
+            "reasons": dict(self._results),
+        }
@@ -0,0 +1,285 @@
+"""
+Реестр промптов OpenAI
+
+Каждый шаблон состоит из неизменной системной части и пользовательских
+сообщений с подстановками, которые идут после нее. Одинаковое начало
+запроса позволяет OpenAI брать его токены из кеша промптов (для
+запросов от 1024 токенов), поэтому переменные данные никогда не
+подставляются в системную часть.
+
+У шаблона может быть сокращенный вариант (compact); вариант выбирается
+для пользователя по хешу его id, что позволяет сравнивать варианты по
+метрикам без смешивания в рамках одного диалога.
+"""
+import hashlib
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+from utils.logger import user_id_var
+from utils.metrics import REGISTRY
+from utils.tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+PROMPT_TOKENS = REGISTRY.counter(
+    "openai_prompt_tokens_total", "Входные токены по шаблонам промптов (всего и из кеша OpenAI)",
+    ("prompt", "variant", "version", "kind")
+)
+
+FULL = "full"
+COMPACT = "compact"
+
+
+@dataclass
+class PromptTemplate:
+    """Версия промпта: системная часть и шаблоны пользовательских сообщений"""
+    name: str
+    variant: str
+    version: int
+    system: str
+    user: Tuple[str, ...] = ("{text}",)
+    model: str = "gpt-4o-mini"
+    system_tokens: int = field(init=False, default=0)
+
+    def __post_init__(self):
+        # Считается один раз при регистрации, а не на каждый вызов
+        self.system_tokens = count_tokens(self.system, self.model)
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}:{self.variant}@{self.version}"
+
+    def messages(self, **values) -> List[Dict[str, str]]:
+        """
+        Сообщения запроса чата
+
+        Пользовательское сообщение пропускается, если все его подстановки
+        пусты (например, нет ранее собранных данных).
+        """
+        messages = [{"role": "system", "content": self.system}]
+        for template in self.user:
+            content = self._render(template, values)
+            if content is not None:
+                messages.append({"role": "user", "content": content})
+        return messages
+
+    def text(self, **values) -> str:
+        """Промпт одной строкой (для генерации изображений): переменная часть в конце"""
+        parts = [self.system]
+        for template in self.user:
+            content = self._render(template, values)
+            if content is not None:
+                parts.append(content)
+        return "\n\n".join(parts)
+
+    @staticmethod
+    def _render(template: str, values: Dict[str, object]) -> Optional[str]:
+        names = [name for name in values if "{" + name + "}" in template]
+        if names and all(values[name] in (None, "") for name in names):
+            return None
+        return template.format(**values)
+
+
+class PromptRegistry:
+    """Шаблоны промптов и выбор варианта для пользователя"""
+
+    def __init__(self, variant: str = FULL, ab_variant: str = COMPACT, ab_share: float = 0.0):
+        """
+        Args:
+            variant: основной вариант шаблонов
+            ab_variant: вариант для экспериментальной группы
+            ab_share: доля пользователей в экспериментальной группе (0 - эксперимент выключен)
+        """
+        self.variant = variant
+        self.ab_variant = ab_variant
+        self.ab_share = ab_share
+        self._templates: Dict[Tuple[str, str], PromptTemplate] = {}
+        self._stats: Dict[str, List[int]] = {}
+        for template in DEFAULT_TEMPLATES:
+            self.register(template)
+        logger.info(
+            "Промпты: %s",
+            ", ".join(f"{t.key} ({t.system_tokens} ток.)" for t in self._templates.values())
+        )
+
+    def register(self, template: PromptTemplate):
+        """Добавление или замена шаблона (новая версия заменяет прежнюю)"""
+        self._templates[(template.name, template.variant)] = template
+
+    def get(self, name: str, variant: str = FULL) -> PromptTemplate:
+        """Шаблон варианта; если его нет - основной"""
+        return self._templates.get((name, variant)) or self._templates[(name, FULL)]
+
+    def select(self, name: str, user_id: Optional[int] = None) -> PromptTemplate:
+        """
+        Шаблон для пользователя
+
+        Без явного user_id используется пользователь текущего обновления
+        или задачи генерации.
+        """
+        if user_id is None:
+            user_id = user_id_var.get()
+        if self.ab_share > 0 and user_id is not None and _bucket(name, user_id) < self.ab_share:
+            return self.get(name, self.ab_variant)
+        return self.get(name, self.variant)
+
+    def prefix_tokens(self, name: str, user_id: Optional[int] = None) -> int:
+        """Токены неизменной части промпта для оценок лимитов"""
+        return self.select(name, user_id).system_tokens
+
+    def record(self, template: PromptTemplate, usage) -> None:
+        """Учет входных токенов и попаданий в кеш промптов из response.usage"""
+        if usage is None:
+            return
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = (getattr(details, "cached_tokens", 0) or 0) if details else 0
+        labels = {"prompt": template.name, "variant": template.variant, "version": str(template.version)}
+        PROMPT_TOKENS.inc(prompt_tokens, kind="input", **labels)
+        PROMPT_TOKENS.inc(cached, kind="cached", **labels)
+        stats = self._stats.setdefault(template.key, [0, 0, 0])
+        stats[0] += 1
+        stats[1] += prompt_tokens
+        stats[2] += cached
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Вызовы, входные токены и доля токенов из кеша по шаблонам"""
+        return {
+            key: {
+                "calls": calls,
+                "prompt_tokens": prompt_tokens,
+                "cached_tokens": cached,
+                "cache_hit_rate": round(cached / prompt_tokens, 3) if prompt_tokens else 0.0,
+            }
+            for key, (calls, prompt_tokens, cached) in self._stats.items()
+        }
+
+
+def _bucket(name: str, user_id: int) -> float:
+    """Устойчивое число от 0 до 1 для пользователя (у каждого промпта свое разбиение)"""
+    digest = hashlib.blake2b(f"{name}:{user_id}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") / 2 ** 64
+
+
+ANALYSIS_SYSTEM = """Ты — помощник чат-бота в Telegram, который помогает пользователю составлять персонализированные поздравления для друзей, родных и коллег.
+
+Твоя задача:
+Проанализировать полученную информацию, посмотреть есть ли "Ранее собранные данные". Если они были то, ты их найдешь после строки "Ранее собранные данные:", между двумя строками "***". Остальная информация - "Новая информация" находится после строки "Новая информация:", между двумя строками "---". Ты анализируешь новую информацию
+
+И собираешь ключевые факты, которые могут пригодиться для создания поздравления.
+
+Это могут быть:
+- Событие с которым поздравляют (переезд, отпуск, свадьба, развод, новый проект, и т.д. и т.п.), если не указано, то не пиши про это.
+- Имя, возраст, родство или степень близости
+- Профессия, хобби, характер
+- Семейное положение, дети, питомцы
+- Интересные или забавные особенности
+- Отношение пользователя к адресату (уважение, дружба, ирония и т.д. и т.п.)
+- Пожелания пользователя о формате (стихотворение, хокку, проза и т.д. и т.п.) или стиле поздравления (официальное, игривое, романтическое, подкол и т.д. и т.п.). Если не указано, то не надо про это писать.
+
+Собранные ключевые факты должны быть записаны кратко и информативно, без лишних слов (чтобы экономить токены).
+Не придумывай факты и не фантазируй — только на основе полученной информации. Не пиши поздравлений, твоя цель — только структурировать факты для будущего поздравления.
+
+Если не было Ранее собранных данных, то твоим ответом будут Собранные ключевые факты.
+
+Если были Ранее собранные данные, их надо дополнить или скорректировать/уточнить собранными ключевыми фактами.
+Собранные ключевые факты могут:
+- Добавиться к фактам из Ранее собранных данных
+- Уточнить или исправить факты в Ранее собранных данных
+Твоим ответом в этом случае будут обновленные с учетом Собранных ключевых фактов Ранее собранные данные.
+Ответ должен быть кратким и информативным, без лишних слов (чтобы экономить токены)"""
+
+ANALYSIS_SYSTEM_COMPACT = """Ты собираешь факты для персонализированного поздравления из переписки в Telegram.
+Ранее собранные данные (если есть) - между строками "***", новая информация - между строками "---".
+Факты: событие, имя, возраст, родство или близость, профессия, хобби, характер, семья, дети, питомцы, забавные особенности, отношение пользователя к адресату, пожелания к формату и стилю.
+Не придумывай и не пиши поздравление. Верни ранее собранные данные, дополненные и уточненные новой информацией, кратко, без лишних слов."""
+
+ANALYSIS_USER = (
+    "Ранее собранные данные:\n***\n{summary}\n***",
+    "Новая информация:\n---\n{text}\n---",
+)
+
+DELTA_ANALYSIS_SYSTEM = """Ты — помощник чат-бота, который собирает факты для персонализированного поздравления.
+На вход ты получаешь текущие факты (если они есть) и новое сообщение пользователя.
+Поля фактов: event - событие, name - имя, age - возраст, gender - пол, relation - родство или близость,
+profession - профессия, hobbies - список хобби и увлечений, character - характер,
+family - семейное положение и дети, pets - питомцы, features - интересные или забавные особенности,
+attitude - отношение пользователя к адресату, format - формат поздравления (стихи, хокку, проза),
+style - стиль (официальный, игривый, романтический), notes - прочее важное.
+Не придумывай факты, бери только то, что сказано.
+
+Верни только изменения: в поле - новое или уточненное значение (кратко, без лишних слов),
+null - если поле не меняется. Для hobbies верни полный новый список. В remove перечисли поля,
+которые пользователь отменил."""
+
+DELTA_ANALYSIS_USER = (
+    "Текущие факты:\n{facts}",
+    "Новая информация:\n---\n{text}\n---",
+)
+
+COMPACTION_SYSTEM = """Ты сжимаешь собранные факты о человеке для будущего поздравления.
+Сократи их так, чтобы они уложились в бюджет, указанный в сообщении.
+Обязательно сохрани событие, имя, родство и пожелания к формату и стилю поздравления.
+Объедини похожие пункты, убери повторы и второстепенные детали. Не добавляй новых фактов.
+"""
+
+COMPACTION_BUDGET = "Бюджет: не больше {budget} токенов (примерно {chars} символов).\n\n"
+
+GREETING_SYSTEM = """Ты — мастер создания тёплых, уместных и запоминающихся поздравлений. На вход ты получаешь краткое описание фактов о человеке и пожелания к формату поздравления, собранные в ходе переписки.
+
+Твоя задача:
+На основе предоставленных фактов о человеке и пожеланий создать одно персонализированное поздравление, подходящее для отправки в мессенджере вместе с открыткой. Если по полученной информации невозможно понять с каким событием поздравляют, ни что в поздравлении не должно быть однозначной привязкой к какому-то конкретному празднику.
+
+Поздравление должно быть:
+- Ярким, образным, тёплым уместным по стилю. (Возможны разные варианты стилей: официальный, игривый, романтический, нежный, поэтический и т.д. — смотри указания к поздравлению). По умолчанию стиль - яркая проза. Используй эмодзи, если это необходимо.
+- Не длиннее 1000 символов!
+
+Не повторяй факты дословно, используй их творчески.
+Если указан поэтический формат — пиши стихами (например, четверостишия, хокку, белый стих, и т.д и т.п.).
+
+Если стиль не указан — подбери нейтрально-дружелюбный тон, яркая проза.
+
+Подпись в конце не нужна."""
+
+GREETING_SYSTEM_COMPACT = """Ты пишешь одно тёплое персонализированное поздравление для мессенджера по фактам и пожеланиям пользователя.
+Стиль и формат - из указаний (стихи, хокку, проза, официальный, игривый и т.д.), по умолчанию - яркая дружелюбная проза, можно с эмодзи.
+Не длиннее 1000 символов. Используй факты творчески, не дословно. Если событие неизвестно, не привязывайся к конкретному празднику. Без подписи."""
+
+GREETING_USER = ("Указания к поздравлению: *** {instructions} ***",)
+
+IMAGE_SYSTEM = """Ты — генератор образных и эстетически приятных изображений-открыток.
+Ниже, после инструкций, приведено поздравление в виде текста - Информация АЛЬФА1.
+
+Твоя задача:
+Создай изображение, подходящее для поздравительной открытки, основываясь на Информации АЛЬФА1. Если по информации АЛЬФА1 невозможно понять с каким событием поздравляют, ни что на изображении не должно быть однозначной привязкой к какому-то конкретному празднику.
+
+Изображение должно передавать настроение, атмосферу события и детали связанные с поздравляемым. Изображение не должно содержать текста.
+
+Изображение должно быть:
+- Ярким, но не перегруженным
+- В соответствии с указанным стилем поздравления. По умолчанию открытка в стиле профессионального фото."""
+
+IMAGE_SYSTEM_COMPACT = """Открытка к поздравлению ниже: яркая, не перегруженная, без текста, передает настроение и детали, связанные с поздравляемым.
+Стиль - как у поздравления, по умолчанию профессиональное фото. Если событие неизвестно, без привязки к конкретному празднику."""
+
+IMAGE_USER = ("Информация АЛЬФА1:\n***\n{greeting}\n***",)
+
+DEFAULT_TEMPLATES = (
+    PromptTemplate("analysis", FULL, 2, ANALYSIS_SYSTEM, ANALYSIS_USER),
+    PromptTemplate("analysis", COMPACT, 1, ANALYSIS_SYSTEM_COMPACT, ANALYSIS_USER),
+    PromptTemplate("delta_analysis", FULL, 1, DELTA_ANALYSIS_SYSTEM, DELTA_ANALYSIS_USER),
+    PromptTemplate(
+        "compact_summary", FULL, 2,
+        COMPACTION_SYSTEM + "Верни только сжатые факты, без пояснений.",
+        (COMPACTION_BUDGET + "{summary}",)
+    ),
+    PromptTemplate(
+        "compact_facts", FULL, 2,
+        COMPACTION_SYSTEM + "Верни все поля; для пустых полей верни null.",
+        (COMPACTION_BUDGET + "{facts}",)
+    ),
+    PromptTemplate("greeting", FULL, 2, GREETING_SYSTEM, GREETING_USER, model="gpt-4o"),
+    PromptTemplate("greeting", COMPACT, 1, GREETING_SYSTEM_COMPACT, GREETING_USER, model="gpt-4o"),
+    PromptTemplate("image", FULL, 2, IMAGE_SYSTEM, IMAGE_USER, model="gpt-4o"),
+    PromptTemplate("image", COMPACT, 1, IMAGE_SYSTEM_COMPACT, IMAGE_USER, model="gpt-4o"),
+)
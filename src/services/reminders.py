@@ -0,0 +1,477 @@
+"""
+Важные даты: хранилище, планировщик напоминаний и заблаговременная генерация
+"""
+import asyncio
+import calendar
+import heapq
+import logging
+import sqlite3
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, tzinfo
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from models.context import Context
+from services.content_generator import ContentGenerator
+from services.scheduler import Priority
+
+logger = logging.getLogger(__name__)
+
+# Сколько строк загружать из базы за одно пополнение кучи
+REFILL_LIMIT = 10000
+# Максимальная пауза цикла планировщика, сек
+MAX_SLEEP = 60.0
+# Пауза перед повтором неудавшейся доставки, сек
+DELIVERY_RETRY_DELAY = 300.0
+
+
+@dataclass(slots=True)
+class Reminder:
+    """Ежегодное событие пользователя"""
+    id: int
+    user_id: int
+    chat_id: int
+    title: str
+    day: int
+    month: int
+    year: Optional[int]
+    summary: str
+    next_at: float
+    greeting: Optional[str] = None
+    image: Optional[str] = None
+
+    def date_text(self) -> str:
+        text = f"{self.day:02d}.{self.month:02d}"
+        return f"{text}.{self.year}" if self.year else text
+
+
+def next_occurrence(day: int, month: int, hour: int, tz: tzinfo, after: float) -> float:
+    """
+    Ближайший момент события после after (время UTC, сек)
+
+    29 февраля в невисокосный год отмечается 28 февраля.
+    """
+    year = datetime.fromtimestamp(after, tz).year
+    while True:
+        last_day = calendar.monthrange(year, month)[1]
+        moment = datetime(year, month, min(day, last_day), hour, tzinfo=tz).timestamp()
+        if moment > after:
+            return moment
+        year += 1
+
+
+def event_context(reminder: Reminder, tz: tzinfo) -> Context:
+    """Контекст генерации: событие и сохраненные при добавлении факты"""
+    event = f"Событие: {reminder.title}"
+    if reminder.year:
+        event += f", исполняется {datetime.fromtimestamp(reminder.next_at, tz).year - reminder.year}"
+    summary = f"{event}\n{reminder.summary}" if reminder.summary else event
+    return Context(summory=summary)
+
+
+class ReminderStore:
+    """
+    Напоминания в SQLite
+
+    Выборка ближайших событий идет по индексу next_at, поэтому объем
+    базы не влияет на работу планировщика. Доставка и подготовка
+    захватываются условными UPDATE с арендой до lease_until, и базу
+    можно разделять между процессами (шарды, отдельный обработчик
+    задач). Событие переносится на следующий год только после
+    доставки: если процесс упал, аренда истечет и доставка повторится.
+    """
+
+    COLUMNS = "id, user_id, chat_id, title, day, month, year, summary, next_at, greeting, image"
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: путь к файлу базы данных
+        """
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS reminders ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, "
+            "chat_id INTEGER NOT NULL, title TEXT NOT NULL, day INTEGER NOT NULL, "
+            "month INTEGER NOT NULL, year INTEGER, summary TEXT NOT NULL, "
+            "next_at REAL NOT NULL, greeting TEXT, image TEXT, lease_until REAL, "
+            "created_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS reminders_next ON reminders (next_at)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS reminders_user ON reminders (user_id)")
+        self._db.commit()
+        logger.info("Хранилище важных дат SQLite: %s", path)
+
+    def add(self, reminder: Reminder) -> int:
+        cursor = self._db.execute(
+            "INSERT INTO reminders (user_id, chat_id, title, day, month, year, summary, "
+            "next_at, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (reminder.user_id, reminder.chat_id, reminder.title, reminder.day, reminder.month,
+             reminder.year, reminder.summary, reminder.next_at, time.time())
+        )
+        self._db.commit()
+        return cursor.lastrowid
+
+    def get(self, reminder_id: int) -> Optional[Reminder]:
+        row = self._db.execute(
+            f"SELECT {self.COLUMNS} FROM reminders WHERE id = ?", (reminder_id,)
+        ).fetchone()
+        return Reminder(*row) if row else None
+
+    def list(self, user_id: int) -> List[Reminder]:
+        rows = self._db.execute(
+            f"SELECT {self.COLUMNS} FROM reminders WHERE user_id = ? ORDER BY next_at", (user_id,)
+        ).fetchall()
+        return [Reminder(*row) for row in rows]
+
+    def count(self, user_id: int) -> int:
+        return self._db.execute(
+            "SELECT COUNT(*) FROM reminders WHERE user_id = ?", (user_id,)
+        ).fetchone()[0]
+
+    def delete(self, user_id: int, reminder_id: int) -> bool:
+        cursor = self._db.execute(
+            "DELETE FROM reminders WHERE id = ? AND user_id = ?", (reminder_id, user_id)
+        )
+        self._db.commit()
+        return cursor.rowcount > 0
+
+    def upcoming(self, until: float, limit: int = REFILL_LIMIT) -> List[Tuple[float, int]]:
+        """Моменты и ID событий до until по возрастанию"""
+        return self._db.execute(
+            "SELECT next_at, id FROM reminders WHERE next_at <= ? ORDER BY next_at LIMIT ?",
+            (until, limit)
+        ).fetchall()
+
+    def lease_delivery(self, reminder: Reminder, until: float) -> bool:
+        """
+        Захват доставки события до until
+
+        Returns:
+            bool: False, если событие доставляет или готовит другой процесс,
+                оно уже доставлено или удалено
+        """
+        now = time.time()
+        cursor = self._db.execute(
+            "UPDATE reminders SET lease_until = ? WHERE id = ? AND next_at = ? "
+            "AND (lease_until IS NULL OR lease_until < ?)",
+            (until, reminder.id, reminder.next_at, now)
+        )
+        self._db.commit()
+        return cursor.rowcount > 0
+
+    def advance(self, reminder: Reminder, next_at: float) -> bool:
+        """Перенос доставленного события на следующий год со сбросом поздравления"""
+        cursor = self._db.execute(
+            "UPDATE reminders SET next_at = ?, greeting = NULL, image = NULL, lease_until = NULL "
+            "WHERE id = ? AND next_at = ?",
+            (next_at, reminder.id, reminder.next_at)
+        )
+        self._db.commit()
+        return cursor.rowcount > 0
+
+    def reschedule(self, reminder: Reminder, at: float, greeting: Optional[str], image: Optional[str]) -> bool:
+        """Повтор доставки в at с уже готовым поздравлением, если оно есть"""
+        cursor = self._db.execute(
+            "UPDATE reminders SET next_at = ?, greeting = ?, image = ?, lease_until = NULL "
+            "WHERE id = ? AND next_at = ?",
+            (at, greeting, image, reminder.id, reminder.next_at)
+        )
+        self._db.commit()
+        return cursor.rowcount > 0
+
+    def unprepared(self, until: float, now: float, limit: int) -> List[Reminder]:
+        """Ближайшие события без готового поздравления, не захваченные на подготовку"""
+        rows = self._db.execute(
+            f"SELECT {self.COLUMNS} FROM reminders WHERE next_at <= ? AND greeting IS NULL "
+            "AND (lease_until IS NULL OR lease_until < ?) ORDER BY next_at LIMIT ?",
+            (until, now, limit)
+        ).fetchall()
+        return [Reminder(*row) for row in rows]
+
+    def lease(self, reminder: Reminder, until: float) -> bool:
+        """Захват подготовки события до until"""
+        now = time.time()
+        cursor = self._db.execute(
+            "UPDATE reminders SET lease_until = ? WHERE id = ? AND next_at = ? "
+            "AND greeting IS NULL AND (lease_until IS NULL OR lease_until < ?)",
+            (until, reminder.id, reminder.next_at, now)
+        )
+        self._db.commit()
+        return cursor.rowcount > 0
+
+    def save_prepared(self, reminder: Reminder, greeting: str, image: Optional[str]):
+        """Сохранение поздравления, если событие еще не доставлено"""
+        self._db.execute(
+            "UPDATE reminders SET greeting = ?, image = ?, lease_until = NULL "
+            "WHERE id = ? AND next_at = ?",
+            (greeting, image, reminder.id, reminder.next_at)
+        )
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+
+DeliverCallback = Callable[[Reminder, str, Optional[str]], Awaitable[None]]
+
+
+class ReminderScheduler:
+    """
+    Планировщик напоминаний
+
+    Одна задача на процесс: в памяти держится куча ближайших событий
+    (на horizon секунд вперед), задача спит до вершины кучи и
+    периодически пополняет ее из базы. Число событий в базе не
+    ограничено и не требует отдельной задачи или таймера на каждое.
+
+    В ночное окно поздравления и открытки для событий ближайших дней
+    генерируются заранее с самым низким приоритетом планировщика
+    запросов, поэтому не мешают пользователям и укладываются в лимиты.
+    В день события готовый результат отправляется сразу; если его нет,
+    он генерируется при доставке. Неудачная генерация или отправка
+    повторяется до конца дня события, затем напоминание уходит без
+    поздравления: пропустить событие на год хуже.
+    """
+
+    def __init__(
+        self,
+        store: ReminderStore,
+        content_generator: ContentGenerator,
+        deliver: DeliverCallback,
+        tz: tzinfo,
+        hour: int = 9,
+        prepare_window: Tuple[int, int] = (2, 6),
+        lookahead: float = 3 * 86400.0,
+        prepare_concurrency: int = 2,
+        delivery_rate: float = 20.0,
+        horizon: float = 3600.0,
+        lease: float = 600.0
+    ):
+        """
+        Args:
+            store: хранилище напоминаний
+            content_generator: генератор контента
+            deliver: отправка напоминания (событие, текст, изображение)
+            tz: часовой пояс дат
+            hour: час доставки в день события
+            prepare_window: часы начала и конца ночного окна подготовки
+            lookahead: на сколько секунд вперед готовить поздравления
+            prepare_concurrency: одновременных генераций при подготовке
+            delivery_rate: максимум доставок в секунду (лимит Telegram ~30 сообщений/с)
+            horizon: на сколько секунд вперед загружать события в кучу
+            lease: время захвата события на подготовку, сек
+        """
+        logger.info("Инициализация ReminderScheduler")
+        self.store = store
+        self.content_generator = content_generator
+        self.deliver = deliver
+        self.tz = tz
+        self.hour = hour
+        self.prepare_window = prepare_window
+        self.lookahead = lookahead
+        self.prepare_concurrency = prepare_concurrency
+        self.delivery_rate = delivery_rate
+        self.horizon = horizon
+        self.lease = lease
+        self.delivered = 0
+        self.prepared = 0
+        self._heap: List[Tuple[float, int]] = []
+        self._scheduled: Dict[int, float] = {}
+        self._loaded_until = 0.0
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._prepare_task: Optional[asyncio.Task] = None
+        self._deliveries: set[asyncio.Task] = set()
+        self._next_delivery = 0.0
+
+    def start(self):
+        self._task = asyncio.create_task(self._run(), name="reminders")
+
+    async def stop(self):
+        tasks = [task for task in (self._task, self._prepare_task) if task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, *self._deliveries, return_exceptions=True)
+
+    def add(
+        self,
+        user_id: int,
+        chat_id: int,
+        title: str,
+        day: int,
+        month: int,
+        year: Optional[int] = None,
+        summary: str = ""
+    ) -> Reminder:
+        """
+        Добавление ежегодного события
+
+        Raises:
+            ValueError: если такой даты не бывает
+        """
+        # 2000 - високосный год, 29 февраля допустимо
+        if not 1 <= month <= 12 or not 1 <= day <= calendar.monthrange(2000, month)[1]:
+            raise ValueError("Неверная дата")
+        next_at = next_occurrence(day, month, self.hour, self.tz, time.time())
+        reminder = Reminder(0, user_id, chat_id, title, day, month, year, summary, next_at)
+        reminder.id = self.store.add(reminder)
+        if next_at <= self._loaded_until:
+            self._push(next_at, reminder.id)
+            self._wakeup.set()
+        logger.info("Пользователь %s добавил дату %s (%s)", user_id, reminder.date_text(), reminder.id)
+        return reminder
+
+    def _push(self, next_at: float, reminder_id: int):
+        if self._scheduled.get(reminder_id) != next_at:
+            self._scheduled[reminder_id] = next_at
+            heapq.heappush(self._heap, (next_at, reminder_id))
+
+    def _refill(self, now: float):
+        """Загрузка событий ближайшего часа из базы"""
+        until = now + self.horizon
+        rows = self.store.upcoming(until)
+        for next_at, reminder_id in rows:
+            self._push(next_at, reminder_id)
+        # Если строк больше лимита, следующее пополнение начнется с последней загруженной
+        self._loaded_until = rows[-1][0] if len(rows) >= REFILL_LIMIT else until
+
+    async def _run(self):
+        while True:
+            try:
+                now = time.time()
+                if now >= self._loaded_until - self.horizon / 2:
+                    self._refill(now)
+                await self._deliver_due(now)
+                if self._in_window(now) and (self._prepare_task is None or self._prepare_task.done()):
+                    self._prepare_task = asyncio.create_task(self._prepare(), name="reminders-prepare")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Ошибка планировщика напоминаний: %s", e, exc_info=True)
+            timeout = MAX_SLEEP
+            if self._heap:
+                timeout = min(timeout, max(0.0, self._heap[0][0] - time.time()))
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _deliver_due(self, now: float):
+        semaphore = asyncio.Semaphore(max(1, int(self.delivery_rate)))
+        while self._heap and self._heap[0][0] <= now:
+            next_at, reminder_id = heapq.heappop(self._heap)
+            if self._scheduled.get(reminder_id) != next_at:
+                continue
+            del self._scheduled[reminder_id]
+            reminder = self.store.get(reminder_id)
+            if reminder is None or reminder.next_at != next_at:
+                continue
+            if not self.store.lease_delivery(reminder, now + self.lease):
+                continue
+            # Равномерный темп отправки вместо пачки сообщений в одну секунду
+            delay = self._next_delivery - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next_delivery = max(self._next_delivery, time.monotonic()) + 1 / self.delivery_rate
+            await semaphore.acquire()
+            task = asyncio.create_task(self._deliver(reminder))
+            self._deliveries.add(task)
+            task.add_done_callback(self._deliveries.discard)
+            task.add_done_callback(lambda _: semaphore.release())
+
+    async def _deliver(self, reminder: Reminder):
+        greeting, image = reminder.greeting, reminder.image
+        try:
+            if not greeting:
+                # Не успели подготовить заранее: генерация в момент доставки
+                try:
+                    greeting, image = await self.content_generator.generate_content(
+                        event_context(reminder, self.tz), reminder.user_id
+                    )
+                except Exception as e:
+                    if self._retry(reminder, None, None, e):
+                        return
+                    logger.error("Поздравление к напоминанию %s не создано, отправка без него", reminder.id)
+                    greeting, image = "", None
+            await self.deliver(reminder, greeting, image)
+        except Exception as e:
+            if self._retry(reminder, greeting or None, image, e):
+                return
+            logger.error("Не удалось доставить напоминание %s: %s", reminder.id, e, exc_info=True)
+        else:
+            self.delivered += 1
+            logger.info("Напоминание %s доставлено пользователю %s", reminder.id, reminder.user_id)
+        following = next_occurrence(reminder.day, reminder.month, self.hour, self.tz, reminder.next_at)
+        self.store.advance(reminder, following)
+
+    def _retry(self, reminder: Reminder, greeting: Optional[str], image: Optional[str], error: Exception) -> bool:
+        """
+        Повтор доставки позже в тот же день
+
+        Returns:
+            bool: False, если день события заканчивается и повторять поздно
+        """
+        at = time.time() + DELIVERY_RETRY_DELAY
+        day = datetime.fromtimestamp(reminder.next_at, self.tz)
+        day_end = (datetime(day.year, day.month, day.day, tzinfo=self.tz) + timedelta(days=1)).timestamp()
+        if at >= day_end:
+            return False
+        logger.warning(
+            "Напоминание %s не доставлено (%s), повтор через %.0f с", reminder.id, error, DELIVERY_RETRY_DELAY
+        )
+        if self.store.reschedule(reminder, at, greeting, image):
+            self._push(at, reminder.id)
+            self._wakeup.set()
+        return True
+
+    def _in_window(self, now: float) -> bool:
+        start, end = self.prepare_window
+        hour = datetime.fromtimestamp(now, self.tz).hour
+        if start <= end:
+            return start <= hour < end
+        return hour >= start or hour < end
+
+    async def _prepare(self):
+        """Подготовка поздравлений для ближайших событий, пока открыто окно"""
+        semaphore = asyncio.Semaphore(self.prepare_concurrency)
+        while self._in_window(time.time()):
+            now = time.time()
+            batch = self.store.unprepared(now + self.lookahead, now, self.prepare_concurrency * 10)
+            if not batch:
+                return
+            logger.info("Подготовка поздравлений к важным датам: %s", len(batch))
+
+            async def prepare(reminder: Reminder):
+                async with semaphore:
+                    if not self._in_window(time.time()):
+                        return
+                    if self.store.lease(reminder, time.time() + self.lease):
+                        await self._prepare_one(reminder)
+
+            await asyncio.gather(*(prepare(reminder) for reminder in batch))
+
+    async def _prepare_one(self, reminder: Reminder):
+        context = event_context(reminder, self.tz)
+        try:
+            greeting = await self.content_generator.generate_greeting(
+                context, reminder.user_id, priority=Priority.SPECULATIVE
+            )
+            image = None
+            # Ссылки OpenAI живут около часа, заранее имеет смысл хранить только свои файлы
+            if self.content_generator.assets:
+                try:
+                    image = await self.content_generator.generate_image(
+                        greeting, reminder.user_id, priority=Priority.SPECULATIVE
+                    )
+                except Exception as e:
+                    logger.warning("Открытка к напоминанию %s не создана: %s", reminder.id, e)
+            self.store.save_prepared(reminder, greeting, image)
+            self.prepared += 1
+        except Exception as e:
+            # Захват истечет, событие попадет в следующую подготовку
+            logger.warning("Не удалось подготовить напоминание %s: %s", reminder.id, e)
@@ -0,0 +1,276 @@
+"""
+Политика надежности вызовов OpenAI: сроки, повторы, хеджирование
+и автоматический выключатель
+"""
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+from openai import (
+    APIConnectionError,
+    APIStatusError,
+    APITimeoutError,
+    InternalServerError,
+    RateLimitError,
+)
+from services.scheduler import AIScheduler
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class CircuitOpenError(Exception):
+    """Вызовы модели временно приостановлены после серии ошибок"""
+
+    def __init__(self, model: str, retry_in: float):
+        super().__init__(f"Модель {model} временно недоступна, повтор через {retry_in:.0f} с")
+        self.model = model
+        self.retry_in = retry_in
+
+
+@dataclass(slots=True)
+class ModelPolicy:
+    """Настройки надежности вызовов одной модели"""
+    timeout: float = 60.0  # Срок всего вызова вместе с повторами, сек
+    retries: int = 2  # Число повторов после первой попытки
+    hedge_after: float = 0.0  # Через сколько секунд отправить дублирующий запрос (0 - не отправлять)
+
+
+class CircuitBreaker:
+    """
+    Автоматический выключатель для одной модели
+
+    После failure_threshold ошибок подряд вызовы отклоняются сразу,
+    без обращения к API. Через reset_timeout секунд пропускается один
+    пробный вызов: успех закрывает выключатель, ошибка снова открывает.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+    def retry_in(self) -> float:
+        """Сколько секунд осталось до пробного вызова"""
+        if self._opened_at is None:
+            return 0.0
+        return max(0.0, self._opened_at + self.reset_timeout - time.monotonic())
+
+    def allow(self) -> bool:
+        """Можно ли выполнить вызов"""
+        if self._opened_at is None:
+            return True
+        if self._probing or self.retry_in() > 0:
+            return False
+        self._probing = True
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    def record_abandon(self):
+        """Вызов прерван (отмена): о модели он ничего не говорит, пробная попытка разрешается снова"""
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probing or self.failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
+        self._probing = False
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Временная ли ошибка (сеть, тайм-аут, лимиты, ошибка сервера)"""
+    return isinstance(error, (
+        asyncio.TimeoutError, APITimeoutError, APIConnectionError,
+        RateLimitError, InternalServerError
+    ))
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Задержка из заголовков Retry-After / retry-after-ms ответа API"""
+    if not isinstance(error, APIStatusError):
+        return None
+    headers = error.response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        return None
+    return None
+
+
+class ResiliencePolicy:
+    """
+    Выполнение вызовов API по политике модели
+
+    Вызов ограничен сроком, временные ошибки повторяются с
+    экспоненциальной задержкой со случайным разбросом (или через
+    Retry-After, если его прислал сервер), медленные запросы могут
+    дублироваться, а модель с серией ошибок отключается выключателем.
+    Дублирующий запрос занимает отдельный слот планировщика и
+    учитывается в лимитах модели; если свободного слота нет, он не
+    отправляется.
+    """
+
+    def __init__(
+        self,
+        policies: Dict[str, ModelPolicy],
+        default: ModelPolicy | None = None,
+        backoff: float = 0.5,
+        max_backoff: float = 8.0,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        scheduler: Optional[AIScheduler] = None
+    ):
+        """
+        Args:
+            policies: политики по моделям
+            default: политика для остальных моделей
+            backoff: задержка перед первым повтором, сек
+            max_backoff: максимальная задержка между повторами, сек
+            failure_threshold: ошибок подряд до отключения модели
+            reset_timeout: через сколько секунд пробовать отключенную модель снова
+            scheduler: планировщик, в лимитах которого учитываются дублирующие запросы
+        """
+        logger.info("Инициализация ResiliencePolicy")
+        self.policies = policies
+        self.default = default or ModelPolicy()
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.scheduler = scheduler
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self.retries = 0
+        self.hedges = 0
+        self.hedges_skipped = 0
+
+    def max_timeout(self) -> float:
+        """Наибольший срок вызова среди политик"""
+        return max([self.default.timeout, *(p.timeout for p in self.policies.values())])
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        """Выключатель модели"""
+        breaker = self._breakers.get(model)
+        if breaker is None:
+            breaker = self._breakers[model] = CircuitBreaker(
+                self.failure_threshold, self.reset_timeout
+            )
+        return breaker
+
+    def available(self, model: str) -> bool:
+        """Не отключена ли модель выключателем"""
+        breaker = self._breakers.get(model)
+        return breaker is None or not breaker.is_open or breaker.retry_in() == 0
+
+    async def call(self, model: str, func: Callable[[], Awaitable[T]]) -> T:
+        """
+        Вызов func по политике модели
+
+        Args:
+            model: модель, к которой относится вызов
+            func: фабрика корутины запроса (вызывается на каждую попытку)
+
+        Raises:
+            CircuitOpenError: модель отключена выключателем
+            asyncio.TimeoutError: истек срок вызова
+        """
+        policy = self.policies.get(model, self.default)
+        breaker = self.breaker(model)
+        deadline = time.monotonic() + policy.timeout
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                raise CircuitOpenError(model, breaker.retry_in())
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                result = await self._attempt(model, policy, func, remaining)
+            except BaseException as e:
+                if not isinstance(e, Exception):
+                    # Отмена (CancelledError) не должна оставлять выключатель в пробном режиме
+                    breaker.record_abandon()
+                    raise
+                if not is_retryable(e):
+                    # Ошибка запроса (400, 401...) не говорит о состоянии модели
+                    breaker.record_success()
+                    raise
+                breaker.record_failure()
+                attempt += 1
+                delay = retry_after(e)
+                if delay is None:
+                    delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+                    delay *= random.uniform(0.5, 1.0)
+                if attempt > policy.retries or time.monotonic() + delay >= deadline:
+                    logger.warning(f"Вызов {model} не удался после {attempt} попыток: {type(e).__name__}")
+                    raise
+                self.retries += 1
+                logger.info(f"Повтор вызова {model} через {delay:.1f} с: {type(e).__name__}")
+                await asyncio.sleep(delay)
+                continue
+            breaker.record_success()
+            return result
+
+    async def _attempt(
+        self, model: str, policy: ModelPolicy, func: Callable[[], Awaitable[T]], timeout: float
+    ) -> T:
+        """Одна попытка с ограничением по времени и, если настроено, хеджированием"""
+        if not policy.hedge_after or policy.hedge_after >= timeout:
+            return await asyncio.wait_for(func(), timeout)
+
+        start = time.monotonic()
+        tasks = {asyncio.ensure_future(func())}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=policy.hedge_after)
+            if not done:
+                if self.scheduler and not self.scheduler.try_acquire(model):
+                    # Лимиты модели исчерпаны: дубль только увеличил бы нагрузку
+                    self.hedges_skipped += 1
+                    logger.debug(f"Хеджирование {model} пропущено: нет свободного слота")
+                else:
+                    # Медленный хвост: дублирующий запрос, берем первый успешный ответ
+                    self.hedges += 1
+                    logger.debug(f"Хеджирование: дублирующий запрос через {policy.hedge_after} с")
+                    tasks.add(asyncio.ensure_future(self._hedge(model, func)))
+            error: Optional[BaseException] = None
+            while tasks:
+                remaining = timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                done, _ = await asyncio.wait(
+                    tasks, timeout=remaining, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    raise asyncio.TimeoutError()
+                for task in done:
+                    tasks.discard(task)
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _hedge(self, model: str, func: Callable[[], Awaitable[T]]) -> T:
+        """Дублирующий запрос в слоте, занятом через try_acquire()"""
+        try:
+            return await func()
+        finally:
+            if self.scheduler:
+                self.scheduler.release(model)
@@ -0,0 +1,266 @@
+"""
+Кеш результатов генерации с объединением одинаковых запросов
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних получателей записи запоминать
+MAX_SERVED = 1000
+
+
+class Uncached:
+    """
+    Результат, который получают ожидающие вызова, но не сохраняет кеш
+
+    Например, поздравление запасной модели: после восстановления
+    основной модели тот же контекст должен получить ее ответ.
+    """
+    __slots__ = ("value",)
+
+    def __init__(self, value: Any):
+        self.value = value
+
+
+class ResultCache:
+    """
+    LRU-кеш результатов с TTL, необязательным хранением на диске
+    и single-flight
+
+    Одновременные запросы с одинаковым ключом ждут один общий вызов
+    вместо того, чтобы выполнять его несколько раз.
+
+    Если передан user_id, запись запоминает, кому она уже отдана:
+    другие пользователи получают ее из кеша, а повторный запрос того же
+    пользователя считается промахом и заменяет запись новым результатом.
+    Так повторное нажатие "Создать поздравление" дает новый текст.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 1000,
+        ttl: float = 86400.0,
+        db_path: str | None = None
+    ):
+        """
+        Args:
+            max_size: максимальное число записей в памяти
+            ttl: время жизни записи по умолчанию, сек
+            db_path: путь к базе SQLite для хранения на диске (необязательно)
+        """
+        logger.info("Инициализация ResultCache")
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items: "OrderedDict[str, tuple[Any, float, Tuple[int, ...]]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.repeats = 0
+        self._db = None
+        if db_path:
+            Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(db_path)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, "
+                "served TEXT NOT NULL DEFAULT '[]')"
+            )
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(results)")}
+            if "served" not in columns:
+                # База прежней версии
+                self._db.execute("ALTER TABLE results ADD COLUMN served TEXT NOT NULL DEFAULT '[]'")
+            self._db.execute("DELETE FROM results WHERE expires_at < ?", (time.time(),))
+            self._db.commit()
+
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        """Ключ кеша из модели, параметров и нормализованного содержимого"""
+        payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def stats(self) -> Dict[str, int]:
+        """Счетчики попаданий и промахов"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "repeats": self.repeats,
+            "size": len(self._items),
+            "inflight": len(self._inflight),
+        }
+
+    def get(self, key: str, user_id: int | None = None) -> Optional[Any]:
+        """
+        Значение из памяти или с диска; None, если его нет, оно устарело
+        или уже было отдано пользователю user_id
+        """
+        item = self._lookup(key)
+        if item is None:
+            return None
+        value, expires_at, served = item
+        if user_id is not None:
+            if user_id in served:
+                self.repeats += 1
+                return None
+            self.mark_served(key, user_id)
+        return value
+
+    def mark_served(self, key: str, user_id: int | None):
+        """Отметка, что значение отдано пользователю"""
+        item = self._items.get(key)
+        if user_id is None or item is None or user_id in item[2]:
+            return
+        value, expires_at, served = item
+        served = (served + (user_id,))[-MAX_SERVED:]
+        self._items[key] = (value, expires_at, served)
+        if self._db is not None:
+            self._db.execute("UPDATE results SET served = ? WHERE key = ?", (json.dumps(served), key))
+            self._db.commit()
+
+    def put(self, key: str, value: Any, ttl: float | None = None, user_id: int | None = None):
+        """Сохранение значения в памяти и, если настроено, на диске"""
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        served = () if user_id is None else (user_id,)
+        self._remember(key, value, expires_at, served)
+        if self._db is not None:
+            self._db.execute(
+                "INSERT OR REPLACE INTO results (key, value, expires_at, served) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), expires_at, json.dumps(served))
+            )
+            self._db.commit()
+
+    def _lookup(self, key: str) -> Optional[Tuple[Any, float, Tuple[int, ...]]]:
+        item = self._items.get(key)
+        now = time.time()
+        if item is not None:
+            if item[1] >= now:
+                self._items.move_to_end(key)
+                return item
+            del self._items[key]
+        if self._db is not None:
+            row = self._db.execute(
+                "SELECT value, expires_at, served FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row and row[1] >= now:
+                self._remember(key, json.loads(row[0]), row[1], tuple(json.loads(row[2])))
+                return self._items[key]
+        return None
+
+    def inflight(self, key: str) -> Optional[asyncio.Future]:
+        """Общий вызов, который уже выполняется для ключа"""
+        return self._inflight.get(key)
+
+    def start_flight(self, key: str) -> asyncio.Future:
+        """Регистрация выполняющегося вызова для ключа"""
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        return future
+
+    def finish_flight(
+        self,
+        key: str,
+        future: asyncio.Future,
+        value: Any = None,
+        error: BaseException | None = None,
+        ttl: float | None = None,
+        user_id: int | None = None
+    ):
+        """
+        Завершение вызова: сохранение результата и пробуждение ожидающих
+
+        Значение в обертке Uncached передается ожидающим без сохранения.
+        """
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+        if future.done():
+            return
+        if isinstance(error, asyncio.CancelledError):
+            future.cancel()
+            return
+        if error is not None:
+            future.set_exception(error)
+            # Исключение могут не забрать, если ожидающих не было
+            future.exception()
+            return
+        if isinstance(value, Uncached):
+            value = value.value
+        else:
+            self.put(key, value, ttl, user_id)
+        future.set_result(value)
+
+    async def join(self, future: asyncio.Future) -> Optional[Any]:
+        """
+        Ожидание общего вызова
+
+        Returns:
+            результат вызова или None, если вызов был отменен его владельцем
+        """
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if future.cancelled() and not asyncio.current_task().cancelling():
+                return None
+            raise
+
+    async def get_or_create(
+        self,
+        key: str,
+        factory: Callable[[], Awaitable[Any]],
+        ttl: float | None = None,
+        user_id: int | None = None
+    ) -> Any:
+        """
+        Значение из кеша или результат factory, выполненной один раз на ключ
+
+        Args:
+            key: ключ кеша
+            factory: фабрика корутины, вычисляющей значение (Uncached - не сохранять)
+            ttl: время жизни записи, сек
+            user_id: получатель; свой прежний результат ему не отдается
+        """
+        value = self.get(key, user_id)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        future = self.inflight(key)
+        while future is not None:
+            self.coalesced += 1
+            value = await self.join(future)
+            if value is not None:
+                self.mark_served(key, user_id)
+                return value
+            future = self.inflight(key)
+
+        self.misses += 1
+        future = self.start_flight(key)
+        try:
+            value = await factory()
+        except BaseException as e:
+            self.finish_flight(key, future, error=e)
+            raise
+        self.finish_flight(key, future, value, ttl=ttl, user_id=user_id)
+        return value.value if isinstance(value, Uncached) else value
+
+    def close(self):
+        """Закрытие базы данных"""
+        logger.info("Статистика кеша результатов: %s", self.stats())
+        if self._db is not None:
+            self._db.close()
+
+    def _remember(self, key: str, value: Any, expires_at: float, served: Tuple[int, ...] = ()):
+        self._items[key] = (value, expires_at, served)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
@@ -0,0 +1,354 @@
+"""
+Планировщик запросов к OpenAI: допуск, лимиты и справедливая очередь
+"""
+import asyncio
+import logging
+import time
+from contextvars import ContextVar
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+QueueCallback = Callable[[int], Awaitable[None]]
+
+# Оценка токенов запроса, выполняющегося в текущем слоте
+_slot_tokens: ContextVar[int] = ContextVar("slot_tokens", default=0)
+
+
+class Priority(IntEnum):
+    """Приоритет запроса: меньшее значение обслуживается раньше"""
+    ANALYSIS = 0
+    GREETING = 1
+    IMAGE = 2
+    SPECULATIVE = 3
+
+
+class QueueFullError(Exception):
+    """Очередь планировщика переполнена, запрос не принят"""
+
+
+@dataclass
+class ModelBudget:
+    """Лимиты для одной модели OpenAI"""
+    max_concurrency: int
+    rpm: int = 0  # запросов в минуту, 0 - без ограничения
+    tpm: int = 0  # токенов в минуту, 0 - без ограничения
+
+
+class _RateBucket:
+    """Корзина токенов с равномерным пополнением за минуту"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: int) -> float:
+        """Сколько секунд ждать, пока в корзине появится amount"""
+        if not self.capacity:
+            return 0.0
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: int):
+        if self.capacity:
+            self.tokens -= min(amount, self.capacity)
+
+
+class _ModelState:
+    """Текущее состояние лимитов модели"""
+
+    def __init__(self, budget: ModelBudget):
+        self.budget = budget
+        self.in_flight = 0
+        self.requests = _RateBucket(budget.rpm)
+        self.tokens = _RateBucket(budget.tpm)
+
+    def wait_time(self, tokens: int) -> float:
+        """0 - можно запускать сейчас, >0 - через сколько секунд, inf - нет свободного слота"""
+        if self.in_flight >= self.budget.max_concurrency:
+            return float("inf")
+        return max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+
+
+@dataclass
+class _Ticket:
+    """Заявка на выполнение запроса"""
+    user_id: int
+    model: str
+    priority: Priority
+    tokens: int
+    granted: asyncio.Future = field(repr=False)
+
+
+class AIScheduler:
+    """
+    Слой между обработчиками и AIService
+
+    Для каждой модели действуют свои лимиты параллельности, запросов
+    и токенов в минуту. Запросы, которые нельзя выполнить сразу, ждут
+    в ограниченной очереди: внутри одного приоритета пользователи
+    обслуживаются по кругу, дешёвый анализ идёт раньше генерации
+    текста, а генерация текста - раньше изображений.
+    """
+
+    def __init__(
+        self,
+        budgets: Dict[str, ModelBudget],
+        max_queue_size: int = 200,
+        max_user_queue: int = 3,
+        max_total_concurrency: int = 0
+    ):
+        """
+        Args:
+            budgets: лимиты по моделям
+            max_queue_size: максимальное число ожидающих запросов
+            max_user_queue: максимальное число ожидающих запросов одного пользователя
+            max_total_concurrency: общий лимит параллельных запросов, 0 - без ограничения
+        """
+        logger.info("Инициализация AIScheduler")
+        self._models = {model: _ModelState(budget) for model, budget in budgets.items()}
+        self._queues: Dict[Priority, "OrderedDict[int, Deque[_Ticket]]"] = {
+            priority: OrderedDict() for priority in Priority
+        }
+        self._queued = 0
+        self._in_flight = 0
+        self.max_queue_size = max_queue_size
+        self.max_user_queue = max_user_queue
+        self.max_total_concurrency = max_total_concurrency
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def queue_size(self) -> int:
+        """Число ожидающих запросов"""
+        return self._queued
+
+    @property
+    def in_flight(self) -> int:
+        """Число выполняющихся запросов"""
+        return self._in_flight
+
+    async def run(
+        self,
+        model: str,
+        user_id: int,
+        priority: Priority,
+        func: Callable[[], Awaitable[T]],
+        tokens: int = 0,
+        on_queued: Optional[QueueCallback] = None
+    ) -> T:
+        """
+        Выполнение запроса с учетом лимитов модели
+
+        Args:
+            model: модель OpenAI, к которой идет запрос
+            user_id: ID пользователя для справедливой очереди
+            priority: приоритет запроса
+            func: фабрика корутины с самим запросом
+            tokens: оценка числа токенов запроса (для лимита TPM)
+            on_queued: вызывается с позицией в очереди, если запрос пришлось отложить
+
+        Raises:
+            QueueFullError: если очередь переполнена
+        """
+        async with self.slot(model, user_id, priority, tokens, on_queued):
+            return await func()
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        model: str,
+        user_id: int,
+        priority: Priority,
+        tokens: int = 0,
+        on_queued: Optional[QueueCallback] = None
+    ) -> AsyncIterator[None]:
+        """
+        Занятие слота модели на время блока (например, потокового ответа)
+
+        Аргументы совпадают с run().
+        """
+        state = self._models.get(model)
+        if state is None:
+            yield
+            return
+
+        if not self._queued and self._can_start(state, tokens):
+            self._acquire(state, tokens)
+        else:
+            await self._wait_turn(model, user_id, priority, tokens, on_queued)
+
+        reset = _slot_tokens.set(tokens)
+        try:
+            yield
+        finally:
+            _slot_tokens.reset(reset)
+            self._release(state)
+
+    def try_acquire(self, model: str, tokens: Optional[int] = None) -> bool:
+        """
+        Занятие дополнительного слота модели без ожидания
+
+        Нужно для дублирующих (хеджирующих) запросов: слот выдается,
+        только если очередь пуста и лимиты параллельности, RPM и TPM
+        позволяют запустить запрос сейчас. Занятый слот возвращается
+        через release().
+
+        Args:
+            model: модель OpenAI
+            tokens: оценка токенов; по умолчанию - как у запроса в текущем слоте
+
+        Returns:
+            bool: False, если свободного слота сейчас нет
+        """
+        state = self._models.get(model)
+        if state is None:
+            return True
+        if tokens is None:
+            tokens = _slot_tokens.get()
+        if self._queued or not self._can_start(state, tokens):
+            return False
+        self._acquire(state, tokens)
+        return True
+
+    def release(self, model: str):
+        """Возврат слота, занятого через try_acquire()"""
+        state = self._models.get(model)
+        if state is not None:
+            self._release(state)
+
+    async def _wait_turn(
+        self,
+        model: str,
+        user_id: int,
+        priority: Priority,
+        tokens: int,
+        on_queued: Optional[QueueCallback]
+    ):
+        """Постановка заявки в очередь и ожидание её допуска"""
+        queue = self._queues[priority]
+        user_queue = queue.get(user_id)
+        if self._queued >= self.max_queue_size or (
+                user_queue and len(user_queue) >= self.max_user_queue):
+            logger.warning("Очередь переполнена, запрос к %s от %s отклонен", model, user_id)
+            raise QueueFullError(f"Очередь запросов к {model} переполнена")
+
+        ticket = _Ticket(user_id, model, priority, tokens,
+                         asyncio.get_running_loop().create_future())
+        if user_queue is None:
+            user_queue = queue[user_id] = deque()
+        user_queue.append(ticket)
+        self._queued += 1
+        position = self._position(ticket)
+        logger.debug("Запрос к %s от %s в очереди, позиция %s", model, user_id, position)
+        self._pump()
+
+        try:
+            if on_queued and not ticket.granted.done():
+                try:
+                    await on_queued(position)
+                except Exception as e:
+                    logger.error("Ошибка при уведомлении об очереди: %s", e, exc_info=True)
+            await ticket.granted
+        except asyncio.CancelledError:
+            if ticket.granted.done() and not ticket.granted.cancelled():
+                # Слот уже выдан, но запрос отменен - возвращаем слот
+                self._release(self._models[model])
+            else:
+                self._remove(ticket)
+            raise
+
+    def _position(self, ticket: _Ticket) -> int:
+        """Оценка позиции заявки: все заявки более высокого или равного приоритета"""
+        ahead = 0
+        for priority, queue in self._queues.items():
+            if priority < ticket.priority:
+                ahead += sum(len(user_queue) for user_queue in queue.values())
+            elif priority == ticket.priority:
+                ahead += sum(
+                    min(len(user_queue), len(queue[ticket.user_id]))
+                    for user_queue in queue.values()
+                )
+        return max(ahead, 1)
+
+    def _can_start(self, state: _ModelState, tokens: int) -> bool:
+        if self.max_total_concurrency and self._in_flight >= self.max_total_concurrency:
+            return False
+        return state.wait_time(tokens) == 0
+
+    def _acquire(self, state: _ModelState, tokens: int):
+        state.in_flight += 1
+        state.requests.consume(1)
+        state.tokens.consume(tokens)
+        self._in_flight += 1
+
+    def _release(self, state: _ModelState):
+        state.in_flight -= 1
+        self._in_flight -= 1
+        self._pump()
+
+    def _remove(self, ticket: _Ticket):
+        queue = self._queues[ticket.priority]
+        user_queue = queue.get(ticket.user_id)
+        if user_queue and ticket in user_queue:
+            user_queue.remove(ticket)
+            self._queued -= 1
+            if not user_queue:
+                del queue[ticket.user_id]
+
+    def _pump(self):
+        """Выдача слотов ожидающим заявкам по приоритету и по кругу пользователей"""
+        retry_after = float("inf")
+        while self._queued:
+            if self.max_total_concurrency and self._in_flight >= self.max_total_concurrency:
+                return
+            ticket, wait = self._next_ticket()
+            if ticket is None:
+                retry_after = wait
+                break
+            self._remove(ticket)
+            # Пользователь уходит в конец круга
+            queue = self._queues[ticket.priority]
+            if ticket.user_id in queue:
+                queue.move_to_end(ticket.user_id)
+            if ticket.granted.cancelled():
+                continue
+            self._acquire(self._models[ticket.model], ticket.tokens)
+            ticket.granted.set_result(None)
+
+        if retry_after != float("inf"):
+            self._schedule_wakeup(retry_after)
+
+    def _next_ticket(self) -> tuple[Optional[_Ticket], float]:
+        """Поиск первой заявки, которую можно запустить сейчас"""
+        min_wait = float("inf")
+        for priority in Priority:
+            for user_queue in self._queues[priority].values():
+                ticket = user_queue[0]
+                wait = self._models[ticket.model].wait_time(ticket.tokens)
+                if wait == 0:
+                    return ticket, 0.0
+                min_wait = min(min_wait, wait)
+        return None, min_wait
+
+    def _schedule_wakeup(self, delay: float):
+        """Повторная попытка после пополнения лимитов RPM/TPM"""
+        if self._wakeup and not self._wakeup.cancelled():
+            self._wakeup.cancel()
+        loop = asyncio.get_running_loop()
+        self._wakeup = loop.call_later(delay, self._pump)
@@ -0,0 +1,186 @@
+"""
+Упреждающая генерация поздравлений после обновления контекста
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, Optional
+from models.context import Context
+from services.content_generator import ContentGenerator
+from services.scheduler import Priority
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _Speculation:
+    """Упреждающая генерация для одного пользователя"""
+    key: str
+    task: Optional[asyncio.Task] = field(default=None, repr=False)
+    started: bool = False
+
+
+class SpeculativeGenerator:
+    """
+    Фоновая генерация поздравления до нажатия кнопки
+
+    После каждого обновления контекста запускается отложенная задача:
+    если резюме не меняется в течение delay секунд, генерируется текст
+    (и при необходимости изображение) с самым низким приоритетом
+    планировщика. Результат привязан к хешу нормализованного резюме или
+    фактов (Context.cache_key): новое резюме отменяет
+    старую задачу, а при нажатии кнопки результат отдается только если
+    хеш совпадает с текущим контекстом. Расходы ограничены числом
+    одновременных генераций и числом запусков в час.
+    """
+
+    def __init__(
+        self,
+        content_generator: ContentGenerator,
+        delay: float = 3.0,
+        with_image: bool = False,
+        max_inflight: int = 5,
+        max_per_hour: int = 60,
+        ttl: float = 900.0
+    ):
+        """
+        Args:
+            content_generator: генератор контента
+            delay: сколько секунд резюме должно не меняться перед запуском
+            with_image: генерировать ли заранее изображение
+            max_inflight: максимум одновременных упреждающих генераций
+            max_per_hour: максимум запусков упреждающей генерации в час
+            ttl: сколько секунд хранить готовый результат
+        """
+        logger.info("Инициализация SpeculativeGenerator")
+        self.content_generator = content_generator
+        self.delay = delay
+        self.with_image = with_image
+        self.max_inflight = max_inflight
+        self.max_per_hour = max_per_hour
+        self.ttl = ttl
+        self._entries: Dict[int, _Speculation] = {}
+        self._starts: Deque[float] = deque()
+        self._running = 0
+        self.hits = 0
+        self.misses = 0
+        self.discarded = 0
+
+    def schedule(self, user_id: int, context: Context):
+        """
+        Запуск упреждающей генерации для нового резюме
+
+        Если для этого резюме генерация уже запущена, ничего не делает.
+        """
+        if not context.summory:
+            return
+        key = context.cache_key()
+        entry = self._entries.get(user_id)
+        if entry and entry.key == key:
+            return
+        self.invalidate(user_id)
+
+        entry = _Speculation(key)
+        # Снимок резюме: контекст может измениться во время генерации
+        snapshot = context.snapshot()
+        entry.task = asyncio.create_task(self._run(user_id, entry, snapshot))
+        self._entries[user_id] = entry
+        logger.debug("Запланирована упреждающая генерация для пользователя %s", user_id)
+
+    def invalidate(self, user_id: int):
+        """Отмена и удаление упреждающей генерации пользователя"""
+        entry = self._entries.pop(user_id, None)
+        if entry is None:
+            return
+        if entry.task.done():
+            if not entry.task.cancelled() and entry.task.result():
+                self.discarded += 1
+        else:
+            entry.task.cancel()
+            if entry.started:
+                self.discarded += 1
+        logger.debug("Упреждающая генерация пользователя %s отменена", user_id)
+
+    async def take(self, user_id: int, context: Context) -> Optional[tuple[str, str | None]]:
+        """
+        Получение готового или почти готового результата для текущего контекста
+
+        Returns:
+            tuple | None: (текст, url_изображения или None) или None, если результата нет
+        """
+        entry = self._entries.get(user_id)
+        if (entry is None or not entry.started
+                or entry.key != context.cache_key()):
+            self.misses += 1
+            self.invalidate(user_id)
+            return None
+
+        del self._entries[user_id]
+        try:
+            result = await entry.task
+        except asyncio.CancelledError:
+            result = None
+        if result is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        logger.info(
+            f"Упреждающий результат отдан пользователю {user_id} "
+            f"(попаданий: {self.hits}, промахов: {self.misses}, впустую: {self.discarded})"
+        )
+        return result
+
+    def _allow(self) -> bool:
+        """Проверка бюджета упреждающих генераций"""
+        now = time.monotonic()
+        while self._starts and now - self._starts[0] > 3600:
+            self._starts.popleft()
+        if self._running >= self.max_inflight or len(self._starts) >= self.max_per_hour:
+            return False
+        self._starts.append(now)
+        return True
+
+    async def _run(
+        self,
+        user_id: int,
+        entry: _Speculation,
+        context: Context
+    ) -> Optional[tuple[str, str | None]]:
+        """Ожидание стабилизации резюме и генерация"""
+        await asyncio.sleep(self.delay)
+        if not self._allow():
+            logger.debug("Бюджет упреждающей генерации исчерпан, пользователь %s", user_id)
+            if self._entries.get(user_id) is entry:
+                del self._entries[user_id]
+            return None
+
+        entry.started = True
+        self._running += 1
+        try:
+            greeting_text = await self.content_generator.generate_greeting(
+                context, user_id, priority=Priority.SPECULATIVE
+            )
+            image_url = None
+            if self.with_image:
+                image_url = await self.content_generator.generate_image(
+                    greeting_text, user_id, priority=Priority.SPECULATIVE
+                )
+            logger.debug("Упреждающая генерация для пользователя %s завершена", user_id)
+            asyncio.get_running_loop().call_later(self.ttl, self._expire, user_id, entry)
+            return greeting_text, image_url
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Упреждающая генерация не удалась: %s", e)
+            if self._entries.get(user_id) is entry:
+                del self._entries[user_id]
+            return None
+        finally:
+            self._running -= 1
+
+    def _expire(self, user_id: int, entry: _Speculation):
+        """Удаление невостребованного результата по истечении ttl"""
+        if self._entries.get(user_id) is entry:
+            self.invalidate(user_id)
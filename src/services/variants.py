@@ -0,0 +1,241 @@
+"""
+Несколько вариантов поздравления за один запрос и выбор варианта пользователем
+"""
+import json
+import logging
+import sqlite3
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional, Tuple
+from models.context import Context
+from services.content_generator import ContentGenerator
+from services.scheduler import Priority, QueueCallback
+from utils.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+VARIANT_EVENTS = REGISTRY.counter(
+    "bot_greeting_variants_total", "События режима вариантов поздравления", ("event",)
+)
+
+
+@dataclass(slots=True)
+class VariantSet:
+    """Набор вариантов одного запроса"""
+    id: int
+    user_id: int
+    context_key: str
+    texts: List[str]
+    shown: int
+    chosen: Optional[int]
+    created_at: float
+
+    @property
+    def exhausted(self) -> bool:
+        """Все варианты уже показаны"""
+        return self.shown + 1 >= len(self.texts)
+
+
+class VariantStore:
+    """
+    Наборы вариантов в SQLite
+
+    У пользователя хранится только последний набор. Переход к следующему
+    варианту и выбор захватываются условными UPDATE, поэтому двойное
+    нажатие кнопки не пропускает вариант и не запускает вторую открытку,
+    а базу можно разделять между процессами (шарды, обработчик задач).
+    """
+
+    COLUMNS = "id, user_id, context_key, texts, shown, chosen, created_at"
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: путь к файлу базы данных
+        """
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS variant_sets ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, "
+            "context_key TEXT NOT NULL, texts TEXT NOT NULL, shown INTEGER NOT NULL, "
+            "chosen INTEGER, created_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS variant_sets_user ON variant_sets (user_id)")
+        self._db.commit()
+        logger.info("Хранилище вариантов поздравлений SQLite: %s", path)
+
+    def put(self, user_id: int, context_key: str, texts: List[str]) -> VariantSet:
+        """Новый набор вместо прежнего; первым показывается вариант 0"""
+        created_at = time.time()
+        self._db.execute("DELETE FROM variant_sets WHERE user_id = ?", (user_id,))
+        cursor = self._db.execute(
+            "INSERT INTO variant_sets (user_id, context_key, texts, shown, chosen, created_at) "
+            "VALUES (?, ?, ?, 0, NULL, ?)",
+            (user_id, context_key, json.dumps(texts, ensure_ascii=False), created_at)
+        )
+        self._db.commit()
+        return VariantSet(cursor.lastrowid, user_id, context_key, list(texts), 0, None, created_at)
+
+    def latest(self, user_id: int) -> Optional[VariantSet]:
+        row = self._db.execute(
+            f"SELECT {self.COLUMNS} FROM variant_sets WHERE user_id = ? ORDER BY id DESC LIMIT 1",
+            (user_id,)
+        ).fetchone()
+        return self._row(row)
+
+    def get(self, user_id: int, set_id: int) -> Optional[VariantSet]:
+        row = self._db.execute(
+            f"SELECT {self.COLUMNS} FROM variant_sets WHERE id = ? AND user_id = ?",
+            (set_id, user_id)
+        ).fetchone()
+        return self._row(row)
+
+    def advance(self, variant_set: VariantSet) -> bool:
+        """
+        Переход к следующему варианту
+
+        Returns:
+            bool: False, если вариант уже переключили или набор заменен
+        """
+        cursor = self._db.execute(
+            "UPDATE variant_sets SET shown = shown + 1 WHERE id = ? AND shown = ?",
+            (variant_set.id, variant_set.shown)
+        )
+        self._db.commit()
+        if cursor.rowcount:
+            variant_set.shown += 1
+        return cursor.rowcount > 0
+
+    def choose(self, variant_set: VariantSet, index: int) -> bool:
+        """
+        Отметка выбранного варианта
+
+        Returns:
+            bool: False, если этот вариант уже выбран
+        """
+        cursor = self._db.execute(
+            "UPDATE variant_sets SET chosen = ? WHERE id = ? AND chosen IS NOT ?",
+            (index, variant_set.id, index)
+        )
+        self._db.commit()
+        if cursor.rowcount:
+            variant_set.chosen = index
+        return cursor.rowcount > 0
+
+    def purge(self, before: float) -> int:
+        """Удаление наборов, созданных раньше before"""
+        cursor = self._db.execute("DELETE FROM variant_sets WHERE created_at < ?", (before,))
+        self._db.commit()
+        return cursor.rowcount
+
+    def close(self):
+        self._db.close()
+
+    @staticmethod
+    def _row(row) -> Optional[VariantSet]:
+        if not row:
+            return None
+        set_id, user_id, context_key, texts, shown, chosen, created_at = row
+        return VariantSet(set_id, user_id, context_key, json.loads(texts), shown, chosen, created_at)
+
+
+class GreetingVariants:
+    """
+    Режим вариантов поздравления
+
+    Вместо одного текста gpt-4o возвращает count вариантов в одном
+    ответе (параметр n): промпт оплачивается один раз, а следующий
+    вариант показывается мгновенно из хранилища. Открытка DALL-E 3
+    создается только для выбранного варианта, поэтому на отвергнутые
+    тексты изображения не тратятся. Повторное нажатие "Создать
+    поздравление" с тем же контекстом показывает следующий непоказанный
+    вариант без запроса к модели.
+    """
+
+    def __init__(self, content_generator: ContentGenerator, store: VariantStore, count: int = 3, ttl: float = 86400.0):
+        """
+        Args:
+            content_generator: генератор контента
+            store: хранилище наборов вариантов
+            count: вариантов в одном запросе
+            ttl: время жизни набора, сек
+        """
+        logger.info("Инициализация GreetingVariants: %s вариантов", count)
+        self.content_generator = content_generator
+        self.store = store
+        self.count = count
+        self.ttl = ttl
+
+    async def generate(
+        self,
+        user_id: int,
+        context: Context,
+        on_queued: Optional[QueueCallback] = None,
+        priority: Priority = Priority.GREETING
+    ) -> VariantSet:
+        """Новый набор вариантов; первый вариант считается показанным"""
+        texts = await self.content_generator.generate_greetings(
+            context, user_id, self.count, on_queued=on_queued, priority=priority
+        )
+        texts = [text.strip() for text in texts if text and text.strip()]
+        if not texts:
+            raise ValueError("Модель не вернула ни одного варианта поздравления")
+        self.store.purge(time.time() - self.ttl)
+        VARIANT_EVENTS.inc(len(texts), event="generated")
+        logger.info("Создано %s вариантов поздравления для пользователя %s", len(texts), user_id)
+        return self.store.put(user_id, context.cache_key(), texts)
+
+    def cached(self, user_id: int, context: Context) -> Optional[Tuple[VariantSet, int]]:
+        """
+        Следующий непоказанный вариант из набора для того же контекста
+
+        Returns:
+            tuple: (набор, номер варианта) или None, если нужен новый запрос
+        """
+        variant_set = self.store.latest(user_id)
+        if (variant_set is None or self._expired(variant_set)
+                or variant_set.context_key != context.cache_key()):
+            return None
+        return self._advance(variant_set)
+
+    def next(self, user_id: int, set_id: int) -> Optional[Tuple[VariantSet, int]]:
+        """
+        Следующий вариант набора по нажатию кнопки
+
+        Returns:
+            tuple: (набор, номер варианта) или None, если набор устарел,
+                заменен или показан целиком
+        """
+        variant_set = self.store.get(user_id, set_id)
+        if variant_set is None or self._expired(variant_set):
+            return None
+        return self._advance(variant_set)
+
+    def choose(self, user_id: int, set_id: int, index: int) -> Optional[str]:
+        """
+        Выбор варианта
+
+        Returns:
+            str: текст выбранного варианта или None, если набор устарел
+                или вариант уже выбран (повторное нажатие)
+        """
+        variant_set = self.store.get(user_id, set_id)
+        if variant_set is None or not 0 <= index < len(variant_set.texts):
+            return None
+        if not self.store.choose(variant_set, index):
+            return None
+        VARIANT_EVENTS.inc(event="chosen")
+        return variant_set.texts[index]
+
+    def _advance(self, variant_set: VariantSet) -> Optional[Tuple[VariantSet, int]]:
+        if variant_set.exhausted or not self.store.advance(variant_set):
+            return None
+        VARIANT_EVENTS.inc(event="cached")
+        return variant_set, variant_set.shown
+
+    def _expired(self, variant_set: VariantSet) -> bool:
+        return time.time() - variant_set.created_at > self.ttl
@@ -0,0 +1,264 @@
+"""
+Диагностика цикла событий: задержка планирования, блокирующие вызовы
+и сэмплирующий профилировщик
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+from utils.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG = REGISTRY.histogram(
+    "bot_loop_lag_seconds", "Задержка планирования цикла событий",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+LOOP_STALLS = REGISTRY.counter("bot_loop_stalls_total", "Блокировки цикла событий дольше порога")
+
+# Сколько строк профиля выводить в отчете
+PROFILE_TOP = 15
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def _collapse(frame) -> str:
+    """Стек в свернутом формате flamegraph (от корня к листу через ;)"""
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class LoopWatchdog:
+    """
+    Сторож цикла событий
+
+    Задача в цикле отмечается каждые interval секунд и измеряет, на
+    сколько ее пробуждение опоздало. Отдельный поток следит за
+    отметками: если цикл не отвечает дольше threshold, поток
+    сохраняет текущий стек потока цикла - это и есть блокирующий вызов.
+    """
+
+    def __init__(self, report_path: Path, threshold: float = 0.25, interval: float = 0.05):
+        """
+        Args:
+            report_path: файл отчетов о блокировках
+            threshold: длительность блокировки, после которой пишется отчет, сек
+            interval: период отметок, сек
+        """
+        self.report_path = report_path
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls = 0
+        self.max_lag = 0.0
+        self.thread_id: Optional[int] = None
+        self._beat = time.monotonic()
+        self._last_lag = 0.0
+        self._stall_beat: Optional[float] = None
+        self._stopped = threading.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Запуск из работающего цикла событий"""
+        self.thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._task = asyncio.create_task(self._tick(), name="loop-watchdog")
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._stopped.set()
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self._thread:
+            await asyncio.to_thread(self._thread.join, 1.0)
+
+    async def _tick(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            LOOP_LAG.observe(lag)
+            self.max_lag = max(self.max_lag, lag)
+            self._last_lag = lag
+            self._beat = now
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval / 2):
+            beat = self._beat
+            stalled = time.monotonic() - beat
+            if self._stall_beat is None:
+                if stalled > self.threshold + self.interval:
+                    self._stall_beat = beat
+                    self._report_stall(stalled)
+            elif beat != self._stall_beat:
+                # Цикл снова отвечает: отметка после блокировки содержит ее длительность
+                self._stall_beat = None
+                self._write(f"{_now()} цикл событий освободился, задержка {self._last_lag:.3f} с\n\n")
+
+    def _report_stall(self, stalled: float):
+        self.stalls += 1
+        LOOP_STALLS.inc()
+        frame = sys._current_frames().get(self.thread_id)
+        stack = "".join(traceback.format_stack(frame)) if frame else "(стек недоступен)\n"
+        logger.warning(f"Цикл событий заблокирован дольше {stalled:.3f} с, стек сохранен в {self.report_path}")
+        self._write(f"{_now()} цикл событий заблокирован {stalled:.3f} с, стек:\n{stack}")
+
+    def _write(self, text: str):
+        try:
+            with open(self.report_path, "a", encoding="utf-8") as report:
+                report.write(text)
+        except OSError as e:
+            logger.error(f"Не удалось записать отчет диагностики: {str(e)}")
+
+
+class SamplingProfiler:
+    """
+    Сэмплирующий профилировщик потока цикла событий
+
+    Стек потока снимается из отдельного потока через sys._current_frames(),
+    поэтому профилируемый код не замедляется инструментированием.
+    Результат сохраняется в свернутом формате (flamegraph.pl, speedscope).
+    """
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        """
+        Args:
+            thread_id: поток, который профилируется
+            interval: период снятия стека, сек
+        """
+        self.thread_id = thread_id
+        self.interval = interval
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    async def run(self, duration: float, report_path: Path) -> str:
+        """
+        Профилирование в течение duration секунд
+
+        Returns:
+            str: краткий отчет с самыми частыми функциями
+        """
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("Профилирование уже выполняется")
+        try:
+            stacks = await asyncio.to_thread(self._sample, duration)
+        finally:
+            self._lock.release()
+        await asyncio.to_thread(self._save, stacks, report_path)
+        return summarize(stacks)
+
+    def _sample(self, duration: float) -> Counter:
+        stacks: Counter = Counter()
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                stacks[_collapse(frame)] += 1
+            del frame
+            time.sleep(self.interval)
+        return stacks
+
+    @staticmethod
+    def _save(stacks: Counter, report_path: Path):
+        with open(report_path, "w", encoding="utf-8") as report:
+            for stack, count in stacks.most_common():
+                report.write(f"{stack} {count}\n")
+
+
+def summarize(stacks: Counter, top: int = PROFILE_TOP) -> str:
+    """Доли функций: собственное время (лист стека) и общее (вместе с вызванными)"""
+    total = sum(stacks.values())
+    if not total:
+        return "Нет данных"
+    own: Counter = Counter()
+    inclusive: Counter = Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(";")
+        own[frames[-1]] += count
+        for name in set(frames):
+            inclusive[name] += count
+    lines = [f"Сэмплов: {total}", "", "Собственное время:"]
+    lines += [f"{count / total:6.1%}  {name}" for name, count in own.most_common(top)]
+    lines += ["", "Общее время:"]
+    lines += [f"{count / total:6.1%}  {name}" for name, count in inclusive.most_common(top)]
+    return "\n".join(lines)
+
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec="milliseconds")
+
+
+class Diagnostics:
+    """Сторож цикла событий и профилировщик одного процесса"""
+
+    def __init__(
+        self,
+        directory: str = "data/diagnostics",
+        lag_threshold: float = 0.25,
+        profile_interval: float = 0.005,
+        name: str = "bot"
+    ):
+        """
+        Args:
+            directory: каталог отчетов
+            lag_threshold: длительность блокировки цикла для отчета, сек
+            profile_interval: период сэмплирования профилировщика, сек
+            name: имя процесса в именах файлов отчетов
+        """
+        logger.info("Инициализация Diagnostics")
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.name = name
+        self.watchdog = LoopWatchdog(self.directory / f"{name}-stalls.log", threshold=lag_threshold)
+        self.profile_interval = profile_interval
+        self.profiler: Optional[SamplingProfiler] = None
+
+    def start(self):
+        """Запуск сторожа (из работающего цикла событий)"""
+        self.watchdog.start()
+        self.profiler = SamplingProfiler(self.watchdog.thread_id, self.profile_interval)
+        logger.info(
+            f"Диагностика цикла событий запущена: порог {self.watchdog.threshold} с, "
+            f"отчеты в {self.directory}"
+        )
+
+    async def stop(self):
+        await self.watchdog.stop()
+
+    async def profile(self, duration: float) -> tuple[str, Path]:
+        """
+        Профилирование цикла событий
+
+        Returns:
+            tuple: (краткий отчет, файл со свернутыми стеками)
+        """
+        path = self.directory / f"{self.name}-profile-{datetime.now():%Y%m%d-%H%M%S}.folded"
+        summary = await self.profiler.run(duration, path)
+        logger.info(f"Профиль за {duration} с сохранен в {path}")
+        return summary, path
+
+    def stats(self) -> str:
+        """Сводка по задержкам цикла событий"""
+        return (
+            f"Блокировок дольше {self.watchdog.threshold} с: {self.watchdog.stalls}, "
+            f"максимальная задержка: {self.watchdog.max_lag:.3f} с"
+        )
@@ -1,28 +1,213 @@
 """
 Настройка логирования
+
+Записи из цикла событий только кладутся в очередь, форматирование и
+запись в поток или файл выполняет отдельный поток QueueListener.
+К каждой записи добавляются user_id и request_id текущего обновления
+Telegram или задачи генерации.
 """
+import atexit
+import json
 import logging
-from logging.handlers import RotatingFileHandler
+import queue
+import random
+import sys
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Any, Awaitable, Callable, Dict, Optional
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+from utils.metrics import REGISTRY
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s%(context)s"
+
+LOG_DROPPED = REGISTRY.counter("bot_log_dropped_total", "Записи журнала, отброшенные при переполнении очереди")
+
+# Контекст текущего обновления или задачи
+user_id_var: ContextVar[Optional[int]] = ContextVar("user_id", default=None)
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+_listener: Optional[QueueListener] = None
+
+
+@contextmanager
+def log_context(user_id: Optional[int] = None, request_id: Optional[str] = None):
+    """Привязка записей журнала к пользователю и запросу внутри блока"""
+    user_token = user_id_var.set(user_id)
+    request_token = request_id_var.set(request_id)
+    try:
+        yield
+    finally:
+        request_id_var.reset(request_token)
+        user_id_var.reset(user_token)
+
+
+class LogContextMiddleware(BaseMiddleware):
+    """Внешний middleware: user_id и id обновления для всех записей обработчиков"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        request_id = f"u{event.update_id}" if isinstance(event, Update) else None
+        with log_context(user.id if user else None, request_id):
+            return await handler(event, data)
 
-def setup_logger(name: str) -> logging.Logger:
+
+class AsyncQueueHandler(QueueHandler):
     """
-    Настройка логгера с ротацией файлов
+    Обработчик, который только ставит запись в очередь
+
+    В потоке вызова сообщение подставляется в шаблон и обрезается,
+    контекст копируется в запись; отладочные записи прореживаются.
+    При переполнении очереди запись отбрасывается, вызов не блокируется.
     """
-    logger = logging.getLogger(name)
-    logger.setLevel(logging.INFO)
-    
-    # Создание обработчика с ротацией файлов
-    handler = RotatingFileHandler(
-        'bot.log',
-        maxBytes=1024*1024,  # 1MB
-        backupCount=5
-    )
-    
-    # Формат сообщений
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+    def __init__(self, log_queue: queue.Queue, max_length: int = 2000, sample_rate: float = 1.0):
+        super().__init__(log_queue)
+        self.max_length = max_length
+        self.sample_rate = sample_rate
+
+    def prepare(self, record: logging.LogRecord) -> Optional[logging.LogRecord]:
+        if record.levelno <= logging.DEBUG and self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return None
+        message = record.getMessage()
+        if self.max_length and len(message) > self.max_length:
+            message = f"{message[:self.max_length]}... [+{len(message) - self.max_length} симв.]"
+        if record.exc_info and not record.exc_text:
+            # traceback нельзя передать в другой поток, текст формируется здесь
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = message
+        record.args = None
+        record.exc_info = None
+        record.user_id = user_id_var.get()
+        record.request_id = request_id_var.get()
+        return record
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            record = self.prepare(record)
+            if record is not None:
+                self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.inc()
+        except Exception:
+            self.handleError(record)
+
+
+class TextFormatter(logging.Formatter):
+    """Обычный текстовый формат, контекст дописывается в конец строки"""
+
+    def __init__(self):
+        super().__init__(TEXT_FORMAT)
+
+    def format(self, record: logging.LogRecord) -> str:
+        context = []
+        if getattr(record, "user_id", None) is not None:
+            context.append(f"user_id={record.user_id}")
+        if getattr(record, "request_id", None):
+            context.append(f"request_id={record.request_id}")
+        record.context = f" [{' '.join(context)}]" if context else ""
+        return super().format(record)
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - один JSON-объект в строке"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "user_id", None) is not None:
+            data["user_id"] = record.user_id
+        if getattr(record, "request_id", None):
+            data["request_id"] = record.request_id
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False)
+
+
+def _parse_levels(value: str) -> Dict[str, str]:
+    """Уровни модулей в формате "aiogram.event=WARNING,services.ai_service=DEBUG" """
+    levels = {}
+    for item in value.split(","):
+        name, _, level = item.strip().partition("=")
+        if name and level:
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging(
+    level: str = "INFO",
+    module_levels: str = "",
+    fmt: str = "text",
+    file: str = "",
+    max_length: int = 2000,
+    sample_rate: float = 1.0,
+    queue_size: int = 10000
+) -> QueueListener:
+    """
+    Настройка корневого логгера с записью в отдельном потоке
+
+    Args:
+        level: уровень корневого логгера
+        module_levels: уровни отдельных модулей, "имя=УРОВЕНЬ" через запятую
+        fmt: формат записей: text или json
+        file: файл журнала с ротацией (пусто - только stderr)
+        max_length: максимальная длина сообщения, символов (0 - без ограничения)
+        sample_rate: доля сохраняемых записей уровня DEBUG
+        queue_size: размер очереди записей
+    """
+    global _listener
+    stop_logging()
+
+    formatter = JsonFormatter() if fmt == "json" else TextFormatter()
+    handlers = [logging.StreamHandler(sys.stderr)]
+    if file:
+        handlers.append(RotatingFileHandler(file, maxBytes=10 * 1024 * 1024, backupCount=5, encoding="utf-8"))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue: queue.Queue = queue.Queue(queue_size)
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(AsyncQueueHandler(log_queue, max_length, sample_rate))
+    root.setLevel(level.upper())
+    for name, module_level in _parse_levels(module_levels).items():
+        logging.getLogger(name).setLevel(module_level)
+
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def setup_logging_from_config(config) -> QueueListener:
+    """Настройка логирования по Config"""
+    return setup_logging(
+        level=config.log_level,
+        module_levels=config.log_levels,
+        fmt=config.log_format,
+        file=config.log_file,
+        max_length=config.log_max_length,
+        sample_rate=config.log_sample_rate,
+        queue_size=config.log_queue_size
     )
-    handler.setFormatter(formatter)
-    
-    logger.addHandler(handler)
-    return logger
+
+
+def stop_logging():
+    """Запись оставшихся в очереди записей и остановка потока"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
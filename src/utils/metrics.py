@@ -0,0 +1,359 @@
+"""
+Метрики в формате Prometheus и (необязательно) трассировка OpenTelemetry
+"""
+import logging
+import math
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from aiohttp import web
+
+try:
+    from opentelemetry import trace as _otel_trace
+    _HAS_OTEL = True
+except ImportError:
+    _otel_trace = None
+    _HAS_OTEL = False
+
+logger = logging.getLogger(__name__)
+
+# Границы гистограмм задержек, сек
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    """Семейство метрик с метками"""
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик"""
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> Iterator[str]:
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+
+
+class Gauge(_Metric):
+    """
+    Текущее значение
+
+    Значение задается через set() или функцией, которая вызывается
+    при каждом чтении метрик (например, длина очереди).
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[LabelValues, float] = {}
+        self._callbacks: Dict[LabelValues, Callable[[], float]] = {}
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def set_function(self, func: Callable[[], float], **labels):
+        self._callbacks[self._key(labels)] = func
+
+    def remove(self, **labels):
+        key = self._key(labels)
+        self._values.pop(key, None)
+        self._callbacks.pop(key, None)
+
+    def samples(self) -> Iterator[str]:
+        values = dict(self._values)
+        for key, func in self._callbacks.items():
+            try:
+                values[key] = float(func())
+            except Exception as e:
+                logger.debug(f"Не удалось получить значение {self.name}: {str(e)}")
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    """Распределение значений по корзинам"""
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labels: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = LATENCY_BUCKETS
+    ):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = self._counts[key] = [0] * len(self.buckets)
+            self._sums[key] = 0.0
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+                break
+        self._sums[key] += value
+
+    def count(self, **labels) -> int:
+        return sum(self._counts.get(self._key(labels), ()))
+
+    @contextmanager
+    def time(self, **labels):
+        """Замер длительности блока"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> Iterator[str]:
+        for key in sorted(self._counts):
+            cumulative = 0
+            for bound, count in zip(self.buckets, self._counts[key]):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}"
+            labels = _format_labels(self.label_names, key)
+            yield f"{self.name}_sum{labels} {_format_value(self._sums[key])}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class MetricsRegistry:
+    """Набор метрик процесса"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labels))
+
+    def gauge(self, name: str, help_text: str, labels: Tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, help_text, labels))
+
+    def histogram(
+        self,
+        name: str,
+        help_text: str,
+        labels: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = LATENCY_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def render(self) -> str:
+        """Текст в формате Prometheus exposition"""
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# Обновления Telegram и обработчики
+UPDATES = REGISTRY.counter("bot_updates_total", "Обработанные обновления Telegram", ("type",))
+UPDATE_DELAY = REGISTRY.histogram(
+    "bot_update_delay_seconds", "Время от отправки сообщения до начала обработки", ("type",)
+)
+HANDLER_LATENCY = REGISTRY.histogram(
+    "bot_handler_seconds", "Длительность обработчиков aiogram", ("handler",)
+)
+HANDLER_ERRORS = REGISTRY.counter(
+    "bot_handler_errors_total", "Необработанные исключения в обработчиках", ("handler", "error")
+)
+PHOTO_SEND_LATENCY = REGISTRY.histogram(
+    "bot_photo_send_seconds", "Отправка открытки в Telegram", ("mode",)
+)
+
+# Вызовы OpenAI
+OPENAI_LATENCY = REGISTRY.histogram(
+    "openai_request_seconds", "Длительность вызовов OpenAI вместе с повторами", ("model", "operation")
+)
+OPENAI_STREAM_LATENCY = REGISTRY.histogram(
+    "openai_stream_seconds", "Длительность потокового ответа до последнего фрагмента", ("model",)
+)
+OPENAI_ERRORS = REGISTRY.counter(
+    "openai_errors_total", "Ошибки вызовов OpenAI", ("model", "operation", "error")
+)
+OPENAI_TOKENS = REGISTRY.counter(
+    "openai_tokens_total", "Токены по данным response.usage", ("model", "kind")
+)
+
+# Очереди
+JOB_LATENCY = REGISTRY.histogram(
+    "bot_job_seconds", "Длительность выполнения задач генерации", ("kind", "status")
+)
+QUEUE_DEPTH = REGISTRY.gauge("bot_queue_depth", "Число ожидающих элементов в очередях", ("queue",))
+
+
+def record_usage(model: str, usage: Any):
+    """Учет токенов из response.usage"""
+    if usage is None:
+        return
+    OPENAI_TOKENS.inc(getattr(usage, "prompt_tokens", 0) or 0, model=model, kind="prompt")
+    OPENAI_TOKENS.inc(getattr(usage, "completion_tokens", 0) or 0, model=model, kind="completion")
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", 0) if details else 0
+    if cached:
+        OPENAI_TOKENS.inc(cached, model=model, kind="cached")
+
+
+_tracing = False
+
+
+def enable_tracing():
+    """Включение спанов OpenTelemetry (если пакет установлен)"""
+    global _tracing
+    if not _HAS_OTEL:
+        logger.warning("Пакет opentelemetry-api не установлен, трассировка отключена")
+        return
+    _tracing = True
+    logger.info("Трассировка OpenTelemetry включена")
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Спан OpenTelemetry; без пакета или при выключенной трассировке ничего не делает"""
+    if not _tracing:
+        yield None
+        return
+    tracer = _otel_trace.get_tracer("memorabot")
+    with tracer.start_as_current_span(name, attributes={
+        key: value for key, value in attributes.items() if value is not None
+    }) as current:
+        yield current
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    Замер длительности обработчиков aiogram
+
+    Регистрируется как внутренний middleware наблюдателей (message,
+    callback_query): там известен выбранный обработчик.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        start = time.perf_counter()
+        try:
+            with span(f"handler {name}"):
+                return await handler(event, data)
+        except Exception as e:
+            HANDLER_ERRORS.inc(handler=name, error=type(e).__name__)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - start, handler=name)
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Счетчик обновлений и задержка доставки (внешний middleware dp.update)"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        update_type = getattr(event, "event_type", "unknown")
+        UPDATES.inc(type=update_type)
+        sent_at = getattr(getattr(event, "event", None), "date", None)
+        if sent_at is not None:
+            # Дата сообщения в Telegram с точностью до секунды
+            UPDATE_DELAY.observe(max(0.0, time.time() - sent_at.timestamp()), type=update_type)
+        return await handler(event, data)
+
+
+def install_middlewares(dp):
+    """Подключение middleware метрик к диспетчеру"""
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    dp.message.middleware(MetricsMiddleware())
+    dp.callback_query.middleware(MetricsMiddleware())
+
+
+class MetricsServer:
+    """Локальный HTTP-сервер с /metrics"""
+
+    def __init__(self, registry: MetricsRegistry = REGISTRY):
+        self.registry = registry
+        self._runner: Optional[web.AppRunner] = None
+        self.app = web.Application()
+        self.app.router.add_get("/metrics", self.handle)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        return web.Response(
+            body=self.registry.render().encode(),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+        )
+
+    async def start(self, host: str, port: int):
+        self._runner = web.AppRunner(self.app, handle_signals=False, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,51 @@
+"""
+Подсчет токенов без обращения к API
+"""
+import importlib.util
+import logging
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# Для русского текста в среднем выходит около трёх символов на токен
+CHARS_PER_TOKEN = 3
+
+_HAS_TIKTOKEN = importlib.util.find_spec("tiktoken") is not None
+
+
+@lru_cache(maxsize=None)
+def _encoding(model: str):
+    """Кодировщик tiktoken для модели (загружается один раз)"""
+    import tiktoken
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text: str, model: str = "gpt-4o-mini") -> int:
+    """
+    Число токенов в тексте
+
+    Если установлен пакет tiktoken, используется точный токенизатор модели,
+    иначе - оценка по числу символов.
+    """
+    if not text:
+        return 0
+    if _HAS_TIKTOKEN:
+        try:
+            return len(_encoding(model).encode(text))
+        except Exception as e:
+            logger.debug(f"tiktoken недоступен, используется оценка: {str(e)}")
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def estimate_tokens(*texts: str, completion: int = 0) -> int:
+    """
+    Оценка числа токенов запроса для лимитов планировщика
+
+    Args:
+        texts: тексты, входящие в запрос
+        completion: ожидаемое число токенов ответа
+    """
+    return sum(len(text) for text in texts if text) // CHARS_PER_TOKEN + completion
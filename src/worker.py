@@ -0,0 +1,50 @@
+"""
+Отдельный процесс обработки очереди задач генерации
+
+Запуск:
+    JOB_WORKERS=0 python src/main.py   # бот только ставит задачи
+    python src/worker.py               # задачи выполняются здесь
+"""
+import asyncio
+import dataclasses
+import logging
+import sys
+from pathlib import Path
+
+# Добавляем корневую директорию проекта в PYTHONPATH
+sys.path.append(str(Path(__file__).parent.parent))
+
+from src.bot.bot import create_bot, close_services, start_diagnostics
+from src.bot.webhook import install_stop_signals
+from src.config import DEFAULT_JOB_WORKERS, load_config
+# Без префикса src: контекст журнала должен быть общим с модулями бота
+from utils.logger import setup_logging_from_config
+
+logger = logging.getLogger(__name__)
+
+async def main():
+    """Работа пула обработчиков до сигнала остановки"""
+    config = load_config()
+    setup_logging_from_config(config)
+    if not config.job_queue_enabled:
+        logger.error("Очередь задач выключена (JOB_QUEUE_ENABLED=false)")
+        return
+    # В процессе бота JOB_WORKERS может быть 0, здесь обработчики нужны всегда
+    config = dataclasses.replace(config, job_workers=config.job_workers or DEFAULT_JOB_WORKERS)
+
+    diagnostics = start_diagnostics(config, name="worker") if config.diagnostics_enabled else None
+    bot, dp = await create_bot(config)
+    stop_event = asyncio.Event()
+    install_stop_signals(stop_event.set)
+    logger.info(f"Обработчик задач запущен: {config.job_workers} задач одновременно")
+    try:
+        await stop_event.wait()
+    finally:
+        await close_services(dp)
+        await bot.session.close()
+        if diagnostics:
+            await diagnostics.stop()
+        logger.info("Обработчик задач остановлен")
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,9 @@
+"""
+Общие настройки тестов: модули бота импортируются так же, как в src/main.py
+"""
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+sys.path.insert(0, str(ROOT / "benchmarks"))
@@ -0,0 +1,90 @@
+"""
+Менеджер контекста: сообщения не теряются, если очередь анализа переполнена,
+а очистка во время анализа не отменяется его результатом
+"""
+import asyncio
+import pytest
+from fake_openai import LatencyProfile, running
+from services.ai_service import AIService, ANALYSIS_MODEL
+from services.context_manager import ContextManager
+from services.scheduler import AIScheduler, ModelBudget, QueueFullError
+
+PROFILE = LatencyProfile(chat_latency=0.01, sigma=0, token_interval=0, completion_tokens=20)
+
+
+def _full_scheduler() -> AIScheduler:
+    """Планировщик, который не принимает ни одного запроса анализа"""
+    return AIScheduler({ANALYSIS_MODEL: ModelBudget(max_concurrency=0)}, max_queue_size=0)
+
+
+def _manager(base_url: str, quiet_window: float = 0.0) -> ContextManager:
+    service = AIService(api_key="test", http2=False, base_url=base_url)
+    return ContextManager(service, _full_scheduler(), quiet_window=quiet_window)
+
+
+def test_rejected_batch_is_analyzed_with_next_message():
+    async def scenario():
+        async with running(PROFILE) as (fake, base_url):
+            manager = _manager(base_url, quiet_window=0.05)
+            try:
+                results = await asyncio.gather(
+                    manager.update_context(1, "Маме 60 лет"),
+                    manager.update_context(1, "Она любит сад"),
+                    return_exceptions=True
+                )
+                assert results[0] is None
+                assert isinstance(results[1], QueueFullError)
+                assert manager.get_context(1) is None
+
+                manager.scheduler = AIScheduler({ANALYSIS_MODEL: ModelBudget(max_concurrency=1)})
+                context = await manager.update_context(1, "И внуков")
+                assert fake.calls[f"chat:{ANALYSIS_MODEL}"] == 1
+                return context
+            finally:
+                await manager.ai_service.close()
+
+    context = asyncio.run(scenario())
+    assert context.message_count == 3
+    assert context.recent_messages[-3:] == ("Маме 60 лет", "Она любит сад", "И внуков")
+
+
+def test_clear_context_drops_rejected_messages():
+    async def scenario():
+        async with running(PROFILE) as (_, base_url):
+            manager = _manager(base_url)
+            try:
+                with pytest.raises(QueueFullError):
+                    await manager.update_context(1, "Маме 60 лет")
+                manager.clear_context(1)
+                manager.scheduler = None
+                return await manager.update_context(1, "Папе 65 лет")
+            finally:
+                await manager.ai_service.close()
+
+    context = asyncio.run(scenario())
+    assert context.recent_messages == ("Папе 65 лет",)
+
+
+def test_clear_during_analysis_is_not_undone():
+    profile = LatencyProfile(chat_latency=0.2, sigma=0, token_interval=0, completion_tokens=20)
+
+    async def scenario():
+        async with running(profile) as (_, base_url):
+            service = AIService(api_key="test", http2=False, base_url=base_url)
+            manager = ContextManager(service)
+            try:
+                await manager.update_context(1, "Маму зовут Анна")
+                analysis = asyncio.ensure_future(manager.update_context(1, "Ей 60 лет"))
+                await asyncio.sleep(0.05)
+                manager.clear_context(1)
+                assert await analysis is None
+                assert manager.get_context(1) is None
+
+                # Следующее сообщение начинает новый контекст
+                context = await manager.update_context(1, "Папе 65 лет")
+                return context
+            finally:
+                await service.close()
+
+    context = asyncio.run(scenario())
+    assert context.recent_messages == ("Папе 65 лет",)
@@ -0,0 +1,54 @@
+"""
+Локальный фильтр сообщений: короткие сообщения с фактами должны уходить на анализ
+"""
+import pytest
+from bot.keyboards import BUTTON_ALIASES, BUTTON_CLEAR, BUTTON_COMMANDS, BUTTON_GENERATE
+from models.context import Context
+from services.prefilter import Action, MessagePrefilter
+
+# Короткие сообщения со сведениями о человеке или пожеланиями к поздравлению
+INFORMATIVE_MESSAGES = (
+    "хокку", "в стихах", "айтишник", "дача", "тамада", "мама", "коллега", "юбилей",
+    "рыбалка", "смешно", "официально", "на ты", "ей 30", "8 марта", "огород",
+    "поздравление маме", "поздравления", "поздравление для начальника",
+    "Маме 60 лет, любит сад", "сестра Оля, учитель",
+)
+
+
+@pytest.fixture(params=[False, True], ids=["rules", "classifier"])
+def prefilter(request) -> MessagePrefilter:
+    return MessagePrefilter(BUTTON_ALIASES, BUTTON_COMMANDS, classifier=request.param)
+
+
+@pytest.mark.parametrize("text", INFORMATIVE_MESSAGES)
+def test_informative_messages_are_analyzed(prefilter, text):
+    assert prefilter.check(text).action is Action.ANALYZE
+
+
+@pytest.mark.parametrize("text", ["ок", "спасибо", "👍👍", "Окееей!!!"])
+def test_smalltalk_is_skipped(prefilter, text):
+    assert prefilter.check(text).action is Action.SMALLTALK
+
+
+def test_duplicate_of_recent_message():
+    prefilter = MessagePrefilter(BUTTON_ALIASES, BUTTON_COMMANDS)
+    context = Context()
+    context.add_message("Маме 60 лет")
+    assert prefilter.check("маме 60 лет!", context).action is Action.DUPLICATE
+
+
+@pytest.mark.parametrize("text, button", [
+    ("создат поздравление", BUTTON_GENERATE),
+    ("создай поздравление", BUTTON_GENERATE),
+    ("очисти контекст", BUTTON_CLEAR),
+    ("/congratulaton", BUTTON_GENERATE),
+])
+def test_button_typos_and_aliases(prefilter, text, button):
+    decision = prefilter.check(text)
+    assert decision.action is Action.BUTTON
+    assert decision.button == button
+
+
+def test_alias_is_not_matched_fuzzily():
+    prefilter = MessagePrefilter(BUTTON_ALIASES, BUTTON_COMMANDS)
+    assert prefilter.check("создай поздравление маме").action is Action.ANALYZE
@@ -0,0 +1,71 @@
+"""
+Выбор варианта промпта: запрос к OpenAI использует тот же шаблон,
+что и ключ кеша, независимо от пользователя в контексте логирования
+"""
+import asyncio
+from fake_openai import LatencyProfile, running
+from models.context import Context
+from services.ai_service import AIService
+from services.content_generator import ContentGenerator
+from services.context_manager import ContextManager
+from services.prompts import PromptRegistry
+from services.result_cache import ResultCache
+from utils.logger import user_id_var
+
+PROFILE = LatencyProfile(chat_latency=0.01, sigma=0, token_interval=0, completion_tokens=20)
+
+
+def _users(prompts: PromptRegistry, name: str) -> tuple[int, int]:
+    """Два пользователя из разных групп A/B для шаблона name"""
+    variants = {}
+    user_id = 1
+    while len(variants) < 2:
+        variants.setdefault(prompts.select(name, user_id).key, user_id)
+        user_id += 1
+    return tuple(variants.values())
+
+
+def test_greeting_uses_template_of_cache_key_user():
+    prompts = PromptRegistry(ab_share=0.5)
+    user, other = _users(prompts, "greeting")
+    expected = prompts.select("greeting", user).key
+
+    async def scenario():
+        async with running(PROFILE) as (_, base_url):
+            service = AIService(api_key="test", http2=False, base_url=base_url, prompts=prompts)
+            generator = ContentGenerator(service, cache=ResultCache())
+            context = Context()
+            context.add_message("Поздравь маму с юбилеем")
+            # Контекст логирования принадлежит другому пользователю
+            token = user_id_var.set(other)
+            try:
+                await generator.generate_greeting(context, user_id=user)
+                async for _ in generator.stream_greeting(context, user_id=user):
+                    pass
+            finally:
+                user_id_var.reset(token)
+                await service.close()
+
+    asyncio.run(scenario())
+    assert set(prompts.stats()) == {expected}
+    assert prompts.stats()[expected]["calls"] == 2
+
+
+def test_analysis_uses_template_of_message_author():
+    prompts = PromptRegistry(ab_share=0.5)
+    user, other = _users(prompts, "analysis")
+    expected = prompts.select("analysis", user).key
+
+    async def scenario():
+        async with running(PROFILE) as (_, base_url):
+            service = AIService(api_key="test", http2=False, base_url=base_url, prompts=prompts)
+            manager = ContextManager(service, delta_mode=False)
+            token = user_id_var.set(other)
+            try:
+                await manager.update_context(user, "Маме 60 лет, любит сад")
+            finally:
+                user_id_var.reset(token)
+                await service.close()
+
+    asyncio.run(scenario())
+    assert set(prompts.stats()) == {expected}
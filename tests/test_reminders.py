@@ -0,0 +1,81 @@
+"""
+Доставка напоминаний: событие не пропускается на год при сбоях генерации и отправки
+"""
+import asyncio
+import time
+from datetime import datetime, timezone
+import pytest
+from services import reminders as reminders_module
+from services.reminders import Reminder, ReminderScheduler, ReminderStore
+
+
+class FailingGenerator:
+    """Генератор контента, который не может создать поздравление"""
+    assets = None
+
+    def __init__(self):
+        self.calls = 0
+
+    async def generate_content(self, context, user_id=0, on_queued=None):
+        self.calls += 1
+        raise RuntimeError("OpenAI недоступен")
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ReminderStore(str(tmp_path / "reminders.db"))
+    yield store
+    store.close()
+
+
+def _due_reminder(store: ReminderStore, next_at: float) -> Reminder:
+    reminder = Reminder(0, 1, 1, "День рождения мамы", 1, 1, None, "", next_at)
+    reminder.id = store.add(reminder)
+    return store.get(reminder.id)
+
+
+def _scheduler(store, generator, sent):
+    async def deliver(reminder, greeting, image):
+        sent.append(greeting)
+    return ReminderScheduler(store, generator, deliver, tz=timezone.utc)
+
+
+def test_generation_failure_is_retried_the_same_day(store, monkeypatch):
+    now = datetime.now(timezone.utc)
+    if now.hour >= 23:
+        pytest.skip("до конца дня меньше паузы повтора")
+    sent = []
+    reminder = _due_reminder(store, time.time() - 1)
+    scheduler = _scheduler(store, FailingGenerator(), sent)
+
+    assert store.lease_delivery(reminder, time.time() + 600)
+    asyncio.run(scheduler._deliver(reminder))
+
+    stored = store.get(reminder.id)
+    assert sent == []
+    # Событие осталось сегодня, а не перенеслось на следующий год
+    assert stored.next_at - time.time() <= reminders_module.DELIVERY_RETRY_DELAY + 1
+    assert store.lease_delivery(stored, time.time() + 600)
+
+
+def test_reminder_is_sent_without_greeting_at_day_end(store, monkeypatch):
+    # Следующий повтор пришелся бы на другой день
+    monkeypatch.setattr(reminders_module, "DELIVERY_RETRY_DELAY", 2 * 86400.0)
+    sent = []
+    reminder = _due_reminder(store, time.time() - 1)
+    scheduler = _scheduler(store, FailingGenerator(), sent)
+
+    asyncio.run(scheduler._deliver(reminder))
+
+    assert sent == [""]
+    # Доставленное событие перенесено на следующий год
+    assert store.get(reminder.id).next_at > time.time() + 86400
+
+
+def test_leased_delivery_is_taken_over_after_crash(store):
+    reminder = _due_reminder(store, time.time() - 1)
+    # Первый процесс захватил доставку и упал, не перенеся событие
+    assert store.lease_delivery(reminder, time.time() - 1)
+    assert store.get(reminder.id).next_at == reminder.next_at
+    assert store.lease_delivery(reminder, time.time() + 600)
+    assert not store.lease_delivery(reminder, time.time() + 600)
@@ -0,0 +1,98 @@
+"""
+Политика надежности: дублирующие запросы в лимитах планировщика и пробный вызов выключателя
+"""
+import asyncio
+from services.resilience import ModelPolicy, ResiliencePolicy
+from services.scheduler import AIScheduler, ModelBudget, Priority
+
+MODEL = "gpt-4o-mini"
+
+
+def _slow_call(started: list, in_flight: list, scheduler: AIScheduler):
+    async def func():
+        started.append(1)
+        in_flight.append(scheduler.in_flight)
+        await asyncio.sleep(0.2)
+        return "ok"
+    return func
+
+
+def _run(budget: ModelBudget):
+    scheduler = AIScheduler({MODEL: budget})
+    policy = ResiliencePolicy({MODEL: ModelPolicy(timeout=5, retries=0, hedge_after=0.05)},
+                              scheduler=scheduler)
+    started, in_flight = [], []
+    func = _slow_call(started, in_flight, scheduler)
+
+    async def scenario():
+        result = await scheduler.run(
+            MODEL, 1, Priority.ANALYSIS, lambda: policy.call(MODEL, func), tokens=100
+        )
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(scenario()) == "ok"
+    return scheduler, policy, started, in_flight
+
+
+def test_hedge_takes_second_slot_and_returns_it():
+    scheduler, policy, started, in_flight = _run(ModelBudget(max_concurrency=2))
+    assert len(started) == 2
+    assert policy.hedges == 1
+    assert in_flight == [1, 2]
+    assert scheduler.in_flight == 0
+
+
+def test_hedge_skipped_without_free_slot():
+    scheduler, policy, started, _ = _run(ModelBudget(max_concurrency=1))
+    assert len(started) == 1
+    assert policy.hedges == 0
+    assert policy.hedges_skipped == 1
+    assert scheduler.in_flight == 0
+
+
+def test_hedge_counts_against_rpm():
+    scheduler, policy, started, _ = _run(ModelBudget(max_concurrency=5, rpm=1))
+    assert len(started) == 1
+    assert policy.hedges_skipped == 1
+
+
+def test_hedge_counts_against_tpm():
+    scheduler, policy, started, _ = _run(ModelBudget(max_concurrency=5, tpm=150))
+    assert len(started) == 1
+    assert policy.hedges_skipped == 1
+
+
+def test_cancelled_half_open_probe_allows_next_call():
+    policy = ResiliencePolicy({MODEL: ModelPolicy(timeout=5, retries=0)},
+                              failure_threshold=1, reset_timeout=0.05)
+    breaker = policy.breaker(MODEL)
+
+    async def fail():
+        raise asyncio.TimeoutError()
+
+    async def hang():
+        await asyncio.sleep(10)
+
+    async def ok():
+        return "ok"
+
+    async def scenario():
+        try:
+            await policy.call(MODEL, fail)
+        except asyncio.TimeoutError:
+            pass
+        assert breaker.is_open
+        await asyncio.sleep(0.06)
+        probe = asyncio.ensure_future(policy.call(MODEL, hang))
+        await asyncio.sleep(0.01)
+        probe.cancel()
+        try:
+            await probe
+        except asyncio.CancelledError:
+            pass
+        # Отмененная проба не блокирует модель: следующий вызов - новая проба
+        return await policy.call(MODEL, ok)
+
+    assert asyncio.run(scenario()) == "ok"
+    assert not breaker.is_open
@@ -0,0 +1,177 @@
+"""
+Сценарии отказов OpenAI на benchmarks/fake_openai.py: Retry-After,
+автоматический выключатель и переключение gpt-4o -> gpt-4o-mini
+
+Коды ошибок задаются через FakeOpenAI.inject(), поэтому сценарии
+воспроизводимы; задержки профиля минимальные и без разброса.
+"""
+import asyncio
+import time
+import pytest
+from fake_openai import LatencyProfile, running
+from models.context import Context
+from services.ai_service import AIService, ANALYSIS_MODEL, GREETING_MODEL
+from services.content_generator import ContentGenerator
+from services.resilience import ModelPolicy, ResiliencePolicy
+from services.result_cache import ResultCache
+from services.scheduler import AIScheduler, ModelBudget, Priority
+
+PROFILE = LatencyProfile(chat_latency=0.01, sigma=0, token_interval=0, completion_tokens=20, retry_after_ms=400)
+PRIMARY = f"chat:{GREETING_MODEL}"
+FALLBACK = f"chat:{ANALYSIS_MODEL}"
+
+
+def _service(base_url: str, policy: ResiliencePolicy, fallback: bool = False) -> AIService:
+    return AIService(
+        api_key="test",
+        http2=False,
+        base_url=base_url,
+        policy=policy,
+        greeting_fallback_model=ANALYSIS_MODEL if fallback else None
+    )
+
+
+def _context() -> Context:
+    context = Context()
+    context.add_message("Поздравь коллегу Ивана с 30-летием, он любит рыбалку")
+    return context
+
+
+def test_rate_limit_retried_after_server_delay():
+    policy = ResiliencePolicy({GREETING_MODEL: ModelPolicy(timeout=10, retries=2)}, backoff=5.0)
+
+    async def scenario():
+        async with running(PROFILE) as (fake, base_url):
+            fake.inject(PRIMARY, [429])
+            service = _service(base_url, policy)
+            start = time.monotonic()
+            try:
+                _, model = await service.generate_greeting(_context())
+            finally:
+                await service.close()
+            return fake, model, time.monotonic() - start
+
+    fake, model, elapsed = asyncio.run(scenario())
+    assert model == GREETING_MODEL
+    assert fake.calls[PRIMARY] == 2
+    assert policy.retries == 1
+    # Пауза из retry-after-ms (0.4 с), а не экспоненциальная задержка (от 2.5 с)
+    assert 0.4 <= elapsed < 2.0
+
+
+def test_breaker_opens_and_recovers_through_half_open_probe():
+    policy = ResiliencePolicy(
+        {GREETING_MODEL: ModelPolicy(timeout=5, retries=0)},
+        failure_threshold=2, reset_timeout=0.3
+    )
+    breaker = policy.breaker(GREETING_MODEL)
+
+    async def scenario():
+        async with running(PROFILE) as (fake, base_url):
+            service = _service(base_url, policy)
+            try:
+                fake.inject(PRIMARY, [500, 500])
+                for _ in range(2):
+                    with pytest.raises(Exception):
+                        await service.generate_greeting(_context())
+                assert breaker.is_open
+
+                # Открытый выключатель отклоняет вызов без запроса к API
+                with pytest.raises(Exception, match="временно недоступна"):
+                    await service.generate_greeting(_context())
+                assert fake.calls[PRIMARY] == 2
+
+                # Неудачная пробная попытка снова открывает выключатель
+                await asyncio.sleep(0.35)
+                fake.inject(PRIMARY, [500])
+                with pytest.raises(Exception):
+                    await service.generate_greeting(_context())
+                assert breaker.is_open
+                assert fake.calls[PRIMARY] == 3
+
+                # Удачная пробная попытка закрывает его
+                await asyncio.sleep(0.35)
+                _, model = await service.generate_greeting(_context())
+                assert model == GREETING_MODEL
+                assert not breaker.is_open
+                assert fake.calls[PRIMARY] == 4
+            finally:
+                await service.close()
+
+    asyncio.run(scenario())
+
+
+def test_fallback_to_mini_is_served_but_not_cached():
+    policy = ResiliencePolicy(
+        {GREETING_MODEL: ModelPolicy(timeout=5, retries=1), ANALYSIS_MODEL: ModelPolicy(timeout=5)},
+        backoff=0.01, failure_threshold=2, reset_timeout=0.3
+    )
+
+    async def scenario():
+        async with running(PROFILE) as (fake, base_url):
+            service = _service(base_url, policy, fallback=True)
+            cache = ResultCache()
+            generator = ContentGenerator(service, cache=cache)
+            try:
+                fake.inject(PRIMARY, [500, 500])
+                degraded = await generator.generate_greeting(_context(), user_id=1)
+                assert fake.calls[PRIMARY] == 2
+                assert fake.calls[FALLBACK] == 1
+                assert policy.breaker(GREETING_MODEL).is_open
+
+                # Пока gpt-4o отключена, запросы сразу идут в gpt-4o-mini
+                await generator.generate_greeting(_context(), user_id=2)
+                assert fake.calls[PRIMARY] == 2
+                assert fake.calls[FALLBACK] == 2
+
+                # После восстановления ответ запасной модели не отдается из кеша
+                await asyncio.sleep(0.35)
+                primary = await generator.generate_greeting(_context(), user_id=3)
+                assert fake.calls[PRIMARY] == 3
+                cached = await generator.generate_greeting(_context(), user_id=4)
+                assert fake.calls[PRIMARY] == 3
+                return degraded, primary, cached
+            finally:
+                await service.close()
+
+    degraded, primary, cached = asyncio.run(scenario())
+    assert cached == primary
+    assert degraded != primary
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_fallback_waits_for_slot_of_fallback_model(streaming):
+    policy = ResiliencePolicy({GREETING_MODEL: ModelPolicy(timeout=5, retries=0)})
+    scheduler = AIScheduler({
+        GREETING_MODEL: ModelBudget(max_concurrency=1),
+        ANALYSIS_MODEL: ModelBudget(max_concurrency=1),
+    })
+
+    async def greeting(generator):
+        if not streaming:
+            return await generator.generate_greeting(_context(), user_id=1)
+        return "".join([chunk async for chunk in generator.stream_greeting(_context(), user_id=1)])
+
+    async def scenario():
+        async with running(PROFILE) as (fake, base_url):
+            service = _service(base_url, policy, fallback=True)
+            generator = ContentGenerator(service, scheduler)
+            try:
+                fake.inject(PRIMARY, [500])
+                # Слот gpt-4o-mini занят анализом другого пользователя
+                async with scheduler.slot(ANALYSIS_MODEL, 2, Priority.ANALYSIS):
+                    task = asyncio.ensure_future(greeting(generator))
+                    await asyncio.sleep(0.2)
+                    assert fake.calls[PRIMARY] == 1
+                    assert fake.calls[FALLBACK] == 0
+                    # Слот gpt-4o освобожден, запасной запрос ждет своей очереди
+                    assert scheduler.in_flight == 1
+                    assert scheduler.queue_size == 1
+                text = await task
+                assert fake.calls[FALLBACK] == 1
+                assert scheduler.in_flight == 0
+                return text
+            finally:
+                await service.close()
+
+    assert asyncio.run(scenario())
@@ -0,0 +1,73 @@
+"""
+Кеш результатов: повторный запрос того же пользователя дает новый результат
+"""
+import asyncio
+import itertools
+from services.result_cache import ResultCache, Uncached
+
+
+def _factory():
+    counter = itertools.count(1)
+
+    async def factory():
+        await asyncio.sleep(0.01)
+        return f"text {next(counter)}"
+    return factory
+
+
+def test_same_user_gets_new_result():
+    cache = ResultCache()
+    factory = _factory()
+
+    async def scenario():
+        first = await cache.get_or_create("key", factory, user_id=1)
+        other_user = await cache.get_or_create("key", factory, user_id=2)
+        again = await cache.get_or_create("key", factory, user_id=1)
+        return first, other_user, again
+
+    first, other_user, again = asyncio.run(scenario())
+    assert other_user == first
+    assert again != first
+    assert cache.stats()["repeats"] == 1
+
+
+def test_concurrent_requests_share_one_call():
+    cache = ResultCache()
+    factory = _factory()
+
+    async def scenario():
+        return await asyncio.gather(*(
+            cache.get_or_create("key", factory, user_id=user_id) for user_id in (1, 1, 2)
+        ))
+
+    assert len(set(asyncio.run(scenario()))) == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_served_users_survive_restart(tmp_path):
+    path = str(tmp_path / "results.sqlite3")
+    cache = ResultCache(db_path=path)
+    cache.put("key", "text", user_id=1)
+    cache.close()
+
+    cache = ResultCache(db_path=path)
+    assert cache.get("key", user_id=1) is None
+    assert cache.get("key", user_id=2) == "text"
+    cache.close()
+
+
+def test_without_user_behaves_as_plain_cache():
+    cache = ResultCache()
+    cache.put("key", "value")
+    assert cache.get("key") == "value"
+    assert cache.get("key") == "value"
+
+
+def test_uncached_result_is_returned_but_not_stored():
+    cache = ResultCache()
+
+    async def fallback():
+        return Uncached("fallback text")
+
+    assert asyncio.run(cache.get_or_create("key", fallback, user_id=1)) == "fallback text"
+    assert cache.get("key") is None